@@ -22,6 +22,47 @@ export async function fetchIAResponse({ userId, channel, text, history = [], sta
   return response.json();
 }
 
+/**
+ * Variante streaming de fetchIAResponse (Server-Sent Events).
+ * onDelta(texte) est appelé au fil de la génération ; la promesse résout
+ * avec la réponse complète (même format que fetchIAResponse).
+ */
+export async function streamIAResponse({ userId, channel, text, history = [], stage = 'greeting', metadata = {} }, onDelta) {
+  const response = await fetch(`${API_BASE}/api/ai/message/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ userId, channel, text, history, stage, metadata }),
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Erreur serveur: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+
+      if (event === 'delta') onDelta?.(data.text);
+      if (event === 'done') return data;
+      if (event === 'error') throw new Error(data.detail || 'Erreur serveur');
+    }
+  }
+
+  throw new Error('Flux interrompu');
+}
+
 /**
  * Récupère l'historique des messages d'un utilisateur sur un canal.
  * Appelé au chargement du ChatWidget.
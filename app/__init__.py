@@ -0,0 +1,9 @@
+from dotenv import load_dotenv
+
+# Variables d'environnement chargées une seule fois, avant tout module de l'application
+load_dotenv()
+
+from app.logging_config import setup_logging  # noqa: E402
+
+# Logs JSON non bloquants (thread d'écriture dédié), configurés avant tout module
+setup_logging()
@@ -0,0 +1,18 @@
+import asyncio
+from app.database import dispose_engines
+from app.services.archive_service import archive_expired, ARCHIVE_AFTER_DAYS
+from app.logging_config import get_logger
+
+log = get_logger("archive")
+
+
+async def main():
+    archived = await archive_expired()
+    log.info("archivage terminé", extra={"conversations": archived, "older_than_days": ARCHIVE_AFTER_DAYS})
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    # Archivage des conversations terminées, à planifier (ex: une fois par jour) :
+    #   python -m app.archive
+    asyncio.run(main())
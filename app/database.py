@@ -1,22 +1,147 @@
 import os
+import time
+import asyncio
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
-from dotenv import load_dotenv
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.logging_config import get_logger
 
-load_dotenv()
+log = get_logger("database")
 
-# Convertir l'URL psycopg2 en asyncpg
-DATABASE_URL = os.getenv("DATABASE_URL", "").replace(
-    "postgresql://", "postgresql+asyncpg://"
-).split("?")[0]  # Enlever les paramètres incompatibles avec asyncpg
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Cache de requêtes préparées asyncpg : 0 derrière PgBouncer en mode transaction
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# Paramètres libpq/psycopg2 sans équivalent côté asyncpg
+LIBPQ_ONLY_PARAMS = {"sslrootcert", "sslcert", "sslkey", "sslcrl", "connect_timeout", "target_session_attrs", "gssencmode", "channel_binding"}
 
-AsyncSessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
+
+def to_async_url(raw_url: str):
+    """
+    Convertit l'URL psycopg2 en asyncpg en gardant les paramètres utiles :
+    sslmode devient ssl, les paramètres propres à libpq sont retirés, les
+    autres (ssl, prepared_statement_cache_size...) sont transmis à asyncpg.
+    """
+    for prefix in ("postgres://", "postgresql://"):
+        if raw_url.startswith(prefix):
+            raw_url = "postgresql+asyncpg://" + raw_url[len(prefix):]
+    url = make_url(raw_url)
+    if url.drivername != "postgresql+asyncpg":
+        return url
+    query = dict(url.query)
+    if "sslmode" in query:
+        query.setdefault("ssl", query.pop("sslmode"))
+    for param in LIBPQ_ONLY_PARAMS:
+        query.pop(param, None)
+    query.setdefault("prepared_statement_cache_size", str(DB_STATEMENT_CACHE_SIZE))
+    return url.set(query=query)
+
+
+class PoolMetrics:
+    """Attente de checkout d'une connexion du pool (temps passé à attendre une connexion libre)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+def _instrumented_pool_class(metrics: PoolMetrics):
+    # Sous-classe dédiée : pool.recreate() (dispose) réutilise la classe et donc les métriques
+    class InstrumentedPool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except Exception:
+                metrics.timeouts += 1
+                raise
+            finally:
+                metrics.record(time.perf_counter() - started)
+
+    InstrumentedPool.metrics = metrics
+    return InstrumentedPool
+
+
+def build_engine(raw_url: str, name: str, read_only: bool = False):
+    url = to_async_url(raw_url)
+    if url.drivername != "postgresql+asyncpg":
+        # SQLite (bancs d'essai, dev local) : réglages de pool par défaut
+        return create_async_engine(url, echo=False)
+    server_settings = {"default_transaction_read_only": "on"} if read_only else {}
+    return create_async_engine(
+        url,
+        echo=False,
+        poolclass=_instrumented_pool_class(PoolMetrics(name)),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "command_timeout": DB_COMMAND_TIMEOUT,
+            "server_settings": server_settings,
+        },
+    )
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# Réplique en lecture pour les endpoints GET ; à défaut, la base principale
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+
+_engine = None
+_read_engine = None
+
+
+def get_engine():
+    """Moteur principal, créé au premier usage (pas à l'import)."""
+    global _engine
+    if _engine is None:
+        _engine = build_engine(DATABASE_URL, "primary")
+    return _engine
+
+
+def get_read_engine():
+    global _read_engine
+    if _read_engine is None:
+        _read_engine = build_engine(DATABASE_REPLICA_URL, "replica", read_only=True) if DATABASE_REPLICA_URL else get_engine()
+    return _read_engine
+
+
+class LazySessionFactory:
+    """sessionmaker lié au moteur au premier appel : AsyncSessionLocal() reste utilisable tel quel."""
+
+    def __init__(self, engine_getter):
+        self._engine_getter = engine_getter
+        self._factory = None
+
+    def __call__(self, **kwargs) -> AsyncSession:
+        if self._factory is None:
+            self._factory = sessionmaker(
+                bind=self._engine_getter(),
+                class_=AsyncSession,
+                expire_on_commit=False
+            )
+        return self._factory(**kwargs)
+
+
+AsyncSessionLocal = LazySessionFactory(get_engine)
+ReadSessionLocal = LazySessionFactory(get_read_engine)
 
 Base = declarative_base()
 
@@ -27,8 +152,164 @@ async def get_db():
         finally:
             await session.close()
 
+async def get_read_db():
+    """Session de lecture seule (réplique si DATABASE_REPLICA_URL est défini) pour les GET."""
+    async with ReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+def pool_stats() -> dict:
+    stats = {}
+    for engine in {id(e): e for e in (_engine, _read_engine) if e is not None}.values():
+        pool = engine.sync_engine.pool
+        metrics = getattr(pool, "metrics", None)
+        if metrics is None:
+            continue
+        stats[metrics.name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": metrics.checkouts,
+            "timeouts": metrics.timeouts,
+            "wait_avg_ms": round(metrics.wait_total / metrics.checkouts * 1000, 3) if metrics.checkouts else 0.0,
+            "wait_max_ms": round(metrics.wait_max * 1000, 3),
+        }
+    return stats
+
+async def check_db(timeout: float = 2.0) -> bool:
+    """Sonde de disponibilité : SELECT 1 sur la base principale."""
+    try:
+        async with get_engine().connect() as conn:
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout)
+        return True
+    except Exception:
+        return False
+
+async def dispose_engines():
+    for engine in {id(e): e for e in (_engine, _read_engine) if e is not None}.values():
+        await engine.dispose()
+
+# Colonnes ajoutées à des tables existantes : create_all ne modifie pas une table déjà créée
+def _foreign_key_upgrade(table: str, column: str, target: str, on_delete: str, code: str) -> str:
+    """Recrée la clé étrangère par défaut <table>_<column>_fkey avec ON DELETE, si elle ne l'a pas déjà."""
+    name = f"{table}_{column}_fkey"
+    return f"""
+    DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = '{name}' AND confdeltype <> '{code}') THEN
+            ALTER TABLE {table} DROP CONSTRAINT {name};
+            -- NOT VALID : l'ancienne contrainte garantissait déjà les lignes existantes, pas de parcours de la table
+            ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {target} ON DELETE {on_delete} NOT VALID;
+        END IF;
+    END $$"""
+
+SCHEMA_UPGRADES = [
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_upto TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS stage_changed_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS whatsapp_content_sid VARCHAR(64)",
+    "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS whatsapp_content_variables TEXT",
+    "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS messenger_tag VARCHAR(40)",
+    # messages.timestamp doublait created_at : ni lu ni écrit par le code, mais conservé (nullable)
+    # tant que des processus de la version précédente l'écrivent et le lisent pendant le déploiement.
+    # Valeur par défaut côté base (catalogue seul, pas de réécriture) pour les lignes insérées sans lui.
+    # Suppression dans une migration ultérieure, une fois backfill_message_created_at passé partout.
+    """
+    DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'messages' AND column_name = 'timestamp') THEN
+            ALTER TABLE messages ALTER COLUMN timestamp SET DEFAULT (now() AT TIME ZONE 'utc');
+        END IF;
+    END $$""",
+    # Suppression d'une conversation (archivage) : la base supprime ses messages, l'ORM ne les charge pas
+    _foreign_key_upgrade("messages", "conversation_id", "conversations(id)", "CASCADE", "c"),
+    _foreign_key_upgrade("email_threads", "conversation_id", "conversations(id)", "CASCADE", "c"),
+    _foreign_key_upgrade("campaign_deliveries", "conversation_id", "conversations(id)", "CASCADE", "c"),
+    _foreign_key_upgrade("payments", "conversation_id", "conversations(id)", "SET NULL", "n"),
+    # Table chaude à taille stable : l'espace des lignes archivées est récupéré tôt et réutilisé
+    "ALTER TABLE messages SET (autovacuum_vacuum_scale_factor = 0.05, autovacuum_analyze_scale_factor = 0.05)",
+    # Segments déjà compressés : pas de seconde compression TOAST, et substr() ne lit que les blocs utiles
+    "ALTER TABLE archive_segments ALTER COLUMN data SET STORAGE EXTERNAL",
+    # Doublons actifs par (user_id, channel) créés avant uq_conversations_active : seule la plus
+    # récente (celle que servait find_active_conversation) reste active, les autres sont closes
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_conversations_active') THEN
+            UPDATE conversations SET stage = 'completed'
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY user_id, channel ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
+                    ) AS position
+                    FROM conversations WHERE stage <> 'completed'
+                ) ranked
+                WHERE position > 1
+            );
+        END IF;
+    END $$""",
+]
+
+def _create_missing_indexes(sync_conn):
+    # create_all ne crée pas les index ajoutés à une table existante.
+    # Chaque index dans son savepoint : un index de performance impossible à
+    # poser ne bloque pas les autres. Un index unique porte une garantie
+    # (ex: une seule conversation active) : son échec fait échouer la migration.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with sync_conn.begin_nested():
+                    index.create(sync_conn, checkfirst=True)
+            except Exception as e:
+                if index.unique:
+                    log.error("index unique non créé, migration interrompue", extra={"index": index.name, "error": str(e).splitlines()[0]})
+                    raise
+                log.warning("index non créé", extra={"index": index.name, "error": str(e).splitlines()[0]})
+
+async def backfill_message_created_at(batch_size: int = 5000) -> int:
+    """
+    Reporte messages.timestamp dans created_at là où il manque, par lots de
+    batch_size lignes (parcours de la clé primaire), une transaction par lot :
+    pas de verrou long ni de parcours complet en une fois. Retourne le nombre
+    de lignes mises à jour. Sans colonne timestamp (hors PostgreSQL) : rien à faire.
+    """
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        return 0
+    async with engine.connect() as conn:
+        exists = (await conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'messages' AND column_name = 'timestamp'"
+        ))).scalar()
+    if not exists:
+        return 0
+
+    updated, last_id = 0, None
+    while True:
+        async with engine.begin() as conn:
+            if last_id is None:
+                page = conn.execute(text("SELECT id FROM messages ORDER BY id LIMIT :limit"), {"limit": batch_size})
+            else:
+                page = conn.execute(text("SELECT id FROM messages WHERE id > :last ORDER BY id LIMIT :limit"), {"last": last_id, "limit": batch_size})
+            ids = (await page).scalars().all()
+            if not ids:
+                break
+            result = await conn.execute(
+                text("UPDATE messages SET created_at = timestamp WHERE id = ANY(:ids) AND created_at IS NULL AND timestamp IS NOT NULL"),
+                {"ids": ids}
+            )
+            updated += result.rowcount
+            last_id = ids[-1]
+    if updated:
+        log.info("created_at des messages reporté", extra={"messages": updated})
+    return updated
+
 async def init_db():
-    """Crée toutes les tables au démarrage."""
-    async with engine.begin() as conn:
+    """Crée toutes les tables, colonnes et index manquants (commande : python -m app.migrate)."""
+    # Enregistre les modèles sur Base.metadata même hors de l'application (app.migrate)
+    from app import models_db  # noqa: F401
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    print("✅ Base de données initialisée")
\ No newline at end of file
+        if conn.dialect.name == "postgresql":
+            for statement in SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
+        await conn.run_sync(_create_missing_indexes)
+    log.info("base de données initialisée")
\ No newline at end of file
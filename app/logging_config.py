@@ -0,0 +1,191 @@
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (production, drains de logs) ou text (lecture en local)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Lignes en attente d'écriture ; au-delà, les nouvelles lignes sont abandonnées (jamais d'attente)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Part des lignes à fort volume (messages entrants, envois) effectivement écrites
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+conversation_id_var: ContextVar[Optional[str]] = ContextVar("conversation_id", default=None)
+
+# Attributs standard d'un LogRecord : tout le reste vient de extra={...}
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "conversation_id", "sample"}
+
+# Numéro explicite dans un texte libre : +229 59 08 55 40, whatsapp:+22959085540.
+# Une simple suite de chiffres n'est pas masquée : UUID, montants et compteurs restent lisibles.
+_PHONE = re.compile(r"\+\d[\d .-]{5,}(\d{2})\b")
+# Champs qui portent l'identifiant du client : tout nombre isolé de 6 chiffres et plus (numéro sans +, PSID...)
+_IDENTITY_FIELDS = {"user", "from", "to", "sender", "recipient"}
+_DIGITS = re.compile(r"(?<![\w-])\d{4,}(\d{2})(?![\w-])")
+_EMAIL = re.compile(r"\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})\b")
+
+
+def redact(value, identity: bool = False):
+    """
+    Masque numéros de téléphone (2 derniers chiffres gardés) et adresses email.
+    identity=True (champ user, from...) : masque aussi les identifiants numériques sans +.
+    """
+    if not isinstance(value, str):
+        return value
+    value = _PHONE.sub(lambda m: "***" + m.group(1), value)
+    if identity:
+        value = _DIGITS.sub(lambda m: "***" + m.group(1), value)
+    return _EMAIL.sub(lambda m: f"{m.group(1)}***@{m.group(2)}", value)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Côté appelant, avant la mise en file : échantillonnage, identifiants de
+    corrélation (lus dans les contextvars de la requête / du job) et masquage.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, "sample", None)
+        if sample is not None and record.levelno < logging.WARNING and random.random() >= sample:
+            return False
+        record.request_id = request_id_var.get()
+        record.conversation_id = conversation_id_var.get()
+        record.msg = redact(record.getMessage())
+        record.args = None
+        for key, value in list(vars(record).items()):
+            if key not in _RECORD_ATTRS:
+                setattr(record, key, redact(value, identity=key in _IDENTITY_FIELDS))
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler qui n'attend jamais : file pleine = ligne abandonnée et comptée."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Message déjà résolu par ContextFilter ; la trace est mise en texte ici,
+        # le thread d'écriture ne reçoit que des valeurs simples
+        if record.exc_info:
+            record.exc_text = redact(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par événement, dans le thread d'écriture."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.msg,
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        if record.conversation_id:
+            entry["conversation_id"] = record.conversation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in vars(record).items() if k not in _RECORD_ATTRS)
+        ids = " ".join(f"{k}={getattr(record, k)}" for k in ("request_id", "conversation_id") if getattr(record, k, None))
+        line = f"{record.levelname:<7} [{record.name}] {record.msg}"
+        return " ".join(part for part in (line, fields, ids) if part)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging():
+    """
+    Logger « pulsai » : les appels ne font que filtrer et mettre en file ;
+    le formatage et l'écriture sur stderr se font dans un thread dédié.
+    Idempotent.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger("pulsai")
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [handler]
+    root.propagate = False
+
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Vide la file puis arrête le thread d'écriture."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger enfant de « pulsai », ex: get_logger("whatsapp")."""
+    return logging.getLogger(f"pulsai.{name}")
+
+
+class RequestContextMiddleware:
+    """
+    Middleware ASGI : identifiant de requête repris de X-Request-ID (ou généré),
+    disponible pour tous les logs de la requête et renvoyé dans la réponse.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
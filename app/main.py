@@ -1,12 +1,30 @@
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import ai, channels, webhooks, payment
-from app.database import init_db
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.routers import ai, channels, webhooks, payment, analytics, campaigns as campaigns_router
+from app.database import init_db, pool_stats, check_db, dispose_engines
+from app.services.whatsapp_service import close_twilio_client
+from app.services.messenger_service import close_graph_client
+from app.services.email_service import close_smtp_pool, get_smtp_pool
+from app.services.payment_service import get_kkiapay_client, close_kkiapay_client, payment_stats
+from app.services.context_cache import context_cache
+from app.services.response_cache import response_cache
+from app.services.llm_provider import get_llm
+from app.services.admission import admission
+from app.services.campaign_service import campaigns
+from app.services.archive_service import archive_job
+from app.services.funnel_service import funnel
+from app.services.metrics import registry, MetricsMiddleware
+from app.services.http_cache import JSONResponse as FastJSONResponse
+from app.logging_config import RequestContextMiddleware
 
 app = FastAPI(
     title="PulsAI CRM Backend",
     description="Backend multi-canaux avec IA conversationnelle jusqu'au paiement",
-    version="1.0.0"
+    version="1.0.0",
+    # Sérialisation orjson (repli sur json si absent) pour toutes les réponses
+    default_response_class=FastJSONResponse
 )
 
 app.add_middleware(
@@ -16,15 +34,53 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Ajouté en dernier = exécuté en premier : l'identifiant de requête couvre toute la chaîne
+app.add_middleware(RequestContextMiddleware)
+
+# Le schéma est créé par `python -m app.migrate` (phase release) ; AUTO_MIGRATE=true pour le dev local
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    if AUTO_MIGRATE:
+        await init_db()
+    await webhooks.whatsapp_queue.start()
+    await payment.payment_queue.start()
+    await webhooks.messenger_executor.start()
+    await webhooks.email_executor.start()
+    await admission.start()
+    await funnel.start()
+    # Campagnes interrompues par le dernier arrêt : reprise au point de reprise
+    await campaigns.start()
+    await archive_job.start()
+    get_kkiapay_client()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Laisser les workers vider la file avant l'arrêt du dyno
+    await campaigns.stop()
+    await archive_job.stop()
+    await webhooks.whatsapp_queue.stop()
+    await payment.payment_queue.stop()
+    await webhooks.messenger_executor.stop()
+    await webhooks.email_executor.stop()
+    # Dernière écriture des compteurs de quota
+    await admission.stop()
+    # Dernière écriture des agrégats du funnel
+    await funnel.stop()
+    await close_twilio_client()
+    await close_graph_client()
+    await close_smtp_pool()
+    await close_kkiapay_client()
+    await dispose_engines()
 
 app.include_router(ai.router, prefix="/api/ai", tags=["IA"])
 app.include_router(channels.router, prefix="/api/channels", tags=["Canaux"])
 app.include_router(webhooks.router, prefix="/api/webhooks", tags=["Webhooks"])
 app.include_router(payment.router, prefix="/api/payment", tags=["Paiement"])
+app.include_router(campaigns_router.router, prefix="/api/campaigns", tags=["Campagnes"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["Analytique"])
 
 
 @app.get("/")
@@ -33,4 +89,76 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
\ No newline at end of file
+    """Liveness : le processus répond, sans toucher aux dépendances."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness : base de données joignable et au moins un fournisseur LLM configuré."""
+    database = await check_db()
+    providers = {p.name: p.configured() for p in get_llm().providers}
+    is_ready = database and any(providers.values())
+    return JSONResponse(
+        {"status": "ready" if is_ready else "unavailable", "database": database, "llm_providers": providers},
+        status_code=200 if is_ready else 503
+    )
+
+@app.get("/stats")
+def stats():
+    """Métriques internes : files de traitement et caches."""
+    return {
+        "queues": {
+            "whatsapp": webhooks.whatsapp_queue.stats(),
+            "payment": payment.payment_queue.stats(),
+            "messenger": webhooks.messenger_executor.stats(),
+            "email": webhooks.email_executor.stats()
+        },
+        "context_cache": context_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "llm": get_llm().stats(),
+        "admission": admission.stats(),
+        "campaigns": campaigns.stats(),
+        "archive": archive_job.stats(),
+        "funnel": funnel.stats(),
+        "db_pool": pool_stats(),
+        "kkiapay": payment_stats(),
+        "smtp": get_smtp_pool().stats()
+    }
+
+# ─────────────────────────────────────────────
+# MÉTRIQUES PROMETHEUS
+# ─────────────────────────────────────────────
+
+def _queues() -> dict:
+    return {
+        "whatsapp": webhooks.whatsapp_queue,
+        "payment": payment.payment_queue,
+        "messenger": webhooks.messenger_executor,
+        "email": webhooks.email_executor,
+    }
+
+registry.gauge_func(
+    "pulsai_queue_depth", "Jobs en attente par file", ("queue",),
+    lambda: {name: queue.depth() for name, queue in _queues().items()}
+)
+registry.gauge_func(
+    "pulsai_queue_in_flight", "Jobs en cours de traitement par file", ("queue",),
+    lambda: {name: queue.stats()["in_flight"] for name, queue in _queues().items()}
+)
+registry.gauge_func(
+    "pulsai_llm_backlog", "Appels LLM en cours ou en attente de créneau, par fournisseur", ("provider",),
+    lambda: {p.name: p.in_flight + p.waiting for p in get_llm().providers}
+)
+registry.gauge_func(
+    "pulsai_db_pool_checked_out", "Connexions du pool actuellement empruntées", ("pool",),
+    lambda: {name: pool["checked_out"] for name, pool in pool_stats().items()}
+)
+registry.gauge_func(
+    "pulsai_cache_hit_ratio", "Taux de hit des caches en mémoire", ("cache",),
+    lambda: {"context": context_cache.stats()["hit_rate"], "response": response_cache.stats()["hit_rate"]}
+)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Registre de métriques au format texte Prometheus."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
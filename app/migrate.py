@@ -0,0 +1,15 @@
+import asyncio
+from app.database import init_db, backfill_message_created_at, dispose_engines
+
+
+async def main():
+    await init_db()
+    # Hors de la transaction du schéma : lots courts, compatibles avec l'ancienne version encore en service
+    await backfill_message_created_at()
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    # Création / mise à niveau du schéma, hors du démarrage de l'application :
+    #   python -m app.migrate
+    asyncio.run(main())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict
 from enum import Enum
 
 class Channel(str, Enum):
@@ -54,4 +54,19 @@ class EmailWebhook(BaseModel):
 
 class MessengerWebhook(BaseModel):
     object: str
-    entry: Optional[List[dict]] = []
\ No newline at end of file
+    entry: Optional[List[dict]] = []
+
+
+class CampaignRequest(BaseModel):
+    name: str
+    stages: List[ConversationStage]
+    channels: List[Channel]
+    inactiveDays: int = 7            # Conversations sans activité depuis au moins N jours
+    template: str                    # Texte du message ({user_id}, {channel}, {stage}), ou consigne si useAi
+    useAi: bool = False
+    start: bool = True
+    # Conversations dont le dernier message client a plus de 24 h : seuls ces envois sont permis,
+    # sans eux l'envoi est ignoré (skipped)
+    whatsappContentSid: Optional[str] = None                 # Modèle WhatsApp approuvé (Twilio Content API)
+    whatsappContentVariables: Optional[Dict[str, str]] = None  # ex: {"1": "{user_id}"}, mêmes champs que template
+    messengerTag: Optional[Literal["ACCOUNT_UPDATE", "CONFIRMED_EVENT_UPDATE", "POST_PURCHASE_UPDATE", "HUMAN_AGENT"]] = None
@@ -1,6 +1,6 @@
 ﻿import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Enum as SAEnum
+from sqlalchemy import Column, String, Text, Date, DateTime, Integer, Boolean, LargeBinary, ForeignKey, Index, UniqueConstraint, Enum as SAEnum, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from app.database import Base
@@ -29,15 +29,177 @@ class Conversation(Base):
     stage = Column(SAEnum(StageEnum), default=StageEnum.greeting)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", order_by="Message.created_at")
+    # Entrée dans le stade actuel : temps passé par stade pour les agrégats du funnel
+    stage_changed_at = Column(DateTime, default=datetime.utcnow)
+    # Résumé glissant des tours sortis de la fenêtre du prompt, jusqu'au message daté summary_upto
+    summary = Column(Text, nullable=True)
+    summary_upto = Column(DateTime, nullable=True)
+    # passive_deletes : la suppression d'une conversation laisse la base supprimer ses messages (ON DELETE CASCADE) sans les charger
+    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True, order_by="Message.created_at")
+    __table_args__ = (
+        # Résolution de la conversation active à chaque message entrant
+        Index("ix_conversations_active_lookup", "user_id", "channel", "stage", "updated_at"),
+        # Au plus une conversation active par (user_id, channel), même entre plusieurs workers
+        Index(
+            "uq_conversations_active", "user_id", "channel", unique=True,
+            postgresql_where=text("stage <> 'completed'"),
+            sqlite_where=text("stage <> 'completed'")
+        ),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)
     content = Column(Text, nullable=False)
     channel = Column(SAEnum(ChannelEnum), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    timestamp = Column(DateTime, default=datetime.utcnow)
     conversation = relationship("Conversation", back_populates="messages")
+    __table_args__ = (
+        # Pagination keyset de l'historique d'une conversation
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
+
+class Payment(Base):
+    __tablename__ = "payments"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Contrainte unique : une relivraison du webhook KKiaPay ne crée pas de second paiement
+    transaction_id = Column(String(100), nullable=False, unique=True)
+    user_id = Column(String(100), nullable=True, index=True)
+    amount = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False)
+    # Le paiement survit à l'archivage de sa conversation
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Renseigné quand le pipeline a traité le paiement (stade, confirmation)
+    processed_at = Column(DateTime, nullable=True)
+
+class EmailThread(Base):
+    __tablename__ = "email_threads"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Message-ID <...> d'un email reçu ou envoyé : In-Reply-To / References d'une réponse y renvoient
+    message_id = Column(String(255), nullable=False, unique=True)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UsageCounter(Base):
+    __tablename__ = "usage_counters"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(String(100), nullable=False)
+    channel = Column(String(20), nullable=False)
+    # Mois du quota, ex: "2026-10"
+    period = Column(String(7), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (
+        # Cible des upserts par lots de l'admission, et somme mensuelle par utilisateur
+        UniqueConstraint("user_id", "period", "channel", name="uq_usage_counters_user_period_channel"),
+    )
+
+class Campaign(Base):
+    __tablename__ = "campaigns"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(100), nullable=False)
+    # Cible : stades et canaux séparés par des virgules, conversations inactives depuis avant `cutoff`
+    stages = Column(String(200), nullable=False)
+    channels = Column(String(200), nullable=False)
+    cutoff = Column(DateTime, nullable=False)
+    template = Column(Text, nullable=False)
+    # True : le template est une consigne transmise à l'IA, qui rédige chaque message
+    use_ai = Column(Boolean, nullable=False, default=False)
+    # Hors de la fenêtre de 24 h (dernier message du client plus ancien) : modèle WhatsApp approuvé
+    # (ContentSid Twilio, variables JSON rendues comme le template) et tag de message Messenger/Instagram
+    whatsapp_content_sid = Column(String(64), nullable=True)
+    whatsapp_content_variables = Column(Text, nullable=True)
+    messenger_tag = Column(String(40), nullable=True)
+    # pending, running, paused, completed, failed
+    status = Column(String(20), nullable=False, default="pending")
+    # Point de reprise : dernière conversation (ordre des id) dont l'envoi est réservé
+    checkpoint = Column(UUID(as_uuid=True), nullable=True)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class CampaignDelivery(Base):
+    __tablename__ = "campaign_deliveries"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    campaign_id = Column(UUID(as_uuid=True), ForeignKey("campaigns.id"), nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    # claimed (réservé, envoi en cours ou interrompu), sent, failed, skipped
+    status = Column(String(20), nullable=False, default="claimed")
+    error = Column(String(200), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        # Une conversation reçoit au plus un message par campagne, même après une reprise
+        UniqueConstraint("campaign_id", "conversation_id", name="uq_campaign_deliveries_campaign_conversation"),
+    )
+
+class ArchiveSegment(Base):
+    __tablename__ = "archive_segments"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Membres gzip concaténés, un par conversation (JSON lines des messages) ; jamais modifié après écriture
+    data = Column(LargeBinary, nullable=False)
+    conversations = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedConversation(Base):
+    __tablename__ = "archived_conversations"
+    # Même id que la conversation archivée
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id = Column(String(100), nullable=False)
+    channel = Column(String(20), nullable=False)
+    stage = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    message_count = Column(Integer, nullable=False)
+    # Position du membre gzip de la conversation dans son segment
+    segment_id = Column(UUID(as_uuid=True), ForeignKey("archive_segments.id"), nullable=False)
+    member_offset = Column(Integer, nullable=False)
+    member_length = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        # Historique archivé d'un (user_id, channel), le plus récent d'abord
+        Index("ix_archived_conversations_lookup", "user_id", "channel", "updated_at"),
+    )
+
+class FunnelDaily(Base):
+    __tablename__ = "funnel_daily"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    day = Column(Date, nullable=False)
+    channel = Column(String(20), nullable=False)
+    stage = Column(String(20), nullable=False)
+    # Conversations entrées dans le stade ce jour-là (création = entrée en greeting)
+    count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        UniqueConstraint("day", "channel", "stage", name="uq_funnel_daily_day_channel_stage"),
+    )
+
+class FunnelTransition(Base):
+    __tablename__ = "funnel_transitions"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    day = Column(Date, nullable=False)
+    channel = Column(String(20), nullable=False)
+    from_stage = Column(String(20), nullable=False)
+    to_stage = Column(String(20), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        UniqueConstraint("day", "channel", "from_stage", "to_stage", name="uq_funnel_transitions_day_channel_stages"),
+    )
+
+class FunnelStageDuration(Base):
+    __tablename__ = "funnel_stage_durations"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Jour de sortie du stade
+    day = Column(Date, nullable=False)
+    channel = Column(String(20), nullable=False)
+    stage = Column(String(20), nullable=False)
+    # Borne haute du bucket en secondes (funnel_service.DURATION_BUCKETS), 0 = au-delà
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        UniqueConstraint("day", "channel", "stage", "bucket", name="uq_funnel_stage_durations_day_channel_stage_bucket"),
+    )
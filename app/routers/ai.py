@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.schemas import AIMessageRequest
-from app.services.ai_service import get_ai_response, get_channel_history
-from app.database import get_db
+from app.services.ai_service import get_ai_response, stream_ai_response
+from app.services.conversation_service import get_conversation_page, find_active_conversation, find_history_version
+from app.services.http_cache import conditional, is_fresh, make_etag, not_modified, REVALIDATE
+from app.database import get_db, get_read_db, AsyncSessionLocal
 
 router = APIRouter()
 
@@ -23,18 +28,85 @@ async def send_message(request: AIMessageRequest, db: AsyncSession = Depends(get
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/message/stream")
+async def send_message_stream(request: AIMessageRequest):
+    """
+    Variante streaming de /message en Server-Sent Events :
+    - event "delta" : {"text": "..."} au fil de la génération
+    - event "done"  : la réponse complète (identique à /message), une fois persistée
+    - event "error" : {"detail": "..."}
+    """
+    async def events():
+        # Session ouverte dans le générateur : elle doit vivre jusqu'à la fin du flux
+        async with AsyncSessionLocal() as db:
+            try:
+                async for event, data in stream_ai_response(
+                    user_text=request.text,
+                    history=request.history or [],
+                    channel=request.channel.value,
+                    user_id=request.userId,
+                    stage=request.stage,
+                    metadata=request.metadata or {},
+                    db=db
+                ):
+                    yield _sse(event, {"text": data} if event == "delta" else data)
+            except Exception as e:
+                yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/messages/{user_id}/{channel}")
-async def get_messages(user_id: str, channel: str, limit: int = 50, db: AsyncSession = Depends(get_db)):
-    """Récupère l'historique des messages depuis PostgreSQL."""
+async def get_messages(
+    request: Request,
+    user_id: str,
+    channel: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    archived: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Récupère l'historique des messages depuis PostgreSQL, page par page.
+    Passer cursors.before (messages plus anciens) ou cursors.after (plus récents)
+    d'une réponse précédente pour naviguer dans les longs historiques.
+    archived=true : dernière conversation archivée (servie aussi quand il n'y a plus de conversation en base).
+    ETag dérivé de (conversation, updated_at, page) : un sondage sans changement
+    reçoit 304 après la seule lecture du validateur, sans lire les messages.
+    """
     try:
-        messages = await get_channel_history(user_id, channel, limit, db)
-        return {"messages": messages, "userId": user_id, "channel": channel}
+        version = await find_history_version(db, user_id, channel, archived)
+        etag = make_etag(version, limit, before, after, weak=True)
+        if is_fresh(request, etag):
+            return not_modified(etag, REVALIDATE)
+        live_id = version[0] if version and not version[2] else None
+        page = await get_conversation_page(
+            db, user_id, channel, limit, before=before, after=after,
+            archived=archived or live_id is None, conversation_id=live_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return conditional(request, {
+        "messages": page["messages"],
+        "userId": user_id,
+        "channel": channel,
+        "cursors": {"before": page["before"], "after": page["after"]},
+        "has_more": page["has_more"]
+    }, etag)
 
 @router.get("/stage/{user_id}/{channel}")
-async def get_stage(user_id: str, channel: str, db: AsyncSession = Depends(get_db)):
-    """Retourne le stade actuel de la conversation."""
-    from app.conversation_service import get_or_create_conversation
-    conversation = await get_or_create_conversation(db, user_id, channel)
-    return {"userId": user_id, "channel": channel, "stage": conversation.stage}
\ No newline at end of file
+async def get_stage(request: Request, user_id: str, channel: str, db: AsyncSession = Depends(get_read_db)):
+    """Retourne le stade actuel de la conversation (greeting si aucune conversation active) ; 304 si inchangé."""
+    conversation = await find_active_conversation(db, user_id, channel)
+    stage = conversation.stage if conversation else "greeting"
+    etag = make_etag(conversation.id, conversation.updated_at, weak=True) if conversation else make_etag("none", weak=True)
+    return conditional(request, {"userId": user_id, "channel": channel, "stage": getattr(stage, "value", stage)}, etag)
\ No newline at end of file
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_read_db
+from app.models_db import ChannelEnum
+from app.services.funnel_service import funnel_report
+
+router = APIRouter()
+
+
+@router.get("/funnel")
+async def get_funnel(
+    days: int = Query(7, ge=1, le=366),
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    channel: Optional[ChannelEnum] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Funnel de vente : entrées par stade, taux de conversion greeting -> completed,
+    transitions et temps passé par stade (p50/p90, en secondes).
+    Fenêtre = les `days` derniers jours (UTC), ou [since, until] si fournis.
+    Lu depuis les agrégats journaliers (écrits toutes les FUNNEL_FLUSH_INTERVAL secondes).
+    """
+    until = until or datetime.utcnow().date()
+    since = since or until - timedelta(days=days - 1)
+    if since > until:
+        raise HTTPException(status_code=400, detail="since doit précéder until")
+    return await funnel_report(db, since, until, channel.value if channel else None)
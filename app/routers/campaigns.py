@@ -0,0 +1,112 @@
+from fastapi import APIRouter, HTTPException, Depends
+from datetime import datetime, timedelta
+import json
+import uuid
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.security import require_admin
+from app.models_db import Campaign
+from app.models.schemas import CampaignRequest
+from app.services.campaign_service import campaigns
+from app.logging_config import get_logger
+
+# Envois de masse sur tous les canaux : réservé à l'administration
+router = APIRouter(dependencies=[Depends(require_admin)])
+log = get_logger("campaigns")
+
+
+def _campaign_view(campaign: Campaign, deliveries: dict = None) -> dict:
+    view = {
+        "id": str(campaign.id),
+        "name": campaign.name,
+        "status": campaign.status,
+        "stages": campaign.stages.split(","),
+        "channels": campaign.channels.split(","),
+        "cutoff": campaign.cutoff.isoformat(),
+        "useAi": campaign.use_ai,
+        "whatsappContentSid": campaign.whatsapp_content_sid,
+        "messengerTag": campaign.messenger_tag,
+        "sent": campaign.sent,
+        "failed": campaign.failed,
+        "skipped": campaign.skipped,
+        "running": campaigns.is_running(campaign.id),
+        "createdAt": campaign.created_at.isoformat() if campaign.created_at else None,
+        "finishedAt": campaign.finished_at.isoformat() if campaign.finished_at else None,
+    }
+    if deliveries is not None:
+        view["deliveries"] = deliveries
+    return view
+
+
+async def _get_campaign(db: AsyncSession, campaign_id: str) -> Campaign:
+    try:
+        campaign = await db.get(Campaign, uuid.UUID(campaign_id))
+    except ValueError:
+        campaign = None
+    if not campaign:
+        raise HTTPException(status_code=404, detail=f"Campagne '{campaign_id}' introuvable")
+    return campaign
+
+
+@router.post("/")
+async def create_campaign(request: CampaignRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Crée une campagne de relance : conversations aux stades et canaux donnés,
+    sans activité depuis inactiveDays jours. La cible est figée à la création
+    (date limite calculée une fois) ; l'envoi part en tâche de fond si start.
+    Conversations WhatsApp / Messenger / Instagram dont le dernier message client
+    a plus de 24 h : whatsappContentSid / messengerTag, sinon envoi ignoré.
+    """
+    if not request.stages or not request.channels:
+        raise HTTPException(status_code=400, detail="stages et channels sont requis")
+    campaign = Campaign(
+        name=request.name,
+        stages=",".join(s.value for s in request.stages),
+        channels=",".join(c.value for c in request.channels),
+        cutoff=datetime.utcnow() - timedelta(days=request.inactiveDays),
+        template=request.template,
+        use_ai=request.useAi,
+        whatsapp_content_sid=request.whatsappContentSid,
+        whatsapp_content_variables=json.dumps(request.whatsappContentVariables) if request.whatsappContentVariables else None,
+        messenger_tag=request.messengerTag,
+        status="running" if request.start else "pending",
+    )
+    db.add(campaign)
+    await db.commit()
+    if request.start:
+        campaigns.launch(campaign.id)
+    log.info("campagne créée", extra={"campaign_id": str(campaign.id), "channels": campaign.channels, "stages": campaign.stages})
+    return _campaign_view(campaign)
+
+
+@router.get("/{campaign_id}")
+async def get_campaign(campaign_id: str, db: AsyncSession = Depends(get_db)):
+    """Avancement : compteurs écrits à chaque page, et envois par statut."""
+    campaign = await _get_campaign(db, campaign_id)
+    return _campaign_view(campaign, await campaigns.deliveries(db, campaign.id))
+
+
+@router.post("/{campaign_id}/pause")
+async def pause_campaign(campaign_id: str, db: AsyncSession = Depends(get_db)):
+    """Suspend la campagne ; les envois de la page en cours se terminent."""
+    campaign = await _get_campaign(db, campaign_id)
+    if campaign.status not in ("running", "pending"):
+        raise HTTPException(status_code=409, detail=f"Campagne {campaign.status}")
+    await db.execute(update(Campaign).where(Campaign.id == campaign.id).values(status="paused"))
+    await db.commit()
+    campaign.status = "paused"
+    return _campaign_view(campaign)
+
+
+@router.post("/{campaign_id}/resume")
+async def resume_campaign(campaign_id: str, db: AsyncSession = Depends(get_db)):
+    """Démarre ou reprend la campagne depuis son dernier point de reprise."""
+    campaign = await _get_campaign(db, campaign_id)
+    if campaign.status == "completed":
+        raise HTTPException(status_code=409, detail="Campagne terminée")
+    await db.execute(update(Campaign).where(Campaign.id == campaign.id).values(status="running"))
+    await db.commit()
+    campaign.status = "running"
+    campaigns.launch(campaign.id)
+    return _campaign_view(campaign)
@@ -1,4 +1,5 @@
-﻿from fastapi import APIRouter, HTTPException
+﻿from fastapi import APIRouter, HTTPException, Request
+from app.services.http_cache import StaticJSON
 
 router = APIRouter()
 
@@ -10,13 +11,20 @@ SUPPORTED_CHANNELS = [
     {"id": "instagram", "label": "Instagram", "icon": "camera", "active": True},
 ]
 
+# Catalogue figé : corps et ETag calculés une fois au démarrage
+_CHANNELS = StaticJSON({"channels": SUPPORTED_CHANNELS})
+_STATUSES = {
+    ch["id"]: StaticJSON({"channel": ch["id"], "status": "active", "connected": ch["active"]})
+    for ch in SUPPORTED_CHANNELS
+}
+
 @router.get("/")
-def list_channels():
-    return {"channels": SUPPORTED_CHANNELS}
+def list_channels(request: Request):
+    return _CHANNELS.response(request)
 
 @router.get("/{channel}/status")
-def channel_status(channel: str):
-    ch = next((c for c in SUPPORTED_CHANNELS if c["id"] == channel), None)
-    if not ch:
+def channel_status(channel: str, request: Request):
+    status = _STATUSES.get(channel)
+    if not status:
         raise HTTPException(status_code=404, detail=f"Canal '{channel}' inconnu")
-    return {"channel": channel, "status": "active", "connected": ch["active"]}
+    return status.response(request)
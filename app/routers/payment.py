@@ -1,12 +1,30 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
-from app.services.payment_service import generate_payment_url, verify_payment, verify_webhook_signature
+from app.database import get_db, AsyncSessionLocal
+from app.models_db import Payment
+from app.services.payment_service import (
+    generate_payment_url,
+    verify_payment,
+    verify_webhook_signature,
+    remember_status,
+    TERMINAL_STATUSES
+)
+from app.services.conversation_service import find_latest_active_conversation, close_sale
+from app.services.job_queue import JobQueue, QueueFullError
+from app.services.admission import admission
+from app.services.whatsapp_service import send_whatsapp_message
+from app.services.http_cache import StaticJSON
+from app.logging_config import get_logger, conversation_id_var
 import json
+import os
 
 router = APIRouter()
+log = get_logger("payment")
 
 class PaymentRequest(BaseModel):
     userId: str
@@ -71,11 +89,83 @@ async def verify(request: PaymentVerifyRequest):
 # WEBHOOK KKIAPAY (confirmation automatique)
 # ─────────────────────────────────────────────
 
+PAYMENT_CONFIRMATION = "✅ Paiement de {amount} FCFA bien reçu, merci ! Votre accès PulsAI est activé."
+
+
+async def process_payment_event(job: dict):
+    """
+    Pipeline asynchrone d'un paiement KKiaPay réussi : conversation passée en
+    completed, confirmation enregistrée puis envoyée sur le canal du client.
+    Idempotent : le paiement est « réservé » par un UPDATE conditionnel sur
+    processed_at, une relivraison déjà traitée ne fait rien. Seul un
+    événement SUCCESS réserve le paiement : un PENDING reçu avant ne
+    bloque pas la confirmation qui suit.
+    """
+    transaction_id = job["transaction_id"]
+    if job["status"] != "SUCCESS" or not job["user_id"]:
+        return
+    async with AsyncSessionLocal() as db:
+        claimed = await db.execute(
+            update(Payment)
+            .where(Payment.transaction_id == transaction_id)
+            .where(Payment.processed_at.is_(None))
+            .values(processed_at=datetime.utcnow())
+        )
+        await db.commit()
+        if claimed.rowcount == 0:
+            return
+
+        try:
+            # Nouveau plan (quota) pris en compte dès le prochain message
+            admission.forget(job["user_id"])
+            conversation = await find_latest_active_conversation(db, job["user_id"])
+            if not conversation:
+                log.warning("paiement sans conversation active", extra={"transaction_id": transaction_id, "user": job["user_id"]})
+                return
+
+            conversation_id_var.set(str(conversation.id))
+            channel = conversation.channel.value
+            confirmation = PAYMENT_CONFIRMATION.format(amount=job["amount"])
+            await db.execute(
+                update(Payment)
+                .where(Payment.transaction_id == transaction_id)
+                .values(conversation_id=conversation.id)
+            )
+            await close_sale(db, conversation.id, channel, confirmation,
+                             previous_stage=conversation.stage, stage_since=conversation.stage_changed_at)
+
+            # Web : la confirmation apparaît dans l'historique ; WhatsApp : envoi direct
+            if channel == "whatsapp":
+                await send_whatsapp_message(job["user_id"], confirmation)
+            log.info("paiement confirmé", extra={"transaction_id": transaction_id, "user": job["user_id"], "amount": job["amount"]})
+        except Exception:
+            # Libère la réservation : la prochaine relivraison retentera
+            await db.rollback()
+            await db.execute(
+                update(Payment)
+                .where(Payment.transaction_id == transaction_id)
+                .values(processed_at=None)
+            )
+            await db.commit()
+            raise
+
+
+payment_queue = JobQueue(
+    "payment",
+    process_payment_event,
+    workers=int(os.getenv("PAYMENT_WORKERS", "2")),
+    maxsize=int(os.getenv("PAYMENT_QUEUE_MAXSIZE", "1000")),
+)
+
+
 @router.post("/webhook")
 async def kkiapay_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Reçoit les confirmations de paiement de KKiaPay.
     KKiaPay appelle cet endpoint automatiquement après chaque paiement.
+    Le paiement est enregistré (unique par transactionId) et acquitté tout de
+    suite ; la mise à jour de la conversation et la confirmation client se
+    font dans le pipeline asynchrone.
     """
     body = await request.body()
     signature = request.headers.get("x-kkiapay-signature", "")
@@ -90,11 +180,44 @@ async def kkiapay_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     amount = data.get("amount")
     user_id = data.get("data")  # userId passé lors de la création
 
-    print(f"[KKiaPay] Transaction {transaction_id} | Statut: {status} | Montant: {amount} FCFA | User: {user_id}")
+    log.info("webhook reçu", extra={"transaction_id": transaction_id, "status": status, "amount": amount, "user": user_id})
+
+    if not transaction_id or not status:
+        raise HTTPException(status_code=400, detail="transactionId et status requis")
+
+    if status in TERMINAL_STATUSES:
+        remember_status(transaction_id, {"status": status, "amount": amount, "transactionId": transaction_id})
+
+    db.add(Payment(transaction_id=transaction_id, user_id=user_id, amount=amount, status=status))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Relivraison : déjà enregistré. Le statut suit le dernier événement (sans
+        # revenir en arrière après SUCCESS) ; on ne relance le pipeline que s'il n'a pas abouti.
+        await db.rollback()
+        await db.execute(
+            update(Payment)
+            .where(Payment.transaction_id == transaction_id)
+            .where(Payment.status != "SUCCESS")
+            .values(status=status)
+        )
+        await db.commit()
+        result = await db.execute(select(Payment.processed_at).where(Payment.transaction_id == transaction_id))
+        if result.scalar() is not None:
+            return {"received": True, "duplicate": True}
 
-    if status == "SUCCESS":
-        # TODO: Mettre à jour la conversation en DB, envoyer confirmation WhatsApp
-        print(f"[KKiaPay] ✅ Paiement confirmé pour {user_id} — {amount} FCFA")
+    if status != "SUCCESS":
+        return {"received": True}
+
+    try:
+        # Pas de clé de dédoublonnage : la réservation sur processed_at suffit, et
+        # une relivraison après un échec du pipeline doit pouvoir le relancer
+        await payment_queue.enqueue(
+            {"transaction_id": transaction_id, "status": status, "amount": amount, "user_id": user_id}
+        )
+    except QueueFullError:
+        # Le paiement est enregistré : la relivraison KKiaPay relancera le traitement
+        raise HTTPException(status_code=503, detail="Traitement saturé, réessayez")
 
     return {"received": True}
 
@@ -103,34 +226,37 @@ async def kkiapay_webhook(request: Request, db: AsyncSession = Depends(get_db)):
 # PLANS TARIFAIRES
 # ─────────────────────────────────────────────
 
+# Catalogue figé : corps et ETag calculés une fois au démarrage
+_PLANS = StaticJSON({
+    "plans": [
+        {
+            "id": "starter",
+            "name": "Starter",
+            "price": 9900,
+            "currency": "FCFA",
+            "period": "mois",
+            "features": ["1 canal", "500 messages/mois", "Support email"]
+        },
+        {
+            "id": "pro",
+            "name": "Pro",
+            "price": 29900,
+            "currency": "FCFA",
+            "period": "mois",
+            "features": ["5 canaux", "5000 messages/mois", "WhatsApp inclus", "Support prioritaire"]
+        },
+        {
+            "id": "enterprise",
+            "name": "Enterprise",
+            "price": 99900,
+            "currency": "FCFA",
+            "period": "mois",
+            "features": ["Canaux illimités", "Messages illimités", "IA personnalisée", "Support dédié"]
+        }
+    ]
+})
+
 @router.get("/plans")
-def get_plans():
+def get_plans(request: Request):
     """Retourne les plans tarifaires disponibles."""
-    return {
-        "plans": [
-            {
-                "id": "starter",
-                "name": "Starter",
-                "price": 9900,
-                "currency": "FCFA",
-                "period": "mois",
-                "features": ["1 canal", "500 messages/mois", "Support email"]
-            },
-            {
-                "id": "pro",
-                "name": "Pro",
-                "price": 29900,
-                "currency": "FCFA",
-                "period": "mois",
-                "features": ["5 canaux", "5000 messages/mois", "WhatsApp inclus", "Support prioritaire"]
-            },
-            {
-                "id": "enterprise",
-                "name": "Enterprise",
-                "price": 99900,
-                "currency": "FCFA",
-                "period": "mois",
-                "features": ["Canaux illimités", "Messages illimités", "IA personnalisée", "Support dédié"]
-            }
-        ]
-    }
\ No newline at end of file
+    return _PLANS.response(request)
\ No newline at end of file
@@ -1,69 +1,111 @@
-from fastapi import APIRouter, Request, HTTPException, Query, Depends
+from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.responses import PlainTextResponse
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
+from app.database import AsyncSessionLocal
 from app.services.ai_service import get_ai_response
+from app.services.job_queue import JobQueue, KeyedSerialExecutor, QueueFullError
 from app.services.whatsapp_service import send_whatsapp_message
+from app.services.messenger_service import send_messenger_message
+from app.services.email_service import build_reply, send_email, EMAIL_FROM
+from app.services.email_parser import (
+    read_email_form, parse_inbound_email, EmailBodyTooLarge,
+    webhook_auth_configured, verify_shared_secret, verify_mailgun_signature
+)
+from app.services.conversation_service import find_email_thread, link_email_thread, find_latest_conversation_id
+from app.logging_config import get_logger, LOG_SAMPLE_RATE
+from email.utils import parseaddr
 import os
 
 router = APIRouter()
+log = get_logger("webhooks")
+
+EMAIL_FROM_ADDRESS = parseaddr(EMAIL_FROM)[1].lower()
 
 # ─────────────────────────────────────────────
 # WHATSAPP TWILIO
 # ─────────────────────────────────────────────
 
+async def process_whatsapp_message(job: dict):
+    """Traite un message WhatsApp mis en file : appel IA puis réponse via Twilio."""
+    from_number = job["from_number"]
+    user_id = from_number.replace("whatsapp:", "")
+
+    async with AsyncSessionLocal() as db:
+        try:
+            # Appeler l'IA
+            ai_response = await get_ai_response(
+                user_text=job["body"],
+                history=[],
+                channel="whatsapp",
+                user_id=user_id,
+                stage="greeting",
+                db=db
+            )
+
+            # Envoyer la réponse IA via WhatsApp
+            await send_whatsapp_message(from_number, ai_response["text"])
+
+            # Si l'IA génère un lien de paiement, l'envoyer aussi
+            if ai_response.get("payment_url"):
+                await send_whatsapp_message(
+                    from_number,
+                    f"💳 Lien de paiement sécurisé : {ai_response['payment_url']}"
+                )
+
+        except Exception:
+            log.exception("échec du traitement", extra={"channel": "whatsapp", "user": user_id})
+            await send_whatsapp_message(
+                from_number,
+                "Désolé, une erreur est survenue. Veuillez réessayer."
+            )
+
+
+whatsapp_queue = JobQueue(
+    "whatsapp",
+    process_whatsapp_message,
+    workers=int(os.getenv("WHATSAPP_WORKERS", "4")),
+    maxsize=int(os.getenv("WHATSAPP_QUEUE_MAXSIZE", "1000")),
+    enqueue_timeout=float(os.getenv("WHATSAPP_ENQUEUE_TIMEOUT", "0.5")),
+)
+
+
 @router.post("/whatsapp/twilio")
-async def whatsapp_twilio_webhook(
-    request: Request,
-    db: AsyncSession = Depends(get_db)
-):
+async def whatsapp_twilio_webhook(request: Request):
     """
     Reçoit les messages WhatsApp entrants via Twilio Sandbox.
     Twilio envoie les données en form-data (pas JSON).
+    Le message est mis en file et Twilio est acquitté immédiatement ;
+    l'appel IA et l'envoi de la réponse se font dans les workers.
     """
     form = await request.form()
 
     # Extraire les données du message
+    message_sid = form.get("MessageSid", "")
     from_number = form.get("From", "")      # ex: whatsapp:+22959085540
     to_number = form.get("To", "")          # ex: whatsapp:+14155238886
     body = form.get("Body", "").strip()     # Le texte du message
     profile_name = form.get("ProfileName", "Utilisateur")
 
-    print(f"[WhatsApp] De {from_number} ({profile_name}): {body}")
+    # Jamais le contenu du message dans les logs : longueur seulement
+    log.info("message reçu", extra={
+        "channel": "whatsapp", "user": from_number, "message_sid": message_sid,
+        "chars": len(body), "sample": LOG_SAMPLE_RATE
+    })
 
     if not body or not from_number:
         return PlainTextResponse("OK")
 
-    # Nettoyer le numéro pour l'utiliser comme userId
-    user_id = from_number.replace("whatsapp:", "")
-
     try:
-        # Appeler l'IA
-        ai_response = await get_ai_response(
-            user_text=body,
-            history=[],
-            channel="whatsapp",
-            user_id=user_id,
-            stage="greeting",
-            db=db
+        queued = await whatsapp_queue.enqueue(
+            {"from_number": from_number, "to_number": to_number, "body": body},
+            key=message_sid or None
         )
+    except QueueFullError as e:
+        # Backpressure : Twilio relivrera le message plus tard
+        log.warning(str(e), extra={"channel": "whatsapp"})
+        return PlainTextResponse("Busy", status_code=503, headers={"Retry-After": "5"})
 
-        # Envoyer la réponse IA via WhatsApp
-        await send_whatsapp_message(from_number, ai_response["text"])
-
-        # Si l'IA génère un lien de paiement, l'envoyer aussi
-        if ai_response.get("payment_url"):
-            await send_whatsapp_message(
-                from_number,
-                f"💳 Lien de paiement sécurisé : {ai_response['payment_url']}"
-            )
-
-    except Exception as e:
-        print(f"[WhatsApp] Erreur traitement: {str(e)}")
-        await send_whatsapp_message(
-            from_number,
-            "Désolé, une erreur est survenue. Veuillez réessayer."
-        )
+    if not queued:
+        log.info("doublon ignoré", extra={"channel": "whatsapp", "message_sid": message_sid})
 
     # Twilio attend une réponse 200 vide ou TwiML
     return PlainTextResponse("OK")
@@ -104,20 +146,79 @@ async def messenger_verify(
         return PlainTextResponse(hub_challenge)
     raise HTTPException(status_code=403, detail="Token invalide")
 
+async def process_messenger_event(job: dict):
+    """Traite un message Messenger / Instagram : appel IA puis réponse via la Graph API."""
+    sender_id = job["sender_id"]
+    channel = job["channel"]
+
+    async with AsyncSessionLocal() as db:
+        try:
+            ai_response = await get_ai_response(
+                user_text=job["text"],
+                history=[],
+                channel=channel,
+                user_id=sender_id,
+                stage="greeting",
+                db=db
+            )
+            await send_messenger_message(sender_id, ai_response["text"])
+
+            if ai_response.get("payment_url"):
+                await send_messenger_message(
+                    sender_id,
+                    f"💳 Lien de paiement sécurisé : {ai_response['payment_url']}"
+                )
+
+        except Exception:
+            log.exception("échec du traitement", extra={"channel": channel, "user": sender_id})
+            await send_messenger_message(sender_id, "Désolé, une erreur est survenue. Veuillez réessayer.")
+
+
+# Un même expéditeur est traité strictement dans l'ordre ; les expéditeurs
+# différents d'un même lot avancent en parallèle.
+messenger_executor = KeyedSerialExecutor(
+    "messenger",
+    process_messenger_event,
+    concurrency=int(os.getenv("MESSENGER_CONCURRENCY", "8")),
+    max_pending=int(os.getenv("MESSENGER_MAX_PENDING", "1000")),
+)
+
+
 @router.post("/messenger")
-async def messenger_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+async def messenger_webhook(request: Request):
+    """
+    Reçoit les lots d'événements Messenger / Instagram.
+    Chaque message est confié à l'exécuteur (file par sender.id) et Meta est
+    acquitté immédiatement.
+    """
     body = await request.json()
     channel = "messenger" if body.get("object") == "page" else "instagram"
     try:
         for entry in body.get("entry", []):
             for messaging in entry.get("messaging", []):
                 sender_id = messaging.get("sender", {}).get("id")
-                text = messaging.get("message", {}).get("text", "")
-                if sender_id and text:
-                    print(f"[{channel.upper()}] De {sender_id}: {text}")
-                    # TODO: Répondre via Graph API
-    except Exception as e:
-        print(f"[{channel}] Erreur: {str(e)}")
+                message = messaging.get("message", {})
+                text = message.get("text", "")
+                # Les échos de nos propres envois reviennent dans le webhook
+                if not sender_id or not text or message.get("is_echo"):
+                    continue
+                log.info("message reçu", extra={
+                    "channel": channel, "user": sender_id, "mid": message.get("mid"),
+                    "chars": len(text), "sample": LOG_SAMPLE_RATE
+                })
+                queued = messenger_executor.submit(
+                    (channel, sender_id),
+                    {"sender_id": sender_id, "channel": channel, "text": text},
+                    job_id=message.get("mid")
+                )
+                if not queued:
+                    log.info("doublon ignoré", extra={"channel": channel, "mid": message.get("mid")})
+    except QueueFullError as e:
+        # Meta relivre les lots non acquittés ; les messages déjà acceptés sont dédoublonnés par mid
+        log.warning(str(e), extra={"channel": channel})
+        raise HTTPException(status_code=503, detail="Traitement saturé, réessayez")
+    except Exception:
+        log.exception("lot invalide", extra={"channel": channel})
     return {"status": "ok"}
 
 
@@ -125,12 +226,94 @@ async def messenger_webhook(request: Request, db: AsyncSession = Depends(get_db)
 # EMAIL
 # ─────────────────────────────────────────────
 
+async def process_email(job: dict):
+    """Traite un email entrant : appel IA puis réponse dans le même fil via SMTP."""
+    sender = job["sender"]
+
+    async with AsyncSessionLocal() as db:
+        try:
+            # Réponse à un email déjà échangé : même conversation, même depuis une autre adresse (alias, transfert)
+            conversation = await find_email_thread(db, job["thread_ids"])
+            user_id = conversation.user_id if conversation else sender
+
+            ai_response = await get_ai_response(
+                user_text=job["text"],
+                history=[],
+                channel="email",
+                user_id=user_id,
+                stage="greeting",
+                db=db
+            )
+            # Le lien de paiement éventuel est déjà dans le texte de la réponse
+            reply = build_reply(sender, job["subject"], ai_response["text"], job["message_id"], job["references"])
+            sent = await send_email(reply)
+
+            conversation_id = conversation.id if conversation else await find_latest_conversation_id(db, user_id, "email")
+            if conversation_id:
+                await link_email_thread(db, conversation_id, [job["message_id"], reply["Message-ID"] if sent else None])
+
+        except Exception:
+            log.exception("échec du traitement", extra={"channel": "email", "user": sender})
+            await send_email(build_reply(
+                sender, job["subject"], "Désolé, une erreur est survenue. Veuillez réessayer.", job["message_id"], job["references"]
+            ))
+
+
+# Emails d'un même expéditeur traités dans l'ordre de réception
+email_executor = KeyedSerialExecutor(
+    "email",
+    process_email,
+    concurrency=int(os.getenv("EMAIL_CONCURRENCY", "4")),
+    max_pending=int(os.getenv("EMAIL_MAX_PENDING", "1000")),
+)
+
+
 @router.post("/email")
 async def email_webhook(request: Request):
-    form = await request.form()
-    from_email = form.get("from", "")
-    subject = form.get("subject", "")
-    body = form.get("text", form.get("body-plain", ""))
-    print(f"[EMAIL] De {from_email} | Sujet: {subject}")
-    # TODO: Répondre par email + appeler l'IA
-    return {"status": "ok"}
\ No newline at end of file
+    """
+    Reçoit les emails entrants d'un service inbound parse (Mailgun, SendGrid...).
+    Le formulaire est lu en flux (pièces jointes ignorées), la réponse est
+    extraite sans citations ni signature et le traitement part en file.
+    Chaque réponse part en email depuis EMAIL_FROM : la requête doit être
+    authentifiée (signature Mailgun ou secret partagé), sinon 401 / 403.
+    """
+    if not webhook_auth_configured():
+        raise HTTPException(status_code=403, detail="Webhook email désactivé (MAILGUN_WEBHOOK_SIGNING_KEY ou EMAIL_WEBHOOK_SECRET)")
+    shared_secret = verify_shared_secret(request)
+    if shared_secret is False:
+        raise HTTPException(status_code=403, detail="Secret invalide")
+
+    try:
+        fields, attachments = await read_email_form(request)
+    except EmailBodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if shared_secret is None:
+        if not fields.get("signature"):
+            raise HTTPException(status_code=401, detail="Webhook non authentifié")
+        if not verify_mailgun_signature(fields):
+            raise HTTPException(status_code=403, detail="Signature invalide")
+    email = parse_inbound_email(fields, attachments)
+
+    log.info("email reçu", extra={
+        "channel": "email", "user": email["sender"], "message_id": email["message_id"],
+        "chars": len(email["text"]), "attachments": len(attachments), "sample": LOG_SAMPLE_RATE
+    })
+
+    # Nos propres envois (copie, alias) et les réponses automatiques ne déclenchent pas de tour
+    if not email["sender"] or not email["text"] or email["automatic"] or email["sender"] == EMAIL_FROM_ADDRESS:
+        return {"status": "ignored"}
+
+    try:
+        queued = email_executor.submit(
+            ("email", email["sender"]),
+            {k: email[k] for k in ("sender", "subject", "message_id", "thread_ids", "references", "text")},
+            job_id=email["message_id"] or None
+        )
+    except QueueFullError as e:
+        # Le service inbound relivre les webhooks en erreur 5xx
+        log.warning(str(e), extra={"channel": "email"})
+        raise HTTPException(status_code=503, detail="Traitement saturé, réessayez")
+
+    if not queued:
+        log.info("doublon ignoré", extra={"channel": "email", "message_id": email["message_id"]})
+    return {"status": "ok"}
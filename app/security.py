@@ -0,0 +1,17 @@
+import os
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+
+# Jeton des endpoints d'administration (campagnes) ; non défini = endpoints désactivés
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dépendance FastAPI : en-tête X-Admin-Token comparé à ADMIN_API_TOKEN (temps constant)."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="API d'administration désactivée (ADMIN_API_TOKEN)")
+    if not x_admin_token:
+        raise HTTPException(status_code=401, detail="En-tête X-Admin-Token requis", headers={"WWW-Authenticate": "X-Admin-Token"})
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Jeton d'administration invalide")
@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Hashable, Optional
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models_db import Payment, UsageCounter, ChannelEnum
+from app.services.concurrency import TokenBucket
+from app.services.llm_provider import get_llm
+from app.services.payment_service import PLANS
+from app.logging_config import get_logger
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+
+# Quotas mensuels des plans payants (500 / 5000 messages annoncés) ; false : l'admission
+# se limite à la protection contre la surcharge (débit, délestage)
+AI_QUOTA_ENABLED = os.getenv("AI_QUOTA_ENABLED", "true").lower() == "true"
+# Messages IA par mois ; 0 = illimité. Prospects sans abonnement : illimité par défaut,
+# un quota ici les coupe en plein tunnel de vente, avant le paiement.
+AI_FREE_MONTHLY_QUOTA = int(os.getenv("AI_FREE_MONTHLY_QUOTA", "0"))
+PLAN_MONTHLY_QUOTAS = {
+    "starter": int(os.getenv("AI_STARTER_MONTHLY_QUOTA", "500")),
+    "pro": int(os.getenv("AI_PRO_MONTHLY_QUOTA", "5000")),
+    "enterprise": int(os.getenv("AI_ENTERPRISE_MONTHLY_QUOTA", "0")),
+}
+# Un paiement réussi ouvre le plan pour SUBSCRIPTION_DAYS jours
+SUBSCRIPTION_DAYS = 31
+
+# Débit par (user_id, channel) : ADMISSION_BURST messages d'affilée, puis ADMISSION_RATE_PER_MINUTE
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "20"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "5"))
+# Délestage : au-delà de ce nombre d'appels LLM en cours ou en attente, réponse « occupé »
+ADMISSION_MAX_LLM_BACKLOG = int(os.getenv("ADMISSION_MAX_LLM_BACKLOG", "50"))
+
+ADMISSION_FLUSH_INTERVAL = float(os.getenv("ADMISSION_FLUSH_INTERVAL", "10"))
+# Durée pendant laquelle plan et consommation d'un utilisateur sont servis depuis la mémoire
+ADMISSION_CACHE_TTL = float(os.getenv("ADMISSION_CACHE_TTL", "300"))
+ADMISSION_MAX_TRACKED = int(os.getenv("ADMISSION_MAX_TRACKED", "50000"))
+FLUSH_BATCH_SIZE = 500
+
+log = get_logger("admission")
+
+BUSY = "busy"
+RATE_LIMITED = "rate_limited"
+QUOTA_EXCEEDED = "quota_exceeded"
+
+UPGRADES = {None: "starter", "starter": "pro", "pro": "enterprise"}
+
+
+def current_period() -> str:
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+def plan_for_amount(amount: Optional[int]) -> Optional[str]:
+    """Plan le plus élevé couvert par le montant payé (None : pas d'abonnement)."""
+    plan = None
+    for name, price in sorted(PLANS.items(), key=lambda item: item[1]):
+        if amount is not None and amount >= price:
+            plan = name
+    return plan
+
+
+class _Usage:
+    __slots__ = ("plan", "quota", "period", "used", "expires_at")
+
+    def __init__(self, plan: Optional[str], period: str, used: int, expires_at: float):
+        self.plan = plan
+        self.quota = PLAN_MONTHLY_QUOTAS.get(plan, 0) if plan else AI_FREE_MONTHLY_QUOTA
+        self.period = period
+        self.used = used
+        self.expires_at = expires_at
+
+
+class AdmissionController:
+    """
+    Contrôle d'admission devant l'appel LLM, en O(1) sur le chemin chaud :
+    - délestage global quand le backlog LLM dépasse max_backlog
+    - débit par (user_id, channel) via un seau de jetons
+    - quota mensuel par utilisateur selon son plan (dernier paiement réussi),
+      si quota_enabled
+
+    Le débit protège chaque conversation ; le quota suit l'abonnement. Un plan
+    est payé par un utilisateur et couvre tous ses canaux (« 5 canaux ») : sa
+    consommation est donc la somme de ses canaux. usage_counters garde le
+    détail par canal.
+
+    Plan et consommation sont chargés une fois par utilisateur (une requête),
+    puis servis depuis la mémoire pendant cache_ttl. Les incréments sont
+    accumulés en mémoire et écrits par lots dans usage_counters. Entre
+    plusieurs workers, le quota est approché : chacun recharge le total
+    persisté à l'expiration de son cache.
+    """
+
+    def __init__(self, enabled: bool, max_backlog: int, rate_per_minute: float, burst: float,
+                 flush_interval: float, cache_ttl: float, max_tracked: int, quota_enabled: bool = True):
+        self.enabled = enabled
+        self.quota_enabled = quota_enabled
+        self.max_backlog = max_backlog
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.max_tracked = max_tracked
+
+        self._usage: "OrderedDict[str, _Usage]" = OrderedDict()
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        # (user_id, channel, period) -> messages pas encore écrits en base
+        self._pending: dict = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.admitted = 0
+        self.shed = 0
+        self.rate_limited = 0
+        self.quota_exceeded = 0
+        self.loads = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    async def check(self, db: Optional[AsyncSession], user_id: str, channel: str) -> Optional[str]:
+        """Retourne None si le message est admis (et le compte), sinon BUSY, RATE_LIMITED ou QUOTA_EXCEEDED."""
+        if not self.enabled:
+            return None
+
+        if get_llm().backlog() >= self.max_backlog:
+            self.shed += 1
+            return BUSY
+
+        if not self._bucket(user_id, channel).try_acquire():
+            self.rate_limited += 1
+            return RATE_LIMITED
+
+        period = current_period()
+        if self.quota_enabled and db is not None:
+            usage = await self._usage_for(db, user_id, period)
+            if usage.quota and usage.used >= usage.quota:
+                self.quota_exceeded += 1
+                return QUOTA_EXCEEDED
+            usage.used += 1
+
+        key = (user_id, channel, period)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self.admitted += 1
+        return None
+
+    def upgrade_for(self, user_id: str) -> Optional[str]:
+        """Plan à proposer à un utilisateur qui a épuisé son quota."""
+        usage = self._usage.get(user_id)
+        return UPGRADES.get(usage.plan if usage else None)
+
+    def forget(self, user_id: str):
+        """À appeler après un paiement : le plan est relu au prochain message."""
+        self._usage.pop(user_id, None)
+
+    def _bucket(self, user_id: str, channel: str) -> TokenBucket:
+        key = (user_id, channel)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate_per_minute / 60, self.burst)
+            if len(self._buckets) > self.max_tracked:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def _usage_for(self, db: AsyncSession, user_id: str, period: str) -> _Usage:
+        usage = self._usage.get(user_id)
+        if usage is not None and usage.period == period and usage.expires_at > time.monotonic():
+            self._usage.move_to_end(user_id)
+            return usage
+
+        # Plan et consommation du mois en un seul aller-retour
+        since = datetime.utcnow() - timedelta(days=SUBSCRIPTION_DAYS)
+        amount = (
+            select(Payment.amount)
+            .where(Payment.user_id == user_id)
+            .where(Payment.status == "SUCCESS")
+            .where(Payment.created_at >= since)
+            .order_by(Payment.created_at.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        used = (
+            select(func.coalesce(func.sum(UsageCounter.count), 0))
+            .where(UsageCounter.user_id == user_id)
+            .where(UsageCounter.period == period)
+            .scalar_subquery()
+        )
+        row = (await db.execute(select(amount.label("amount"), used.label("used")))).one()
+        self.loads += 1
+
+        # Le total persisté n'inclut pas encore les incréments en attente d'écriture
+        unflushed = sum(self._pending.get((user_id, c.value, period), 0) for c in ChannelEnum)
+        usage = _Usage(plan_for_amount(row.amount), period, int(row.used) + unflushed,
+                       time.monotonic() + self.cache_ttl)
+        self._usage[user_id] = usage
+        if len(self._usage) > self.max_tracked:
+            self._usage.popitem(last=False)
+        return usage
+
+    async def flush(self):
+        """Écrit les compteurs accumulés dans usage_counters (upsert par lots)."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [
+            {"user_id": user_id, "channel": channel, "period": period, "count": count}
+            for (user_id, channel, period), count in batch.items()
+        ]
+        try:
+            async with AsyncSessionLocal() as db:
+                dialect = db.get_bind().dialect.name
+                insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                for i in range(0, len(rows), FLUSH_BATCH_SIZE):
+                    statement = insert(UsageCounter).values(rows[i:i + FLUSH_BATCH_SIZE])
+                    statement = statement.on_conflict_do_update(
+                        index_elements=["user_id", "period", "channel"],
+                        set_={"count": UsageCounter.count + statement.excluded.count, "updated_at": datetime.utcnow()}
+                    )
+                    await db.execute(statement)
+                await db.commit()
+            self.flushes += 1
+        except Exception as e:
+            # Les compteurs sont remis en attente pour le prochain passage
+            for key, count in batch.items():
+                self._pending[key] = self._pending.get(key, 0) + count
+            self.flush_errors += 1
+            log.error("échec d'écriture des compteurs", extra={"counters": len(batch), "error": str(e)})
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="admission-flush")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "quota_enabled": self.quota_enabled,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+            "quota_exceeded": self.quota_exceeded,
+            "tracked_users": len(self._usage),
+            "usage_loads": self.loads,
+            "pending_counters": len(self._pending),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "llm_backlog": get_llm().backlog(),
+            "max_llm_backlog": self.max_backlog,
+        }
+
+
+admission = AdmissionController(
+    enabled=ADMISSION_ENABLED,
+    max_backlog=ADMISSION_MAX_LLM_BACKLOG,
+    rate_per_minute=ADMISSION_RATE_PER_MINUTE,
+    burst=ADMISSION_BURST,
+    flush_interval=ADMISSION_FLUSH_INTERVAL,
+    cache_ttl=ADMISSION_CACHE_TTL,
+    max_tracked=ADMISSION_MAX_TRACKED,
+    quota_enabled=AI_QUOTA_ENABLED,
+)
@@ -1,19 +1,25 @@
-﻿import os, time, json
-from dotenv import load_dotenv
-load_dotenv()
-
-from groq import AsyncGroq
+﻿import os, time, json, hashlib
+from contextlib import nullcontext
+from datetime import datetime
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.services.conversation_service import (
     get_or_create_conversation,
-    save_message,
-    update_conversation_stage,
+    turn_lock,
+    record_turn,
+    get_conversation_context,
     get_conversation_history
 )
-from app.services.payment_service import generate_payment_url
+from app.services.payment_service import generate_payment_url, PLANS
+from app.services.stream_parser import TextFieldParser
+from app.services.response_cache import response_cache
+from app.services.llm_provider import get_llm
+from app.services.prompt_builder import build_prompt
+from app.services.admission import admission, BUSY, RATE_LIMITED, QUOTA_EXCEEDED
+from app.services.metrics import TURN_PHASE_SECONDS, TURNS_TOTAL
+from app.logging_config import get_logger, conversation_id_var, LOG_SAMPLE_RATE
 
-client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+log = get_logger("ai")
 
 SYSTEM_PROMPT = """Tu es PulsAI, un assistant commercial intelligent et empathique pour une plateforme CRM multi-canaux.
 Guide le client a travers ces 6 etapes jusqu'au paiement :
@@ -33,37 +39,87 @@ IMPORTANT sur le paiement : Quand le client est pret a payer, mets "payment_url"
 Reponds TOUJOURS uniquement en JSON valide, sans texte avant ou apres :
 {"text": "ta reponse", "stage": "greeting|qualification|presentation|objection|payment|completed", "payment_url": null, "actions": []}"""
 
-PLANS = {
-    "starter": 9900,
-    "pro": 29900,
-    "enterprise": 99900
+# Change dès que le prompt ou les modèles changent : invalide le cache de réponses
+PROMPT_VERSION = hashlib.sha1(f"{get_llm().signature}\n{SYSTEM_PROMPT}".encode()).hexdigest()[:12]
+
+# Réponses prêtes à l'emploi quand le message n'est pas admis (aucun appel LLM)
+REFUSAL_TEXTS = {
+    BUSY: "Nous recevons beaucoup de messages en ce moment 🙏 Réessayez dans quelques instants, je reste à votre disposition.",
+    RATE_LIMITED: "Vous m'écrivez très vite 🙂 Laissez-moi quelques secondes avant votre prochain message.",
+    QUOTA_EXCEEDED: "Vous avez atteint la limite mensuelle de messages de votre formule.",
 }
 
-async def get_ai_response(user_text: str, history: list, channel: str, user_id: str, stage: str, metadata: dict = {}, db: AsyncSession = None):
-    """Appelle Groq, persiste en PostgreSQL et génère le lien KKiaPay si nécessaire."""
+def _refusal_response(reason: str, stage: str, user_id: str) -> dict:
+    """Réponse au format de get_ai_response pour un message refusé par l'admission."""
+    text = REFUSAL_TEXTS[reason]
+    payment_url = None
+    if reason == QUOTA_EXCEEDED:
+        plan = admission.upgrade_for(user_id)
+        if plan:
+            payment_url = generate_payment_url(
+                amount=PLANS[plan],
+                reason=f"PulsAI {plan.capitalize()} — {PLANS[plan]} FCFA/mois",
+                user_id=user_id
+            )
+            text += f" Passez à la formule {plan.capitalize()} pour continuer :\n{payment_url}"
+    return {
+        "text": text,
+        "stage": stage,
+        "timestamp": int(time.time() * 1000),
+        "payment_url": payment_url,
+        "actions": [reason],
+        "from_": "ia"
+    }
+
+def _bind_conversation(conversation):
+    # Corrélation des logs : valable pour le reste de la tâche (requête HTTP ou job de file)
+    if conversation is not None:
+        conversation_id_var.set(str(conversation.id))
 
+def _current_stage(stage, conversation) -> str:
+    """Le stade réel de la conversation prime sur celui annoncé par le client."""
+    current = conversation.stage if conversation is not None else stage
+    return getattr(current, "value", current)
+
+async def _prepare_turn(user_text: str, history: list, channel: str, user_id: str, stage, db: Optional[AsyncSession]):
+    """Résout la conversation et assemble le prompt dans le budget de tokens."""
     conversation = None
     if db:
         conversation = await get_or_create_conversation(db, user_id, channel)
-        await save_message(db, conversation.id, "user", user_text, channel)
-
-    # Construire l'historique
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    for m in history[-10:]:
-        role = m.role if hasattr(m, 'role') else m.get('role', 'user')
-        content = m.content if hasattr(m, 'content') else m.get('content', '')
-        messages.append({"role": role, "content": content})
-    messages.append({"role": "user", "content": user_text})
-
-    # Appel Groq
-    response = await client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=messages,
-        max_tokens=1024,
-        temperature=0.7,
+        # Canaux sans historique côté client (WhatsApp...) : contexte serveur
+        if not history:
+            history = await get_conversation_context(db, conversation.id)
+        # Termine la transaction de lecture : la connexion retourne au pool pendant l'appel LLM
+        await db.commit()
+
+    prompt = build_prompt(
+        SYSTEM_PROMPT,
+        history,
+        user_text,
+        channel=channel,
+        stage=_current_stage(stage, conversation),
+        summary=conversation.summary if conversation is not None else None,
+        summary_upto=conversation.summary_upto if conversation is not None else None
     )
-    raw = response.choices[0].message.content.strip()
+    return conversation, prompt
 
+def _cache_key(user_text: str, channel: str, stage, conversation, prompt: dict):
+    return response_cache.key_for(
+        user_text,
+        stage=_current_stage(stage, conversation),
+        channel=channel,
+        prompt_version=PROMPT_VERSION,
+        history_turns=prompt["history_turns"]
+    )
+
+def _cache_store(key, raw: str):
+    # Jamais de lien de paiement en cache : il est propre à l'utilisateur
+    if "GENERATE" not in raw:
+        response_cache.put(key, raw)
+
+async def _complete_turn(raw: str, user_text: str, channel: str, user_id: str, stage: str,
+                         conversation, prompt: dict, received_at: datetime, db: Optional[AsyncSession]) -> dict:
+    """Interprète l'enveloppe JSON du modèle, génère le lien de paiement et persiste le tour."""
     try:
         data = json.loads(raw)
     except Exception:
@@ -93,11 +149,19 @@ async def get_ai_response(user_text: str, history: list, channel: str, user_id:
         )
         ai_text += f"\n\n💳 Voici votre lien de paiement sécurisé KKiaPay :\n{payment_url}"
 
-    # Persister la réponse IA
+    # Persister le tour complet (message, réponse, stade) en une transaction
     if db and conversation:
-        await save_message(db, conversation.id, "assistant", ai_text, channel)
-        await update_conversation_stage(db, conversation.id, new_stage)
+        changed = prompt["summary_changed"]
+        await record_turn(
+            db, conversation.id, channel, user_text, ai_text, new_stage, user_at=received_at,
+            summary=prompt["summary"] if changed else None,
+            summary_upto=prompt["summary_upto"] if changed else None,
+            previous_stage=conversation.stage, stage_since=conversation.stage_changed_at
+        )
 
+    log.info("tour traité", extra={
+        "channel": channel, "stage": new_stage, "payment_link": payment_url is not None, "sample": LOG_SAMPLE_RATE
+    })
     return {
         "text": ai_text,
         "stage": new_stage,
@@ -107,6 +171,123 @@ async def get_ai_response(user_text: str, history: list, channel: str, user_id:
         "from_": "ia"
     }
 
+async def _admit(db: Optional[AsyncSession], user_id: str, channel: str) -> Optional[str]:
+    with TURN_PHASE_SECONDS.time("admission"):
+        refusal = await admission.check(db, user_id, channel)
+    if refusal:
+        TURNS_TOTAL.labels(channel, refusal).inc()
+    return refusal
+
+def _record_llm(started: float):
+    elapsed = time.perf_counter() - started
+    response_cache.record_llm_latency(elapsed)
+    TURN_PHASE_SECONDS.labels("llm").observe(elapsed)
+
+async def get_ai_response(user_text: str, history: list, channel: str, user_id: str, stage: str, metadata: dict = {}, db: AsyncSession = None):
+    """Appelle le LLM, persiste en PostgreSQL et génère le lien KKiaPay si nécessaire."""
+    # Quota, débit et délestage avant tout travail : un refus ne coûte ni LLM ni écriture
+    refusal = await _admit(db, user_id, channel)
+    if refusal:
+        return _refusal_response(refusal, stage, user_id)
+
+    # Un tour à la fois par (user_id, channel) : le tour suivant voit le stade du précédent.
+    # Horodatage pris sous le verrou pour que l'historique reste dans l'ordre des tours.
+    waiting = time.perf_counter()
+    async with turn_lock(user_id, channel) if db else nullcontext():
+        TURN_PHASE_SECONDS.labels("lock").observe(time.perf_counter() - waiting)
+        received_at = datetime.utcnow()
+        with TURN_PHASE_SECONDS.time("prepare"):
+            conversation, prompt = await _prepare_turn(user_text, history, channel, user_id, stage, db)
+        _bind_conversation(conversation)
+
+        cache_key = _cache_key(user_text, channel, stage, conversation, prompt)
+        raw = response_cache.get(cache_key)
+        if raw is None:
+            # Appel LLM (fournisseur primaire, secours si lent ou en erreur)
+            started = time.perf_counter()
+            raw = await get_llm().complete(prompt["system"], prompt["messages"])
+            _record_llm(started)
+            _cache_store(cache_key, raw)
+            TURNS_TOTAL.labels(channel, "ok").inc()
+        else:
+            TURNS_TOTAL.labels(channel, "cache").inc()
+
+        with TURN_PHASE_SECONDS.time("persist"):
+            return await _complete_turn(raw, user_text, channel, user_id, stage, conversation, prompt, received_at, db)
+
+async def stream_ai_response(user_text: str, history: list, channel: str, user_id: str, stage: str, metadata: dict = {}, db: AsyncSession = None):
+    """
+    Variante streaming de get_ai_response.
+    Produit ("delta", texte) au fil de la génération du champ "text" de
+    l'enveloppe JSON, puis ("done", réponse) une fois le flux terminé.
+    La réponse finale et ce qui est persisté sont identiques au chemin non-streaming.
+    """
+    refusal = await _admit(db, user_id, channel)
+    if refusal:
+        response = _refusal_response(refusal, stage, user_id)
+        yield "delta", response["text"]
+        yield "done", response
+        return
+
+    waiting = time.perf_counter()
+    async with turn_lock(user_id, channel) if db else nullcontext():
+        TURN_PHASE_SECONDS.labels("lock").observe(time.perf_counter() - waiting)
+        received_at = datetime.utcnow()
+        with TURN_PHASE_SECONDS.time("prepare"):
+            conversation, prompt = await _prepare_turn(user_text, history, channel, user_id, stage, db)
+        _bind_conversation(conversation)
+
+        parser = TextFieldParser()
+        cache_key = _cache_key(user_text, channel, stage, conversation, prompt)
+        raw = response_cache.get(cache_key)
+        if raw is not None:
+            TURNS_TOTAL.labels(channel, "cache").inc()
+            text = parser.feed(raw)
+            if text:
+                yield "delta", text
+        else:
+            started = time.perf_counter()
+            chunks = []
+            async for delta in get_llm().stream(prompt["system"], prompt["messages"]):
+                chunks.append(delta)
+                text = parser.feed(delta)
+                if text:
+                    yield "delta", text
+            _record_llm(started)
+            raw = "".join(chunks).strip()
+            _cache_store(cache_key, raw)
+            TURNS_TOTAL.labels(channel, "ok").inc()
+
+        with TURN_PHASE_SECONDS.time("persist"):
+            response = await _complete_turn(raw, user_text, channel, user_id, stage, conversation, prompt, received_at, db)
+        yield "done", response
+
+async def generate_follow_up(instruction: str, conversation, db: AsyncSession) -> str:
+    """
+    Message de relance rédigé par l'IA pour une conversation existante (campagnes).
+    Ni admission ni quota : la consigne vient de l'équipe, pas du client, et
+    n'est pas enregistrée dans l'historique. Retourne le texte à envoyer.
+    """
+    _bind_conversation(conversation)
+    history = await get_conversation_context(db, conversation.id)
+    await db.commit()
+    prompt = build_prompt(
+        SYSTEM_PROMPT,
+        history,
+        f"[Consigne interne, ne pas citer : rédige un message de relance] {instruction}",
+        channel=getattr(conversation.channel, "value", conversation.channel),
+        stage=_current_stage(None, conversation),
+        summary=conversation.summary,
+        summary_upto=conversation.summary_upto
+    )
+    started = time.perf_counter()
+    raw = await get_llm().complete(prompt["system"], prompt["messages"])
+    _record_llm(started)
+    try:
+        return json.loads(raw).get("text") or raw
+    except Exception:
+        return raw
+
 async def get_channel_history(user_id: str, channel: str, limit: int = 50, db: AsyncSession = None) -> list:
     if db:
         return await get_conversation_history(db, user_id, channel, limit)
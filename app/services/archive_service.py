@@ -0,0 +1,193 @@
+import os
+import gzip
+import json
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models_db import (
+    Conversation, Message, Payment, EmailThread, CampaignDelivery,
+    ArchiveSegment, ArchivedConversation, StageEnum
+)
+from app.services.context_cache import context_cache
+from app.services.metrics import DB_QUERY_SECONDS, timed
+from app.logging_config import get_logger
+
+# Conversations terminées (completed) sans activité depuis ce nombre de jours : sorties de la table chaude
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# Conversations par segment (et par transaction)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Passage périodique dans le processus web, en secondes ; 0 = désactivé (python -m app.archive via un planificateur)
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "0"))
+
+log = get_logger("archive")
+
+
+def _encode_member(messages: list) -> bytes:
+    """Membre gzip autonome : les messages d'une conversation en JSON lines."""
+    lines = "".join(
+        json.dumps({
+            "id": str(m.id), "role": m.role, "content": m.content,
+            "created_at": m.created_at.isoformat() if m.created_at else None,
+        }, ensure_ascii=False) + "\n"
+        for m in messages
+    )
+    return gzip.compress(lines.encode(), compresslevel=6)
+
+
+def _decode_member(member: bytes) -> list:
+    messages = []
+    for line in gzip.decompress(member).decode().splitlines():
+        entry = json.loads(line)
+        entry["created_at"] = datetime.fromisoformat(entry["created_at"]) if entry["created_at"] else None
+        messages.append(entry)
+    return messages
+
+
+async def archive_batch(db: AsyncSession, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Archive un lot de conversations terminées avant `cutoff`, en une transaction :
+    un segment (membres gzip concaténés), une ligne d'index par conversation,
+    puis suppression en masse des lignes chaudes (aucun chargement ORM).
+    Retourne le nombre de conversations archivées.
+    """
+    result = await db.execute(
+        select(Conversation)
+        .where(Conversation.stage == StageEnum.completed)
+        .where(Conversation.updated_at < cutoff)
+        .order_by(Conversation.updated_at)
+        .limit(batch_size)
+        # Deux archiveurs en parallèle se partagent les lots au lieu de s'attendre
+        .with_for_update(skip_locked=True)
+    )
+    conversations = result.scalars().all()
+    if not conversations:
+        return 0
+    ids = [c.id for c in conversations]
+
+    rows = (await db.execute(
+        select(Message.id, Message.conversation_id, Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id.in_(ids))
+        .order_by(Message.conversation_id, Message.created_at, Message.id)
+    )).all()
+    by_conversation: dict = {}
+    for row in rows:
+        by_conversation.setdefault(row.conversation_id, []).append(row)
+
+    data = bytearray()
+    index = []
+    for conversation in conversations:
+        messages = by_conversation.get(conversation.id, [])
+        member = _encode_member(messages)
+        index.append({
+            "id": conversation.id,
+            "user_id": conversation.user_id,
+            "channel": getattr(conversation.channel, "value", conversation.channel),
+            "stage": getattr(conversation.stage, "value", conversation.stage),
+            "created_at": conversation.created_at,
+            "updated_at": conversation.updated_at,
+            "message_count": len(messages),
+            "member_offset": len(data),
+            "member_length": len(member),
+        })
+        data += member
+
+    segment = ArchiveSegment(data=bytes(data), conversations=len(conversations))
+    db.add(segment)
+    await db.flush()
+    await db.execute(ArchivedConversation.__table__.insert(), [{**entry, "segment_id": segment.id} for entry in index])
+
+    # Suppression explicite des dépendances : ne repose pas sur ON DELETE CASCADE (SQLite, contraintes anciennes)
+    await db.execute(delete(Message).where(Message.conversation_id.in_(ids)).execution_options(synchronize_session=False))
+    await db.execute(delete(EmailThread).where(EmailThread.conversation_id.in_(ids)).execution_options(synchronize_session=False))
+    await db.execute(delete(CampaignDelivery).where(CampaignDelivery.conversation_id.in_(ids)).execution_options(synchronize_session=False))
+    await db.execute(update(Payment).where(Payment.conversation_id.in_(ids)).values(conversation_id=None).execution_options(synchronize_session=False))
+    await db.execute(delete(Conversation).where(Conversation.id.in_(ids)).execution_options(synchronize_session=False))
+    await db.commit()
+
+    for conversation_id in ids:
+        context_cache.invalidate(conversation_id)
+    log.info("lot archivé", extra={
+        "conversations": len(ids), "messages": len(rows), "segment_bytes": len(data), "segment_id": str(segment.id)
+    })
+    return len(ids)
+
+
+async def archive_expired(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archive toutes les conversations éligibles, lot par lot ; retourne le total archivé."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            archived = await archive_batch(db, cutoff, batch_size)
+        total += archived
+        if archived < batch_size:
+            return total
+
+
+@timed(DB_QUERY_SECONDS, "load_archived_conversation")
+async def load_archived_conversation(db: AsyncSession, user_id: str, channel: str) -> Optional[list]:
+    """
+    Messages de la dernière conversation archivée d'un (user_id, channel),
+    ou None. Une lecture d'index, puis seul le membre gzip de la conversation
+    est extrait du segment (substr côté base) et décompressé.
+    """
+    entry = (await db.execute(
+        select(ArchivedConversation.segment_id, ArchivedConversation.member_offset, ArchivedConversation.member_length)
+        .where(ArchivedConversation.user_id == user_id)
+        .where(ArchivedConversation.channel == channel)
+        .order_by(ArchivedConversation.updated_at.desc())
+        .limit(1)
+    )).first()
+    if entry is None:
+        return None
+    member = (await db.execute(
+        select(func.substr(ArchiveSegment.data, entry.member_offset + 1, entry.member_length))
+        .where(ArchiveSegment.id == entry.segment_id)
+    )).scalar()
+    return _decode_member(member)
+
+
+class ArchiveJob:
+    """Passage d'archivage périodique dans le processus (ARCHIVE_INTERVAL > 0)."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.archived = 0
+        self.errors = 0
+
+    async def run_once(self) -> int:
+        try:
+            archived = await archive_expired()
+            self.runs += 1
+            self.archived += archived
+            return archived
+        except Exception:
+            self.errors += 1
+            log.exception("archivage en échec")
+            return 0
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    async def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="archive")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval_s": self.interval, "runs": self.runs, "archived": self.archived, "errors": self.errors}
+
+
+archive_job = ArchiveJob(ARCHIVE_INTERVAL)
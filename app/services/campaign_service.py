@@ -0,0 +1,322 @@
+import os
+import json
+import uuid
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, ReadSessionLocal
+from app.models_db import Campaign, CampaignDelivery, Conversation, Message
+from app.services.ai_service import generate_follow_up
+from app.services.admission import ADMISSION_MAX_LLM_BACKLOG
+from app.services.concurrency import TokenBucket
+from app.services.conversation_service import save_message, link_email_thread
+from app.services.email_service import build_message, send_email
+from app.services.llm_provider import get_llm
+from app.services.messenger_service import send_messenger_message
+from app.services.whatsapp_service import send_whatsapp_message, send_whatsapp_template
+from app.logging_config import get_logger
+
+# Envois simultanés, toutes campagnes confondues
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "8"))
+# Conversations lues par page ; le point de reprise avance après chaque page
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "200"))
+# Messages/s par canal, en plus des limites propres à chaque API : le trafic en direct garde la priorité
+CAMPAIGN_RATES = {
+    "whatsapp": float(os.getenv("CAMPAIGN_WHATSAPP_RATE", "10")),
+    "messenger": float(os.getenv("CAMPAIGN_MESSENGER_RATE", "10")),
+    "instagram": float(os.getenv("CAMPAIGN_INSTAGRAM_RATE", "10")),
+    "email": float(os.getenv("CAMPAIGN_EMAIL_RATE", "5")),
+}
+# Campagnes IA : génération suspendue tant que le backlog LLM dépasse ce seuil
+CAMPAIGN_MAX_LLM_BACKLOG = int(os.getenv("CAMPAIGN_MAX_LLM_BACKLOG", str(ADMISSION_MAX_LLM_BACKLOG // 2)))
+# WhatsApp et Messenger/Instagram n'acceptent le texte libre que dans les 24 h qui suivent
+# le dernier message du client ; au-delà : modèle approuvé (WhatsApp) ou tag de message (Meta)
+SERVICE_WINDOW = timedelta(hours=24)
+
+log = get_logger("campaigns")
+
+SENT = "sent"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class _TemplateValues(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def render(template: str, conversation: Conversation) -> str:
+    """Remplace {user_id}, {channel} et {stage} ; les autres accolades restent telles quelles."""
+    return template.format_map(_TemplateValues(
+        user_id=conversation.user_id,
+        channel=getattr(conversation.channel, "value", conversation.channel),
+        stage=getattr(conversation.stage, "value", conversation.stage),
+    ))
+
+
+class CampaignRunner:
+    """
+    Exécute les campagnes de relance en tâche de fond :
+    - sélection par pages keyset (ordre des id) des conversations ciblées
+    - envois en parallèle (concurrency), limités par canal (seau de jetons)
+    - chaque envoi est d'abord réservé dans campaign_deliveries (contrainte
+      unique) : une campagne reprise après un arrêt ne renvoie jamais un message
+    - point de reprise et compteurs écrits après chaque page
+    - hors de la fenêtre de 24 h (WhatsApp, Messenger, Instagram) : modèle
+      approuvé ou tag de message de la campagne, sinon envoi ignoré (skipped)
+    Les campagnes « running » sont reprises au démarrage ; une pause est prise
+    en compte à la page suivante.
+    """
+
+    def __init__(self, concurrency: int, batch_size: int, rates: dict):
+        self.batch_size = batch_size
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._buckets = {channel: TokenBucket(rate) for channel, rate in rates.items()}
+        self._tasks: dict = {}
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(Campaign.id).where(Campaign.status == "running"))
+                running = result.scalars().all()
+        except Exception as e:
+            # Base indisponible au démarrage : les campagnes se reprennent via /resume
+            log.warning("reprise des campagnes impossible", extra={"error": str(e).splitlines()[0]})
+            return
+        for campaign_id in running:
+            log.info("campagne reprise", extra={"campaign_id": str(campaign_id)})
+            self.launch(campaign_id)
+
+    async def stop(self, timeout: float = 10.0):
+        """Interrompt les campagnes en cours ; elles restent « running » et reprennent au prochain démarrage."""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def launch(self, campaign_id: uuid.UUID) -> bool:
+        """Démarre l'exécution d'une campagne ; False si elle tourne déjà dans ce processus."""
+        if campaign_id in self._tasks:
+            return False
+        task = asyncio.create_task(self._run(campaign_id), name=f"campaign-{campaign_id}")
+        self._tasks[campaign_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(campaign_id, None))
+        return True
+
+    # ─────────────────────────────────────────────
+    # EXÉCUTION
+    # ─────────────────────────────────────────────
+
+    async def _run(self, campaign_id: uuid.UUID):
+        try:
+            async with AsyncSessionLocal() as db:
+                campaign = await db.get(Campaign, campaign_id)
+                await db.execute(update(Campaign).where(Campaign.id == campaign_id).values(status="running"))
+                await db.commit()
+
+            checkpoint = campaign.checkpoint
+            while True:
+                batch = await self._next_batch(campaign, checkpoint)
+                if not batch:
+                    break
+                last_inbound = await self._last_inbound([conversation.id for conversation in batch])
+                outcomes = await asyncio.gather(*(
+                    self._deliver(campaign, conversation, last_inbound.get(conversation.id)) for conversation in batch
+                ))
+                # Page interrompue (arrêt) : le point de reprise n'avance pas, les envois déjà réservés ne repartiront pas
+                interrupted = self._stopping
+                if not interrupted:
+                    checkpoint = batch[-1].id
+                status = await self._save_progress(campaign_id, checkpoint, Counter(o for o in outcomes if o))
+                if interrupted or status != "running":
+                    return
+
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Campaign).where(Campaign.id == campaign_id).where(Campaign.status == "running")
+                    .values(status="completed", finished_at=datetime.utcnow())
+                )
+                await db.commit()
+            log.info("campagne terminée", extra={"campaign_id": str(campaign_id)})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("campagne en échec", extra={"campaign_id": str(campaign_id)})
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(Campaign).where(Campaign.id == campaign_id).values(status="failed"))
+                await db.commit()
+
+    async def _next_batch(self, campaign: Campaign, after: Optional[uuid.UUID]) -> list:
+        """Page suivante de conversations ciblées, après `after` dans l'ordre des id (requête courte, pas de transaction longue)."""
+        query = (
+            select(Conversation)
+            .where(Conversation.stage.in_(campaign.stages.split(",")))
+            .where(Conversation.channel.in_(campaign.channels.split(",")))
+            .where(Conversation.updated_at < campaign.cutoff)
+            .order_by(Conversation.id)
+            .limit(self.batch_size)
+        )
+        if after is not None:
+            query = query.where(Conversation.id > after)
+        async with ReadSessionLocal() as db:
+            result = await db.execute(query)
+            return result.scalars().all()
+
+    @staticmethod
+    async def _last_inbound(conversation_ids: list) -> dict:
+        """Dernier message du client par conversation de la page (une requête, index (conversation_id, created_at))."""
+        async with ReadSessionLocal() as db:
+            result = await db.execute(
+                select(Message.conversation_id, func.max(Message.created_at))
+                .where(Message.conversation_id.in_(conversation_ids))
+                .where(Message.role == "user")
+                .group_by(Message.conversation_id)
+            )
+            return dict(result.all())
+
+    @staticmethod
+    def _outside_window_allowed(campaign: Campaign, channel: str) -> bool:
+        if channel == "whatsapp":
+            return bool(campaign.whatsapp_content_sid)
+        if channel in ("messenger", "instagram"):
+            return bool(campaign.messenger_tag)
+        return True
+
+    async def _save_progress(self, campaign_id: uuid.UUID, checkpoint, outcomes: Counter) -> str:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Campaign).where(Campaign.id == campaign_id).values(
+                    checkpoint=checkpoint,
+                    sent=Campaign.sent + outcomes[SENT],
+                    failed=Campaign.failed + outcomes[FAILED],
+                    skipped=Campaign.skipped + outcomes[SKIPPED],
+                )
+            )
+            status = (await db.execute(select(Campaign.status).where(Campaign.id == campaign_id))).scalar()
+            await db.commit()
+            return status
+
+    @staticmethod
+    async def _claim(db: AsyncSession, campaign_id: uuid.UUID, conversation_id: uuid.UUID) -> bool:
+        """Réserve l'envoi (INSERT ... ON CONFLICT DO NOTHING) ; False s'il est déjà réservé."""
+        insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+        result = await db.execute(
+            insert(CampaignDelivery)
+            .values(id=uuid.uuid4(), campaign_id=campaign_id, conversation_id=conversation_id, status="claimed", created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["campaign_id", "conversation_id"])
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    async def _deliver(self, campaign: Campaign, conversation: Conversation, last_inbound: Optional[datetime]) -> Optional[str]:
+        """Un envoi ; retourne SENT, FAILED, SKIPPED, ou None (déjà réservé, arrêt en cours)."""
+        channel = getattr(conversation.channel, "value", conversation.channel)
+        in_window = last_inbound is not None and datetime.utcnow() - last_inbound < SERVICE_WINDOW
+        async with self._slots:
+            if self._stopping:
+                return None
+            async with AsyncSessionLocal() as db:
+                if not await self._claim(db, campaign.id, conversation.id):
+                    return None
+
+                error = None
+                if channel not in self._buckets:
+                    # web : pas de canal sortant, le client doit revenir sur le site
+                    outcome, error = SKIPPED, "canal sans envoi sortant"
+                elif not in_window and not self._outside_window_allowed(campaign, channel):
+                    # Le texte libre serait refusé (Meta) ou accepté puis non délivré (Twilio, erreur 63016)
+                    outcome, error = SKIPPED, "hors de la fenêtre de 24 h, sans modèle approuvé ni tag"
+                else:
+                    await self._buckets[channel].acquire()
+                    try:
+                        if channel == "whatsapp" and not in_window:
+                            text, sent = await self._send_template(campaign, conversation)
+                        else:
+                            text = await self._render(campaign, conversation, db)
+                            tag = None if in_window else campaign.messenger_tag
+                            sent = await self._send(db, conversation, channel, campaign.name, text, tag)
+                        outcome = SENT if sent else FAILED
+                    except Exception as e:
+                        outcome, error = FAILED, str(e)[:200]
+                        log.exception("envoi de campagne en échec", extra={"campaign_id": str(campaign.id), "channel": channel})
+
+                await db.execute(
+                    update(CampaignDelivery)
+                    .where(CampaignDelivery.campaign_id == campaign.id)
+                    .where(CampaignDelivery.conversation_id == conversation.id)
+                    .values(status=outcome, error=error)
+                )
+                if outcome == SENT:
+                    # Même transaction : la relance apparaît dans l'historique de la conversation
+                    await save_message(db, conversation.id, "assistant", text, channel)
+                else:
+                    await db.commit()
+                return outcome
+
+    async def _render(self, campaign: Campaign, conversation: Conversation, db: AsyncSession) -> str:
+        text = render(campaign.template, conversation)
+        if not campaign.use_ai:
+            return text
+        # Le trafic en direct passe avant : attendre que le backlog LLM redescende
+        while get_llm().backlog() >= CAMPAIGN_MAX_LLM_BACKLOG:
+            await asyncio.sleep(1.0)
+        return await generate_follow_up(text, conversation, db)
+
+    @staticmethod
+    async def _send_template(campaign: Campaign, conversation: Conversation) -> tuple:
+        """Modèle WhatsApp approuvé ; retourne (trace pour l'historique, envoyé)."""
+        variables = {
+            key: render(value, conversation)
+            for key, value in json.loads(campaign.whatsapp_content_variables or "{}").items()
+        }
+        sent = await send_whatsapp_template(conversation.user_id, campaign.whatsapp_content_sid, variables)
+        return f"[Modèle WhatsApp {campaign.whatsapp_content_sid}] {json.dumps(variables, ensure_ascii=False)}", sent
+
+    @staticmethod
+    async def _send(db: AsyncSession, conversation: Conversation, channel: str, subject: str, text: str,
+                    tag: Optional[str] = None) -> bool:
+        if channel == "whatsapp":
+            return await send_whatsapp_message(conversation.user_id, text)
+        if channel in ("messenger", "instagram"):
+            return await send_messenger_message(conversation.user_id, text, tag)
+        message = build_message(conversation.user_id, subject, text)
+        sent = await send_email(message)
+        if sent:
+            # Une réponse du client à la relance retrouve la conversation
+            await link_email_thread(db, conversation.id, [message["Message-ID"]])
+        return sent
+
+    # ─────────────────────────────────────────────
+    # SUIVI
+    # ─────────────────────────────────────────────
+
+    async def deliveries(self, db: AsyncSession, campaign_id: uuid.UUID) -> dict:
+        """Envois par statut ; « claimed » hors exécution = envois interrompus, jamais relancés."""
+        result = await db.execute(
+            select(CampaignDelivery.status, func.count())
+            .where(CampaignDelivery.campaign_id == campaign_id)
+            .group_by(CampaignDelivery.status)
+        )
+        return dict(result.all())
+
+    def is_running(self, campaign_id: uuid.UUID) -> bool:
+        return campaign_id in self._tasks
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "rates": {channel: bucket.rate for channel, bucket in self._buckets.items()},
+        }
+
+
+campaigns = CampaignRunner(CAMPAIGN_CONCURRENCY, CAMPAIGN_BATCH_SIZE, CAMPAIGN_RATES)
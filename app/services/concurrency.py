@@ -0,0 +1,66 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+
+class KeyedLock:
+    """
+    Verrous asyncio indexés par clé (ex: numéro de destination).
+    Les appelants d'une même clé passent un par un, dans l'ordre d'arrivée ;
+    un verrou est supprimé dès qu'il n'a plus d'utilisateur.
+    """
+
+    def __init__(self):
+        self._locks: dict = {}
+
+    @asynccontextmanager
+    async def acquire(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class TokenBucket:
+    """Limiteur de débit à seau de jetons : `rate` jetons/s, rafale max `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Prend des jetons sans attendre ; retourne False si le seau est vide."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0):
+        """Attend que des jetons soient disponibles (les appelants sont servis dans l'ordre)."""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
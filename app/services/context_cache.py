@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Hashable, List, Optional
+
+CONTEXT_CACHE_TURNS = int(os.getenv("CONTEXT_CACHE_TURNS", "20"))
+CONTEXT_CACHE_MAX_CONVERSATIONS = int(os.getenv("CONTEXT_CACHE_MAX_CONVERSATIONS", "5000"))
+CONTEXT_CACHE_MAX_CHARS = int(os.getenv("CONTEXT_CACHE_MAX_CHARS", "20000"))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "1800"))
+
+
+class _Entry:
+    __slots__ = ("turns", "chars", "expires_at")
+
+    def __init__(self, max_turns: int, expires_at: float):
+        self.turns = deque(maxlen=max_turns)
+        self.chars = 0
+        self.expires_at = expires_at
+
+
+class ConversationContextCache:
+    """
+    Cache LRU + TTL des N derniers tours de chaque conversation, en mémoire.
+    Mémoire bornée par max_conversations x max_chars. Le TTL court depuis le
+    remplissage depuis la DB : il borne la durée pendant laquelle un autre
+    worker peut avoir écrit des tours absents de ce cache.
+    """
+
+    def __init__(self, max_turns: int, max_conversations: int, max_chars: int, ttl: float):
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[List[dict]]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(entry.turns)
+
+    def put(self, key: Hashable, turns: List[dict]):
+        entry = _Entry(self.max_turns, time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        for turn in turns[-self.max_turns:]:
+            self._push(entry, turn)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def append(self, key: Hashable, role: str, content: str, created_at: Optional[datetime] = None):
+        """Écriture directe : n'ajoute que si la conversation est déjà en cache."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        self._push(entry, {"role": role, "content": content, "created_at": created_at or datetime.utcnow()})
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def _push(self, entry: _Entry, turn: dict):
+        if len(entry.turns) == entry.turns.maxlen:
+            entry.chars -= len(entry.turns[0]["content"])
+        entry.turns.append(turn)
+        entry.chars += len(turn["content"])
+        # Plafond mémoire par conversation : on lâche les tours les plus anciens
+        while entry.chars > self.max_chars and len(entry.turns) > 1:
+            entry.chars -= len(entry.turns.popleft()["content"])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+context_cache = ConversationContextCache(
+    max_turns=CONTEXT_CACHE_TURNS,
+    max_conversations=CONTEXT_CACHE_MAX_CONVERSATIONS,
+    max_chars=CONTEXT_CACHE_MAX_CHARS,
+    ttl=CONTEXT_CACHE_TTL,
+)
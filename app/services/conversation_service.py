@@ -1,48 +1,319 @@
 ﻿from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from sqlalchemy.orm import selectinload
-from app.models_db import Conversation, Message, StageEnum
+from sqlalchemy import select, update, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from app.models_db import Conversation, Message, StageEnum, EmailThread, ArchivedConversation
+from app.services.context_cache import context_cache
+from app.services.archive_service import load_archived_conversation
+from app.services.funnel_service import funnel
+from app.services.concurrency import KeyedLock
+from app.services.metrics import DB_QUERY_SECONDS, timed
 from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+import base64
 import uuid
 
-async def get_or_create_conversation(db: AsyncSession, user_id: str, channel: str) -> Conversation:
+_turn_locks = KeyedLock()
+
+@timed(DB_QUERY_SECONDS, "find_active_conversation")
+async def find_active_conversation(db: AsyncSession, user_id: str, channel: str) -> Optional[Conversation]:
+    """
+    Conversation active (non terminée) la plus récente, sans charger ses messages.
+    Servie par l'index ix_conversations_active_lookup.
+    """
     result = await db.execute(
         select(Conversation)
         .where(Conversation.user_id == user_id)
         .where(Conversation.channel == channel)
         .where(Conversation.stage != StageEnum.completed)
-        .options(selectinload(Conversation.messages))
         .order_by(Conversation.updated_at.desc())
+        .limit(1)
     )
-    conversation = result.scalars().first()
+    return result.scalars().first()
+
+def turn_lock(user_id: str, channel: str):
+    """
+    Sérialise les tours d'un même (user_id, channel) dans ce processus : deux
+    messages rapprochés ne créent pas deux conversations et les stades sont
+    appliqués dans l'ordre d'arrivée. Entre workers, l'index unique partiel
+    uq_conversations_active garantit l'unicité de la conversation active.
+    """
+    return _turn_locks.acquire((user_id, channel))
+
+@timed(DB_QUERY_SECONDS, "get_or_create_conversation")
+async def get_or_create_conversation(db: AsyncSession, user_id: str, channel: str) -> Conversation:
+    conversation = await find_active_conversation(db, user_id, channel)
     if not conversation:
         conversation = Conversation(user_id=user_id, channel=channel, stage=StageEnum.greeting)
         db.add(conversation)
-        await db.commit()
-        await db.refresh(conversation)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Un autre worker a créé la conversation entre-temps : on la reprend
+            await db.rollback()
+            return await find_active_conversation(db, user_id, channel)
+        # Nouvelle conversation : contexte vide connu, pas de lecture à froid
+        context_cache.put(conversation.id, [])
+        funnel.record_entry(channel, StageEnum.greeting.value, conversation.created_at)
     return conversation
 
+@timed(DB_QUERY_SECONDS, "save_message")
 async def save_message(db: AsyncSession, conversation_id: uuid.UUID, role: str, content: str, channel: str) -> Message:
-    message = Message(conversation_id=conversation_id, role=role, content=content, channel=channel, timestamp=datetime.utcnow())
+    message = Message(conversation_id=conversation_id, role=role, content=content, channel=channel, created_at=datetime.utcnow())
     db.add(message)
     await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=datetime.utcnow()))
     await db.commit()
-    await db.refresh(message)
+    context_cache.append(conversation_id, role, content, message.created_at)
     return message
 
+def _stage_values(stage: str, previous_stage, now: datetime) -> dict:
+    """Valeurs d'UPDATE du stade : stage_changed_at n'avance que sur un vrai changement."""
+    values = {"stage": stage}
+    if previous_stage is not None and getattr(previous_stage, "value", previous_stage) != stage:
+        values["stage_changed_at"] = now
+    return values
+
+def _record_stage_change(channel: str, stage: str, previous_stage, stage_since: Optional[datetime], now: datetime):
+    """À appeler après le COMMIT : compte la transition dans les agrégats du funnel."""
+    previous = getattr(previous_stage, "value", previous_stage)
+    if previous is not None and previous != stage:
+        funnel.record_transition(channel, previous, stage, now, stage_since)
+
+@timed(DB_QUERY_SECONDS, "record_turn")
+async def record_turn(db: AsyncSession, conversation_id: uuid.UUID, channel: str, user_text: str,
+                      assistant_text: str, stage: str, user_at: Optional[datetime] = None,
+                      summary: Optional[str] = None, summary_upto: Optional[datetime] = None,
+                      previous_stage=None, stage_since: Optional[datetime] = None) -> None:
+    """
+    Unité de travail d'un tour IA : message utilisateur, réponse de l'assistant,
+    nouveau stade et updated_at écrits dans une seule transaction.
+    Les deux INSERT partent en un seul lot, suivis d'un UPDATE et du COMMIT.
+    Le résumé glissant, s'il a changé, part dans le même UPDATE.
+    previous_stage / stage_since (conversation lue en début de tour, sous le
+    verrou du tour) alimentent le funnel sans relire la conversation.
+    """
+    now = datetime.utcnow()
+    user_at = user_at or now
+    db.add_all([
+        Message(conversation_id=conversation_id, role="user", content=user_text, channel=channel, created_at=user_at),
+        Message(conversation_id=conversation_id, role="assistant", content=assistant_text, channel=channel, created_at=now),
+    ])
+    values = {"updated_at": now, **_stage_values(stage, previous_stage, now)}
+    if summary is not None:
+        values.update(summary=summary, summary_upto=summary_upto)
+    await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(**values))
+    await db.commit()
+    context_cache.append(conversation_id, "user", user_text, user_at)
+    context_cache.append(conversation_id, "assistant", assistant_text, now)
+    _record_stage_change(channel, stage, previous_stage, stage_since, now)
+
+@timed(DB_QUERY_SECONDS, "update_conversation_stage")
 async def update_conversation_stage(db: AsyncSession, conversation_id: uuid.UUID, stage: str):
-    await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(stage=stage, updated_at=datetime.utcnow()))
+    previous = (await db.execute(
+        select(Conversation.channel, Conversation.stage, Conversation.stage_changed_at).where(Conversation.id == conversation_id)
+    )).first()
+    if previous is None:
+        return
+    now = datetime.utcnow()
+    await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=now, **_stage_values(stage, previous.stage, now)))
     await db.commit()
+    _record_stage_change(previous.channel.value, stage, previous.stage, previous.stage_changed_at, now)
 
-async def get_conversation_history(db: AsyncSession, user_id: str, channel: str, limit: int = 50) -> list:
+@timed(DB_QUERY_SECONDS, "find_latest_active_conversation")
+async def find_latest_active_conversation(db: AsyncSession, user_id: str) -> Optional[Conversation]:
+    """Conversation active la plus récente d'un utilisateur, tous canaux confondus."""
     result = await db.execute(
         select(Conversation)
         .where(Conversation.user_id == user_id)
+        .where(Conversation.stage != StageEnum.completed)
+        .order_by(Conversation.updated_at.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+@timed(DB_QUERY_SECONDS, "close_sale")
+async def close_sale(db: AsyncSession, conversation_id: uuid.UUID, channel: str, confirmation: str,
+                     previous_stage=None, stage_since: Optional[datetime] = None) -> None:
+    """Passe la conversation en completed et enregistre la confirmation, en une transaction."""
+    now = datetime.utcnow()
+    completed = StageEnum.completed.value
+    db.add(Message(conversation_id=conversation_id, role="assistant", content=confirmation, channel=channel, created_at=now))
+    await db.execute(update(Conversation).where(Conversation.id == conversation_id).values(updated_at=now, **_stage_values(completed, previous_stage, now)))
+    await db.commit()
+    context_cache.append(conversation_id, "assistant", confirmation, now)
+    _record_stage_change(channel, completed, previous_stage, stage_since, now)
+
+@timed(DB_QUERY_SECONDS, "find_email_thread")
+async def find_email_thread(db: AsyncSession, message_ids: list) -> Optional[Conversation]:
+    """
+    Conversation active à laquelle répond un email (In-Reply-To / References),
+    en une requête sur l'index unique email_threads.message_id.
+    """
+    if not message_ids:
+        return None
+    result = await db.execute(
+        select(Conversation)
+        .join(EmailThread, EmailThread.conversation_id == Conversation.id)
+        .where(EmailThread.message_id.in_(message_ids))
+        .where(Conversation.stage != StageEnum.completed)
+        .order_by(EmailThread.created_at.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+@timed(DB_QUERY_SECONDS, "link_email_thread")
+async def link_email_thread(db: AsyncSession, conversation_id: uuid.UUID, message_ids: list) -> None:
+    """Rattache des Message-ID (reçus ou envoyés) à la conversation ; les relivraisons sont ignorées."""
+    rows = [{"id": uuid.uuid4(), "message_id": m, "conversation_id": conversation_id, "created_at": datetime.utcnow()} for m in message_ids if m]
+    if not rows:
+        return
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    await db.execute(insert(EmailThread).values(rows).on_conflict_do_nothing(index_elements=["message_id"]))
+    await db.commit()
+
+@timed(DB_QUERY_SECONDS, "get_conversation_context")
+async def get_conversation_context(db: AsyncSession, conversation_id: uuid.UUID) -> list:
+    """
+    Derniers tours de la conversation pour le prompt, servis par le cache mémoire
+    et chargés depuis la DB au premier accès (ou après expiration).
+    """
+    turns = context_cache.get(conversation_id)
+    if turns is not None:
+        return turns
+    result = await db.execute(
+        select(Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(context_cache.max_turns)
+    )
+    turns = [{"role": row.role, "content": row.content, "created_at": row.created_at} for row in reversed(result.all())]
+    context_cache.put(conversation_id, turns)
+    return turns
+
+def encode_cursor(created_at: datetime, message_id: uuid.UUID) -> str:
+    """Curseur opaque (created_at, id) pour la pagination keyset de l'historique."""
+    raw = f"{created_at.isoformat()}|{message_id.hex}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Lève ValueError si le curseur est invalide."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(message_id)
+    except Exception:
+        raise ValueError(f"Curseur invalide : {cursor}")
+
+@timed(DB_QUERY_SECONDS, "find_latest_conversation_id")
+async def find_latest_conversation_id(db: AsyncSession, user_id: str, channel: str) -> Optional[uuid.UUID]:
+    result = await db.execute(
+        select(Conversation.id)
+        .where(Conversation.user_id == user_id)
         .where(Conversation.channel == channel)
-        .options(selectinload(Conversation.messages))
         .order_by(Conversation.updated_at.desc())
+        .limit(1)
     )
-    conversation = result.scalars().first()
-    if not conversation:
-        return []
-    return [{"from": "user" if msg.role == "user" else "ia", "text": msg.content, "timestamp": int(msg.timestamp.timestamp() * 1000)} for msg in conversation.messages[-limit:]]
+    return result.scalar()
+
+@timed(DB_QUERY_SECONDS, "find_history_version")
+async def find_history_version(db: AsyncSession, user_id: str, channel: str, archived: bool = False) -> Optional[tuple]:
+    """
+    (conversation_id, updated_at, archivée) de la conversation que servirait
+    get_conversation_page : validateur HTTP de l'historique. Toute écriture
+    (tour, relance, paiement) avance updated_at. Une lecture d'index
+    (deux sans conversation en base, table d'archive).
+    """
+    if not archived:
+        row = (await db.execute(
+            select(Conversation.id, Conversation.updated_at)
+            .where(Conversation.user_id == user_id)
+            .where(Conversation.channel == channel)
+            .order_by(Conversation.updated_at.desc())
+            .limit(1)
+        )).first()
+        if row:
+            return row.id, row.updated_at, False
+    row = (await db.execute(
+        select(ArchivedConversation.id, ArchivedConversation.updated_at)
+        .where(ArchivedConversation.user_id == user_id)
+        .where(ArchivedConversation.channel == channel)
+        .order_by(ArchivedConversation.updated_at.desc())
+        .limit(1)
+    )).first()
+    return (row.id, row.updated_at, True) if row else None
+
+def _page_view(rows: list, limit: int, before: Optional[str], after: Optional[str]) -> dict:
+    """rows : limit + 1 messages au plus, dans l'ordre de parcours (décroissant sauf avec `after`)."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows.reverse()
+    if not rows:
+        return {"messages": [], "before": before, "after": after, "has_more": False}
+
+    return {
+        "messages": [
+            {"from": "user" if row.role == "user" else "ia", "text": row.content, "timestamp": int(row.created_at.timestamp() * 1000)}
+            for row in rows
+        ],
+        "before": encode_cursor(rows[0].created_at, rows[0].id),
+        "after": encode_cursor(rows[-1].created_at, rows[-1].id),
+        "has_more": has_more,
+    }
+
+@timed(DB_QUERY_SECONDS, "get_conversation_page")
+async def get_conversation_page(db: AsyncSession, user_id: str, channel: str, limit: int = 50,
+                                before: Optional[str] = None, after: Optional[str] = None, archived: bool = False,
+                                conversation_id: Optional[uuid.UUID] = None) -> dict:
+    """
+    Page de l'historique de la dernière conversation, paginée côté DB.
+    Sans curseur : les `limit` messages les plus récents. `before` remonte vers
+    les plus anciens, `after` avance vers les plus récents. Chaque page coûte
+    une lecture d'index (conversation_id, created_at), quelle que soit la longueur.
+    Sans conversation en base (ou avec archived=True), la dernière conversation
+    archivée est servie, avec les mêmes curseurs.
+    conversation_id : conversation déjà résolue par l'appelant (find_history_version).
+    """
+    if conversation_id is None and not archived:
+        conversation_id = await find_latest_conversation_id(db, user_id, channel)
+    if not conversation_id:
+        return await _get_archived_page(db, user_id, channel, limit, before, after)
+
+    position = tuple_(Message.created_at, Message.id)
+    query = (
+        select(Message.id, Message.role, Message.content, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+    )
+    if after:
+        query = query.where(position > tuple_(*decode_cursor(after))).order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if before:
+            query = query.where(position < tuple_(*decode_cursor(before)))
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    return _page_view(rows, limit, before, after)
+
+async def _get_archived_page(db: AsyncSession, user_id: str, channel: str, limit: int,
+                             before: Optional[str], after: Optional[str]) -> dict:
+    """Même pagination sur une conversation archivée, décompressée en mémoire (conversation terminée, taille bornée)."""
+    messages = await load_archived_conversation(db, user_id, channel)
+    if not messages:
+        return {"messages": [], "before": None, "after": None, "has_more": False}
+
+    rows = [SimpleNamespace(id=uuid.UUID(m["id"]), role=m["role"], content=m["content"], created_at=m["created_at"]) for m in messages]
+    if after:
+        position = decode_cursor(after)
+        rows = [r for r in rows if (r.created_at, r.id) > position]
+    else:
+        if before:
+            position = decode_cursor(before)
+            rows = [r for r in rows if (r.created_at, r.id) < position]
+        rows.reverse()
+    return _page_view(rows[:limit + 1], limit, before, after)
+
+@timed(DB_QUERY_SECONDS, "get_conversation_history")
+async def get_conversation_history(db: AsyncSession, user_id: str, channel: str, limit: int = 50) -> list:
+    page = await get_conversation_page(db, user_id, channel, limit)
+    return page["messages"]
@@ -0,0 +1,271 @@
+import os
+import re
+import hmac
+import time
+import base64
+import hashlib
+from email.parser import HeaderParser
+from email.utils import parseaddr
+from typing import Optional
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Taille maximale conservée par champ texte (text, html, headers...) ; le reste est ignoré
+EMAIL_MAX_FIELD_BYTES = int(os.getenv("EMAIL_MAX_FIELD_BYTES", str(256 * 1024)))
+# Corps de requête maximal (pièces jointes comprises), au-delà : 413
+EMAIL_MAX_BODY_BYTES = int(os.getenv("EMAIL_MAX_BODY_BYTES", str(30 * 1024 * 1024)))
+# Texte de réponse transmis au prompt, après retrait des citations et signatures
+EMAIL_MAX_REPLY_CHARS = int(os.getenv("EMAIL_MAX_REPLY_CHARS", "4000"))
+
+# Authentification du webhook (au moins un des deux, sinon tout est refusé) :
+# Mailgun signe chaque requête (timestamp, token, signature) avec la clé de signature du compte
+MAILGUN_WEBHOOK_SIGNING_KEY = os.getenv("MAILGUN_WEBHOOK_SIGNING_KEY")
+# SendGrid ne signe pas l'inbound parse : secret partagé dans l'URL (https://pulsai:<secret>@.../email ou ?token=<secret>)
+EMAIL_WEBHOOK_SECRET = os.getenv("EMAIL_WEBHOOK_SECRET")
+# Âge maximal d'une signature Mailgun (rejeu), en secondes
+EMAIL_WEBHOOK_MAX_AGE = int(os.getenv("EMAIL_WEBHOOK_MAX_AGE", "300"))
+
+# Champs utiles des webhooks inbound parse (Mailgun, SendGrid, Postmark...) ; les autres sont ignorés
+TEXT_FIELDS = {
+    "from", "to", "subject", "text", "body-plain", "stripped-text", "html", "body-html", "headers",
+    "message-id", "message-headers", "in-reply-to", "references", "auto-submitted", "precedence",
+    "timestamp", "token", "signature",
+}
+
+
+class EmailBodyTooLarge(Exception):
+    """Corps de requête au-delà de EMAIL_MAX_BODY_BYTES."""
+
+
+class _FormCollector:
+    """
+    Callbacks du parseur multipart : les champs texte sont accumulés (bornés),
+    les fichiers (pièces jointes) ne sont que comptés, jamais gardés en mémoire.
+    """
+
+    def __init__(self):
+        self.fields: dict = {}
+        self.attachments: list = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: dict = {}
+        self._name: Optional[str] = None
+        self._filename: Optional[str] = None
+        self._chunks: list = []
+        self._size = 0
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = self._filename = None
+        self._chunks = []
+        self._size = 0
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b"").decode("latin-1"))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace").lower()
+        if b"filename" in options:
+            self._filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self._size += end - start
+        if self._filename is not None or self._name not in TEXT_FIELDS:
+            return
+        kept = sum(len(c) for c in self._chunks)
+        if kept < EMAIL_MAX_FIELD_BYTES:
+            self._chunks.append(data[start:min(end, start + EMAIL_MAX_FIELD_BYTES - kept)])
+
+    def on_part_end(self):
+        if self._filename is not None:
+            self.attachments.append({"name": self._filename, "size": self._size})
+        elif self._name in TEXT_FIELDS:
+            self.fields[self._name] = b"".join(self._chunks).decode("utf-8", "replace")
+        self._chunks = []
+
+
+async def read_email_form(request: Request) -> tuple:
+    """
+    Lit le formulaire d'un webhook email en flux : retourne (champs texte, pièces jointes).
+    Les pièces jointes ne sont ni bufferisées ni écrites sur disque, seuls
+    leur nom et leur taille sont conservés.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        # application/x-www-form-urlencoded : pas de pièce jointe possible
+        form = await request.form()
+        return {k.lower(): v for k, v in form.items() if k.lower() in TEXT_FIELDS and isinstance(v, str)}, []
+
+    collector = _FormCollector()
+    parser = MultipartParser(options.get(b"boundary", b""), collector.callbacks())
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > EMAIL_MAX_BODY_BYTES:
+            raise EmailBodyTooLarge(f"Corps email au-delà de {EMAIL_MAX_BODY_BYTES} octets")
+        parser.write(chunk)
+    parser.finalize()
+    return collector.fields, collector.attachments
+
+
+# ─────────────────────────────────────────────
+# AUTHENTIFICATION DU WEBHOOK
+# ─────────────────────────────────────────────
+
+def webhook_auth_configured() -> bool:
+    return bool(MAILGUN_WEBHOOK_SIGNING_KEY or EMAIL_WEBHOOK_SECRET)
+
+
+def verify_shared_secret(request: Request) -> Optional[bool]:
+    """
+    Secret partagé présenté en Basic auth (mot de passe) ou en paramètre token :
+    None si aucun n'est présenté, sinon True / False. Vérifiable avant de lire le corps.
+    """
+    presented = request.query_params.get("token")
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("basic "):
+        try:
+            presented = base64.b64decode(authorization[6:]).decode().partition(":")[2]
+        except (ValueError, UnicodeDecodeError):
+            return False
+    if presented is None:
+        return None
+    return bool(EMAIL_WEBHOOK_SECRET) and hmac.compare_digest(presented.encode(), EMAIL_WEBHOOK_SECRET.encode())
+
+
+def verify_mailgun_signature(fields: dict) -> bool:
+    """Signature Mailgun : HMAC-SHA256(clé de signature, timestamp + token), timestamp récent."""
+    timestamp, token, signature = fields.get("timestamp", ""), fields.get("token", ""), fields.get("signature", "")
+    if not (MAILGUN_WEBHOOK_SIGNING_KEY and timestamp and token and signature):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > EMAIL_WEBHOOK_MAX_AGE:
+            return False
+    except ValueError:
+        return False
+    expected = hmac.new(MAILGUN_WEBHOOK_SIGNING_KEY.encode(), f"{timestamp}{token}".encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+# ─────────────────────────────────────────────
+# EN-TÊTES ET FIL DE DISCUSSION
+# ─────────────────────────────────────────────
+
+_MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+
+
+def message_ids(value: Optional[str]) -> list:
+    """Identifiants <...> d'un en-tête Message-ID / In-Reply-To / References, dans l'ordre."""
+    return _MESSAGE_ID.findall(value or "")
+
+
+def parse_inbound_email(fields: dict, attachments: list) -> dict:
+    """Normalise les champs du webhook : expéditeur, sujet, identifiants de fil, texte de la réponse."""
+    # En-têtes bruts (SendGrid "headers", Mailgun "message-headers" en JSON) en complément des champs dédiés
+    headers = HeaderParser().parsestr(fields.get("headers", "")) if fields.get("headers") else {}
+    raw_headers = fields.get("message-headers", "")
+
+    def header(name: str) -> str:
+        value = fields.get(name.lower()) or headers.get(name) or ""
+        if not value and raw_headers:
+            match = re.search(rf'\["{name}",\s*"([^"]*)"\]', raw_headers, re.IGNORECASE)
+            value = match.group(1) if match else ""
+        return value
+
+    _, sender = parseaddr(header("From"))
+    references = message_ids(header("References"))
+    in_reply_to = message_ids(header("In-Reply-To"))
+
+    # Mailgun fournit déjà la réponse sans citation ni signature
+    text = fields.get("stripped-text") or extract_reply(
+        fields.get("text") or fields.get("body-plain") or html_to_text(fields.get("html") or fields.get("body-html") or "")
+    )
+    return {
+        "sender": sender.lower(),
+        "subject": header("Subject").strip(),
+        "message_id": (message_ids(header("Message-ID")) or [""])[0],
+        # Du plus direct au plus ancien : parent, puis le reste du fil
+        "thread_ids": list(dict.fromkeys(in_reply_to + references[::-1])),
+        "references": references,
+        # Réponses automatiques (absence, accusés de lecture) : jamais de réponse, sinon boucle entre robots
+        "automatic": header("Auto-Submitted").strip().lower() not in ("", "no")
+        or header("Precedence").strip().lower() in ("bulk", "auto_reply", "junk"),
+        "text": text,
+        "attachments": attachments,
+    }
+
+
+# ─────────────────────────────────────────────
+# CITATIONS ET SIGNATURES
+# ─────────────────────────────────────────────
+
+# Début de la partie citée : tout ce qui suit est l'historique renvoyé par le client mail
+_QUOTE_HEADERS = [
+    re.compile(r"^-{2,}\s*(original message|message d'origine|forwarded message|message transféré)\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+    re.compile(r"^(from|de)\s*:\s.+", re.IGNORECASE),
+]
+# « Le 3 oct. 2026 à 10:02, Jean <j@x.fr> a écrit : » / « On Mon, ... wrote: », parfois sur 2-3 lignes
+_ATTRIBUTION = re.compile(r"^(le|on)\s.{0,300}?(a écrit|wrote)\s*:\s*$", re.IGNORECASE | re.DOTALL)
+# Début de signature : délimiteur standard « -- » ou mentions de client mobile
+_SIGNATURE = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^(envoyé de mon|sent from my|envoyé depuis|get outlook for)\b", re.IGNORECASE),
+]
+
+
+def extract_reply(text: str) -> str:
+    """
+    Texte écrit par le client : s'arrête à la première citation (attribution
+    « a écrit : », « -----Original Message----- », bloc From:) ou signature,
+    et ignore les lignes citées « > ». Borné à EMAIL_MAX_REPLY_CHARS.
+    """
+    lines = text.replace("\r\n", "\n").split("\n")
+    kept = []
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if any(p.match(stripped) for p in _SIGNATURE + _QUOTE_HEADERS):
+            break
+        if stripped[:3].lower() in ("le ", "on ") and any(
+            _ATTRIBUTION.match(" ".join(l.strip() for l in lines[i:i + n])) for n in (1, 2, 3)
+        ):
+            break
+        if stripped.startswith(">"):
+            continue
+        kept.append(line.rstrip())
+
+    reply = "\n".join(kept).strip()
+    # Message entièrement cité (transfert sans commentaire) : on garde le texte d'origine
+    return (reply or text.strip())[:EMAIL_MAX_REPLY_CHARS]
+
+
+def html_to_text(html: str) -> str:
+    """Conversion minimale pour les emails sans partie texte."""
+    html = re.sub(r"(?is)<(script|style|blockquote).*?</\1>", "", html)
+    html = re.sub(r"(?i)<br\s*/?>|</p>|</div>", "\n", html)
+    text = re.sub(r"<[^>]+>", "", html)
+    return re.sub(r"\n{3,}", "\n\n", text.replace("&nbsp;", " ").replace("&amp;", "&")).strip()
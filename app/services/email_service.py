@@ -0,0 +1,167 @@
+import os
+import time
+import random
+import asyncio
+import smtplib
+from email.message import EmailMessage
+from email.utils import make_msgid, formatdate
+from typing import Optional
+from app.services.metrics import observe_outbound
+from app.logging_config import get_logger, LOG_SAMPLE_RATE
+
+# Surchargeable pour pointer vers un serveur SMTP local (ex: python -m aiosmtpd -n -l localhost:1025)
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_SSL = os.getenv("SMTP_SSL", "false").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+# Connexions SMTP ouvertes en parallèle, réutilisées d'un envoi à l'autre
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "2"))
+EMAIL_FROM = os.getenv("EMAIL_FROM", "PulsAI <assistant@pulsai.app>")
+# Domaine des Message-ID générés
+EMAIL_DOMAIN = os.getenv("EMAIL_DOMAIN", EMAIL_FROM.rsplit("@", 1)[-1].strip("> "))
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+log = get_logger("email")
+
+
+class SMTPPool:
+    """
+    Pool de connexions SMTP (smtplib exécuté dans des threads) : au plus
+    `size` envois simultanés, connexions gardées ouvertes entre deux envois
+    (pas de TCP + STARTTLS + AUTH à chaque message). Une connexion fermée
+    par le serveur est rouverte au prochain essai.
+    """
+
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self.size = max(1, size)
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle: list = []
+        self._opened = 0
+        self._sent = 0
+        self._failed = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if SMTP_SSL else smtplib.SMTP
+        conn = smtp_class(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS and not SMTP_SSL and conn.has_extn("starttls"):
+            conn.starttls()
+        if SMTP_USERNAME:
+            conn.login(SMTP_USERNAME, SMTP_PASSWORD or "")
+        self._opened += 1
+        return conn
+
+    @staticmethod
+    def _discard(conn: Optional[smtplib.SMTP]):
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    async def send(self, message: EmailMessage):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            for attempt in range(SMTP_MAX_RETRIES + 1):
+                started = time.perf_counter()
+                try:
+                    if conn is None:
+                        conn = await asyncio.to_thread(self._connect)
+                    await asyncio.to_thread(conn.send_message, message)
+                    observe_outbound("smtp", started, 250)
+                    self._idle.append(conn)
+                    self._sent += 1
+                    return
+                except smtplib.SMTPRecipientsRefused:
+                    observe_outbound("smtp", started, 550)
+                    self._idle.append(conn)
+                    self._failed += 1
+                    raise
+                except smtplib.SMTPResponseException as e:
+                    observe_outbound("smtp", started, e.smtp_code)
+                    # 5xx : refus définitif (destinataire invalide...), la connexion reste utilisable
+                    if e.smtp_code >= 500 or attempt == SMTP_MAX_RETRIES:
+                        self._idle.append(conn)
+                        self._failed += 1
+                        raise
+                except (smtplib.SMTPException, OSError):
+                    observe_outbound("smtp", started)
+                    self._discard(conn)
+                    conn = None
+                    if attempt == SMTP_MAX_RETRIES:
+                        self._failed += 1
+                        raise
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                await asyncio.to_thread(conn.quit)
+            except Exception:
+                self._discard(conn)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "opened": self._opened,
+            "sent": self._sent,
+            "failed": self._failed,
+        }
+
+
+_pool: Optional[SMTPPool] = None
+
+
+def get_smtp_pool() -> SMTPPool:
+    global _pool
+    if _pool is None:
+        _pool = SMTPPool()
+    return _pool
+
+
+async def close_smtp_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def build_message(to_address: str, subject: str, text: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = EMAIL_FROM
+    message["To"] = to_address
+    message["Subject"] = subject
+    message["Date"] = formatdate(localtime=False)
+    message["Message-ID"] = make_msgid(domain=EMAIL_DOMAIN)
+    message.set_content(text)
+    return message
+
+
+def build_reply(to_address: str, subject: str, text: str, in_reply_to: str = "", references: Optional[list] = None) -> EmailMessage:
+    """Réponse dans le fil du client : sujet « Re: », In-Reply-To et References."""
+    if not subject.lower().startswith(("re:", "re :")):
+        subject = f"Re: {subject or 'PulsAI'}"
+    message = build_message(to_address, subject, text)
+    if in_reply_to:
+        message["In-Reply-To"] = in_reply_to
+        message["References"] = " ".join(list(references or []) + [in_reply_to])
+    return message
+
+
+async def send_email(message: EmailMessage) -> bool:
+    """Envoie un email via le pool SMTP. Retourne False en cas d'échec (déjà journalisé)."""
+    try:
+        await get_smtp_pool().send(message)
+        log.info("email envoyé", extra={"user": message["To"], "message_id": message["Message-ID"], "sample": LOG_SAMPLE_RATE})
+        return True
+    except Exception as e:
+        log.error("échec d'envoi", extra={"user": message["To"], "error": str(e)})
+        return False
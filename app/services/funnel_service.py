@@ -0,0 +1,189 @@
+import os
+import asyncio
+from bisect import bisect_left
+from datetime import datetime, date
+from typing import Optional
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models_db import FunnelDaily, FunnelTransition, FunnelStageDuration, StageEnum
+from app.logging_config import get_logger
+
+FUNNEL_FLUSH_INTERVAL = float(os.getenv("FUNNEL_FLUSH_INTERVAL", "15"))
+FLUSH_BATCH_SIZE = 500
+
+# Seuils (secondes) de l'histogramme de temps passé dans un stade ; 0 = au-delà du dernier seuil
+DURATION_BUCKETS = [60, 300, 900, 3600, 4 * 3600, 86400, 3 * 86400, 7 * 86400, 30 * 86400]
+OVERFLOW_BUCKET = 0
+
+STAGES = [stage.value for stage in StageEnum]
+
+log = get_logger("funnel")
+
+
+def duration_bucket(seconds: float) -> int:
+    index = bisect_left(DURATION_BUCKETS, seconds)
+    return DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else OVERFLOW_BUCKET
+
+
+class FunnelRecorder:
+    """
+    Agrégats incrémentaux du funnel de vente, par jour et par canal :
+    - entrées dans chaque stade (création = entrée en greeting)
+    - transitions stade -> stade
+    - histogramme du temps passé dans le stade quitté
+    Les changements de stade sont comptés en mémoire (O(1) sur le chemin
+    chaud) et écrits par lots en upsert, comme les compteurs d'admission.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._entered: dict = {}
+        self._transitions: dict = {}
+        self._durations: dict = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+    @staticmethod
+    def _add(counters: dict, key: tuple):
+        counters[key] = counters.get(key, 0) + 1
+
+    def record_entry(self, channel: str, stage: str, at: datetime):
+        self._add(self._entered, (at.date(), channel, stage))
+
+    def record_transition(self, channel: str, from_stage: str, to_stage: str, at: datetime, since: Optional[datetime]):
+        day = at.date()
+        self._add(self._entered, (day, channel, to_stage))
+        self._add(self._transitions, (day, channel, from_stage, to_stage))
+        # Conversations antérieures à stage_changed_at : durée inconnue, pas d'observation
+        if since is not None:
+            self._add(self._durations, (day, channel, from_stage, duration_bucket((at - since).total_seconds())))
+
+    async def flush(self):
+        """Écrit les compteurs accumulés (upsert par lots, une transaction)."""
+        if not (self._entered or self._transitions or self._durations):
+            return
+        batches = (
+            (FunnelDaily, ["day", "channel", "stage"], self._entered),
+            (FunnelTransition, ["day", "channel", "from_stage", "to_stage"], self._transitions),
+            (FunnelStageDuration, ["day", "channel", "stage", "bucket"], self._durations),
+        )
+        self._entered, self._transitions, self._durations = {}, {}, {}
+        try:
+            async with AsyncSessionLocal() as db:
+                insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+                for model, keys, counters in batches:
+                    rows = [{**dict(zip(keys, key)), "count": count} for key, count in counters.items()]
+                    for i in range(0, len(rows), FLUSH_BATCH_SIZE):
+                        statement = insert(model).values(rows[i:i + FLUSH_BATCH_SIZE])
+                        statement = statement.on_conflict_do_update(
+                            index_elements=keys, set_={"count": model.count + statement.excluded.count}
+                        )
+                        await db.execute(statement)
+                await db.commit()
+            self.flushes += 1
+        except Exception as e:
+            # Remis en attente pour le prochain passage
+            for (_, _, counters), name in zip(batches, ("_entered", "_transitions", "_durations")):
+                target = getattr(self, name)
+                for key, count in counters.items():
+                    target[key] = target.get(key, 0) + count
+            self.flush_errors += 1
+            log.error("échec d'écriture des agrégats du funnel", extra={"error": str(e)})
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="funnel-flush")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._entered) + len(self._transitions) + len(self._durations),
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+funnel = FunnelRecorder(FUNNEL_FLUSH_INTERVAL)
+
+
+# ─────────────────────────────────────────────
+# LECTURE
+# ─────────────────────────────────────────────
+
+def _percentile(buckets: dict, q: float) -> Optional[int]:
+    """Seuil du bucket contenant le quantile q (borne haute, en secondes) ; None si au-delà du dernier seuil."""
+    total = sum(buckets.values())
+    if not total:
+        return None
+    seen = 0
+    for bound in DURATION_BUCKETS + [OVERFLOW_BUCKET]:
+        seen += buckets.get(bound, 0)
+        if seen >= q * total:
+            return bound or None
+    return None
+
+
+async def funnel_report(db: AsyncSession, since: date, until: date, channel: Optional[str] = None) -> dict:
+    """
+    Funnel sur [since, until] depuis les seuls agrégats : trois requêtes
+    GROUP BY sur des tables de quelques lignes par jour, quel que soit le
+    volume de conversations et de messages.
+    """
+    def scoped(query, model):
+        query = query.where(model.day >= since).where(model.day <= until)
+        return query.where(model.channel == channel) if channel else query
+
+    entered = (await db.execute(scoped(
+        select(FunnelDaily.channel, FunnelDaily.stage, func.sum(FunnelDaily.count))
+        .group_by(FunnelDaily.channel, FunnelDaily.stage), FunnelDaily
+    ))).all()
+    transitions = (await db.execute(scoped(
+        select(FunnelTransition.channel, FunnelTransition.from_stage, FunnelTransition.to_stage, func.sum(FunnelTransition.count))
+        .group_by(FunnelTransition.channel, FunnelTransition.from_stage, FunnelTransition.to_stage), FunnelTransition
+    ))).all()
+    durations = (await db.execute(scoped(
+        select(FunnelStageDuration.channel, FunnelStageDuration.stage, FunnelStageDuration.bucket, func.sum(FunnelStageDuration.count))
+        .group_by(FunnelStageDuration.channel, FunnelStageDuration.stage, FunnelStageDuration.bucket), FunnelStageDuration
+    ))).all()
+
+    channels: dict = {}
+
+    def view(name: str) -> dict:
+        return channels.setdefault(name, {"entered": dict.fromkeys(STAGES, 0), "transitions": [], "_durations": {}})
+
+    for name, stage, count in entered:
+        for target in (view(name), view("all")):
+            target["entered"][stage] = target["entered"].get(stage, 0) + int(count)
+    for name, from_stage, to_stage, count in transitions:
+        view(name)["transitions"].append({"from": from_stage, "to": to_stage, "count": int(count)})
+    for name, stage, bucket, count in durations:
+        for target in (view(name), view("all")):
+            histogram = target["_durations"].setdefault(stage, {})
+            histogram[bucket] = histogram.get(bucket, 0) + int(count)
+
+    for data in channels.values():
+        started = data["entered"]["greeting"]
+        data["conversion_rate"] = round(data["entered"]["completed"] / started, 4) if started else None
+        data["time_in_stage_s"] = {
+            stage: {"p50": _percentile(histogram, 0.5), "p90": _percentile(histogram, 0.9), "count": sum(histogram.values())}
+            for stage, histogram in data.pop("_durations").items()
+        }
+        data["transitions"].sort(key=lambda t: -t["count"])
+    # Les transitions « all » se déduisent des canaux : pas de double liste
+    channels.get("all", {}).pop("transitions", None)
+
+    return {"since": since.isoformat(), "until": until.isoformat(), "channels": channels}
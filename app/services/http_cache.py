@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+from typing import Any, Optional
+from fastapi import Request
+from fastapi.responses import Response, JSONResponse as _StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:  # encodeur de la bibliothèque standard, plus lent
+    orjson = None
+
+# Durée de cache navigateur/CDN des catalogues statiques (plans, canaux), en secondes
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "300"))
+# Historique et stade : réutilisables seulement après revalidation (If-None-Match -> 304)
+REVALIDATE = "private, no-cache"
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """Réponse JSON par défaut de l'application : orjson si installé."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def make_etag(*parts, weak: bool = False) -> str:
+    digest = hashlib.blake2b("|".join(str(p) for p in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def is_fresh(request: Request, etag: str) -> bool:
+    """If-None-Match correspond à l'ETag (comparaison faible, RFC 9110 §13.1.2)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in header.split(","))
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def conditional(request: Request, content: Any, etag: str, cache_control: str = REVALIDATE) -> Response:
+    """304 si le client a déjà cette version, sinon le corps sérialisé avec ses validateurs."""
+    if is_fresh(request, etag):
+        return not_modified(etag, cache_control)
+    return Response(dumps(content), media_type="application/json", headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+class StaticJSON:
+    """
+    Corps JSON immuable, sérialisé une seule fois au chargement du module,
+    avec son ETag (empreinte du corps) : chaque appel ne fait plus qu'une
+    comparaison d'en-tête.
+    """
+
+    def __init__(self, content: Any, max_age: int = CATALOG_MAX_AGE):
+        self.body = dumps(content)
+        self.etag = make_etag(self.body.decode())
+        self.cache_control = f"public, max-age={max_age}"
+
+    def response(self, request: Optional[Request] = None) -> Response:
+        if request is not None and is_fresh(request, self.etag):
+            return not_modified(self.etag, self.cache_control)
+        return Response(self.body, media_type="application/json", headers={"ETag": self.etag, "Cache-Control": self.cache_control})
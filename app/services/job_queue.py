@@ -0,0 +1,281 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+from app.logging_config import get_logger
+
+log = get_logger("jobs")
+
+
+class QueueFullError(Exception):
+    """Levée quand la file est pleine et que le délai d'attente d'enqueue est dépassé."""
+
+
+class JobQueue:
+    """
+    File de jobs asyncio en mémoire, traitée par un pool de workers.
+    - profondeur bornée (maxsize) avec backpressure sur enqueue()
+    - dédoublonnage sur une clé (ex: MessageSid Twilio)
+    - drain propre à l'arrêt
+    - métriques : profondeur, temps d'attente, jobs traités / en échec
+    Chaque job s'exécute dans le contexte (contextvars) de l'appelant
+    d'enqueue() : les logs du job portent l'identifiant de la requête.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 4,
+        maxsize: int = 1000,
+        enqueue_timeout: float = 0.5,
+        dedup_size: int = 10000,
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.enqueue_timeout = enqueue_timeout
+        self.dedup_size = dedup_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._accepting = False
+
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._duplicates = 0
+        self._rejected = 0
+        self._in_flight = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._accepting = True
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 25.0):
+        """Refuse les nouveaux jobs, attend la fin de ceux en file puis arrête les workers."""
+        self._accepting = False
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("jobs abandonnés à l'arrêt", extra={"queue": self.name, "jobs": self._queue.qsize(), "timeout_s": timeout})
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, payload: Any, key: Optional[Hashable] = None) -> bool:
+        """
+        Ajoute un job à la file.
+        Retourne False si la clé a déjà été vue (doublon), lève QueueFullError
+        si la file reste pleine plus de enqueue_timeout secondes.
+        """
+        if not self._accepting:
+            raise QueueFullError(f"File '{self.name}' arrêtée")
+
+        if key is not None:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self._duplicates += 1
+                return False
+            self._remember(key)
+
+        try:
+            await asyncio.wait_for(
+                self._queue.put((time.monotonic(), contextvars.copy_context(), payload)),
+                timeout=self.enqueue_timeout,
+            )
+        except asyncio.TimeoutError:
+            # La clé est oubliée pour que la relivraison soit acceptée plus tard
+            if key is not None:
+                self._seen.pop(key, None)
+            self._rejected += 1
+            raise QueueFullError(f"File '{self.name}' pleine ({self.maxsize})")
+
+        self._enqueued += 1
+        return True
+
+    def _remember(self, key: Hashable):
+        self._seen[key] = None
+        while len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+
+    async def _worker(self):
+        while True:
+            enqueued_at, context, payload = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._in_flight += 1
+            try:
+                await asyncio.create_task(self.handler(payload), context=context)
+                self._processed += 1
+            except Exception:
+                self._failed += 1
+                log.exception("échec du job", extra={"queue": self.name})
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self) -> dict:
+        started = self._processed + self._failed + self._in_flight
+        return {
+            "depth": self.depth(),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "enqueued": self._enqueued,
+            "processed": self._processed,
+            "failed": self._failed,
+            "duplicates": self._duplicates,
+            "rejected": self._rejected,
+            "wait_avg_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2),
+        }
+
+
+class KeyedSerialExecutor:
+    """
+    Exécuteur asyncio à ordre garanti par clé (ex: sender.id Messenger).
+    - les jobs d'une même clé s'exécutent un par un, dans l'ordre de soumission
+    - des clés différentes avancent en parallèle, bornées par `concurrency`
+    - nombre total de jobs en attente borné (max_pending) avec QueueFullError
+    - dédoublonnage sur un identifiant de job (ex: mid du message)
+    - drain propre à l'arrêt
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        concurrency: int = 8,
+        max_pending: int = 1000,
+        dedup_size: int = 10000,
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.max_pending = max_pending
+        self.dedup_size = dedup_size
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lanes: dict = {}
+        self._tasks: set = set()
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._accepting = False
+        self._pending = 0
+
+        self._submitted = 0
+        self._processed = 0
+        self._failed = 0
+        self._duplicates = 0
+        self._rejected = 0
+        self._in_flight = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._accepting = True
+
+    async def stop(self, timeout: float = 25.0):
+        """Refuse les nouveaux jobs et attend la fin de toutes les files par clé."""
+        self._accepting = False
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            log.warning("jobs abandonnés à l'arrêt", extra={"queue": self.name, "jobs": self._pending, "timeout_s": timeout})
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def submit(self, key: Hashable, payload: Any, job_id: Optional[Hashable] = None) -> bool:
+        """
+        Ajoute un job à la file de sa clé, sans attendre.
+        Retourne False pour un job_id déjà vu, lève QueueFullError au-delà de max_pending.
+        """
+        if not self._accepting:
+            raise QueueFullError(f"Exécuteur '{self.name}' arrêté")
+
+        if job_id is not None and job_id in self._seen:
+            self._seen.move_to_end(job_id)
+            self._duplicates += 1
+            return False
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise QueueFullError(f"Exécuteur '{self.name}' saturé ({self.max_pending})")
+        if job_id is not None:
+            self._seen[job_id] = None
+            while len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = []
+            task = asyncio.create_task(self._drain_lane(key, lane), name=f"{self.name}-{key}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        lane.append((time.monotonic(), contextvars.copy_context(), payload))
+        self._pending += 1
+        self._submitted += 1
+        return True
+
+    async def _drain_lane(self, key: Hashable, lane: list):
+        # Une tâche par clé active : elle vide sa file dans l'ordre puis disparaît
+        try:
+            while lane:
+                enqueued_at, context, payload = lane[0]
+                async with self._semaphore:
+                    wait = time.monotonic() - enqueued_at
+                    self._wait_total += wait
+                    self._wait_max = max(self._wait_max, wait)
+                    self._in_flight += 1
+                    try:
+                        await asyncio.create_task(self.handler(payload), context=context)
+                        self._processed += 1
+                    except Exception:
+                        self._failed += 1
+                        log.exception("échec du job", extra={"queue": self.name})
+                    finally:
+                        self._in_flight -= 1
+                        self._pending -= 1
+                        lane.pop(0)
+        finally:
+            self._lanes.pop(key, None)
+
+    def depth(self) -> int:
+        return self._pending - self._in_flight
+
+    def stats(self) -> dict:
+        started = self._processed + self._failed + self._in_flight
+        return {
+            "depth": self.depth(),
+            "max_pending": self.max_pending,
+            "concurrency": self.concurrency,
+            "active_keys": len(self._lanes),
+            "in_flight": self._in_flight,
+            "submitted": self._submitted,
+            "processed": self._processed,
+            "failed": self._failed,
+            "duplicates": self._duplicates,
+            "rejected": self._rejected,
+            "wait_avg_ms": round(self._wait_total / started * 1000, 2) if started else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2),
+        }
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+from app.services.metrics import OUTBOUND_SECONDS
+
+# Ordre des fournisseurs : le premier est le primaire, les suivants servent de secours
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "groq")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1024"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Délai (s) au-delà duquel une requête de secours est lancée en parallèle ; 0 = secours sur erreur seulement
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_SDK_RETRIES = int(os.getenv("LLM_SDK_RETRIES", "1"))
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
+
+
+class ProviderError(Exception):
+    """Échec d'un fournisseur LLM (erreur API, timeout...)."""
+
+
+class LLMProvider(ABC):
+    """
+    Interface commune des fournisseurs LLM.
+    Chaque fournisseur a son sémaphore de concurrence et son timeout ;
+    le client SDK n'est créé qu'au premier appel. _complete et _stream sont
+    abstraites : un fournisseur incomplet échoue dès son instanciation.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str, concurrency: int, timeout: float):
+        self.model = model
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+
+    @asynccontextmanager
+    async def _slot(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Requête couverte perdante, ou client parti pendant le flux
+            outcome = "cancelled"
+            raise
+        except Exception:
+            self.errors += 1
+            outcome = "error"
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            OUTBOUND_SECONDS.labels(f"llm_{self.name}", outcome).observe(time.perf_counter() - started)
+
+    async def complete(self, system: str, messages: List[dict], max_tokens: int, temperature: float) -> str:
+        async with self._slot():
+            try:
+                return await asyncio.wait_for(self._complete(system, messages, max_tokens, temperature), self.timeout)
+            except asyncio.TimeoutError:
+                raise ProviderError(f"{self.name}: timeout après {self.timeout}s")
+
+    async def stream(self, system: str, messages: List[dict], max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        async with self._slot():
+            chunks = self._stream(system, messages, max_tokens, temperature).__aiter__()
+            while True:
+                try:
+                    # Timeout appliqué entre deux fragments : un flux bloqué échoue sans couper un flux lent mais vivant
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise ProviderError(f"{self.name}: flux inactif depuis {self.timeout}s")
+                if chunk:
+                    yield chunk
+
+    @abstractmethod
+    async def _complete(self, system, messages, max_tokens, temperature) -> str:
+        """Réponse complète du modèle."""
+
+    @abstractmethod
+    def _stream(self, system, messages, max_tokens, temperature) -> AsyncIterator[str]:
+        """Générateur asynchrone des fragments de texte de la réponse."""
+
+    def configured(self) -> bool:
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "errors": self.errors,
+        }
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    @property
+    def client(self):
+        if self._client is None:
+            from groq import AsyncGroq
+            self._client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=LLM_SDK_RETRIES)
+        return self._client
+
+    def configured(self) -> bool:
+        return bool(os.getenv("GROQ_API_KEY"))
+
+    async def _complete(self, system, messages, max_tokens, temperature) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "system", "content": system}] + messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        return response.choices[0].message.content.strip()
+
+    async def _stream(self, system, messages, max_tokens, temperature):
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "system", "content": system}] + messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import AsyncAnthropic
+            self._client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=LLM_SDK_RETRIES)
+        return self._client
+
+    def configured(self) -> bool:
+        return bool(os.getenv("ANTHROPIC_API_KEY"))
+
+    @staticmethod
+    def _alternate(messages: List[dict]) -> List[dict]:
+        """L'API Messages exige des rôles alternés commençant par 'user'."""
+        merged = []
+        for m in messages:
+            if not merged and m["role"] != "user":
+                continue
+            if merged and merged[-1]["role"] == m["role"]:
+                merged[-1] = {"role": m["role"], "content": f"{merged[-1]['content']}\n\n{m['content']}"}
+            else:
+                merged.append({"role": m["role"], "content": m["content"]})
+        return merged
+
+    async def _complete(self, system, messages, max_tokens, temperature) -> str:
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=self._alternate(messages),
+        )
+        return response.content[0].text.strip()
+
+    async def _stream(self, system, messages, max_tokens, temperature):
+        async with self.client.messages.stream(
+            model=self.model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=self._alternate(messages),
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+
+class FakeProvider(LLMProvider):
+    """
+    Fournisseur local déterministe, sans réseau : fait avancer la conversation
+    d'un stade par message utilisateur et demande un lien de paiement quand
+    le client dit vouloir payer. Latence simulée via LLM_FAKE_LATENCY (s).
+    """
+
+    name = "fake"
+    STAGES = ["greeting", "qualification", "presentation", "objection", "payment"]
+    PAY_WORDS = ("payer", "acheter", "paiement", "je prends")
+
+    def __init__(self, model: str, concurrency: int, timeout: float):
+        super().__init__(model, concurrency, timeout)
+        self.latency = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+
+    def reply(self, messages: List[dict]) -> str:
+        user_turns = sum(1 for m in messages if m["role"] == "user")
+        last = messages[-1]["content"].lower() if messages else ""
+        if any(word in last for word in self.PAY_WORDS):
+            return json.dumps({
+                "text": "Parfait, voici la suite pour finaliser votre abonnement Pro.",
+                "stage": "payment",
+                "payment_url": "GENERATE",
+                "actions": ["plan:pro", "amount:29900"],
+            }, ensure_ascii=False)
+        stage = self.STAGES[min(user_turns, len(self.STAGES) - 1)]
+        return json.dumps({
+            "text": f"Réponse {user_turns} ({stage}) à : {messages[-1]['content'][:80] if messages else ''}",
+            "stage": stage,
+            "payment_url": None,
+            "actions": [],
+        }, ensure_ascii=False)
+
+    async def _complete(self, system, messages, max_tokens, temperature) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.reply(messages)
+
+    async def _stream(self, system, messages, max_tokens, temperature):
+        raw = self.reply(messages)
+        step = max(1, len(raw) // 10)
+        for i in range(0, len(raw), step):
+            if self.latency:
+                await asyncio.sleep(self.latency / 10)
+            yield raw[i:i + step]
+
+
+PROVIDER_CLASSES = {
+    "groq": (GroqProvider, GROQ_MODEL),
+    "anthropic": (AnthropicProvider, ANTHROPIC_MODEL),
+    "fake": (FakeProvider, "fake"),
+}
+
+
+class LLMRouter:
+    """
+    Route les appels vers le fournisseur primaire. Si le primaire échoue, ou
+    dépasse hedge_after secondes sans répondre, le fournisseur suivant est
+    lancé ; la première réponse valide gagne et les autres sont annulées.
+    """
+
+    def __init__(self, providers: List[LLMProvider], hedge_after: float = 0.0,
+                 max_tokens: int = LLM_MAX_TOKENS, temperature: float = LLM_TEMPERATURE):
+        if not providers:
+            raise ValueError("Aucun fournisseur LLM configuré")
+        self.providers = providers
+        self.hedge_after = hedge_after
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.hedges = 0
+        self.failovers = 0
+
+    @property
+    def signature(self) -> str:
+        return ",".join(f"{p.name}:{p.model}" for p in self.providers)
+
+    def backlog(self) -> int:
+        """Requêtes en cours ou en attente de créneau, tous fournisseurs confondus."""
+        return sum(p.in_flight + p.waiting for p in self.providers)
+
+    async def complete(self, system: str, messages: List[dict]) -> str:
+        pending = {}
+        remaining = list(self.providers)
+        errors = []
+
+        def launch():
+            provider = remaining.pop(0)
+            task = asyncio.create_task(provider.complete(system, messages, self.max_tokens, self.temperature))
+            pending[task] = provider
+
+        launch()
+        try:
+            while pending:
+                timeout = self.hedge_after if (self.hedge_after and remaining) else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primaire trop lent : requête couverte sur le fournisseur suivant
+                    self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{provider.name}: {task.exception()}")
+                if not pending and remaining:
+                    self.failovers += 1
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise ProviderError("Tous les fournisseurs LLM ont échoué — " + " | ".join(errors))
+
+    async def stream(self, system: str, messages: List[dict]) -> AsyncIterator[str]:
+        """Flux du premier fournisseur disponible ; bascule sur le suivant tant qu'aucun fragment n'est parti."""
+        errors = []
+        for index, provider in enumerate(self.providers):
+            started = False
+            try:
+                async for chunk in provider.stream(system, messages, self.max_tokens, self.temperature):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e}")
+                if index + 1 < len(self.providers):
+                    self.failovers += 1
+        raise ProviderError("Tous les fournisseurs LLM ont échoué — " + " | ".join(errors))
+
+    def stats(self) -> dict:
+        return {
+            "providers": {p.name: p.stats() for p in self.providers},
+            "hedge_after_s": self.hedge_after,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+        }
+
+
+def build_provider(name: str) -> LLMProvider:
+    provider_class, model = PROVIDER_CLASSES[name]
+    concurrency = int(os.getenv(f"LLM_CONCURRENCY_{name.upper()}", "16"))
+    timeout = float(os.getenv(f"LLM_TIMEOUT_{name.upper()}", str(LLM_TIMEOUT)))
+    return provider_class(model, concurrency, timeout)
+
+
+_router: Optional[LLMRouter] = None
+
+
+def get_llm() -> LLMRouter:
+    global _router
+    if _router is None:
+        names = [n.strip() for n in LLM_PROVIDERS.split(",") if n.strip()]
+        _router = LLMRouter([build_provider(n) for n in names], hedge_after=LLM_HEDGE_AFTER)
+    return _router
@@ -0,0 +1,141 @@
+import os
+import time
+import random
+import asyncio
+from typing import Optional
+import httpx
+from app.services.metrics import observe_outbound
+from app.logging_config import get_logger, LOG_SAMPLE_RATE
+
+PAGE_ACCESS_TOKEN = os.getenv("MESSENGER_PAGE_ACCESS_TOKEN")
+
+# Surchargeable pour pointer vers un faux serveur Graph API local
+GRAPH_API_BASE = os.getenv("GRAPH_API_BASE", "https://graph.facebook.com")
+GRAPH_API_VERSION = os.getenv("GRAPH_API_VERSION", "v19.0")
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "20"))
+
+# Limite Messenger : 2000 caractères par message texte
+MAX_MESSAGE_LENGTH = 2000
+# POST /me/messages crée un message : il n'est rejoué que si Meta ne l'a
+# certainement pas accepté. 429 : refusé (limite de débit) ; 503 : refusé
+# seulement s'il est accompagné d'un Retry-After.
+RETRYABLE_STATUS = {429}
+RETRYABLE_WITH_RETRY_AFTER = {503}
+# La requête n'est jamais partie : connexion impossible ou pas de connexion libre
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+_client: Optional[httpx.AsyncClient] = None
+log = get_logger("messenger")
+
+
+def get_graph_client() -> httpx.AsyncClient:
+    """Client HTTP partagé (connexions keep-alive) vers la Graph API Meta."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=f"{GRAPH_API_BASE}/{GRAPH_API_VERSION}",
+            params={"access_token": PAGE_ACCESS_TOKEN or ""},
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+        )
+    return _client
+
+
+async def close_graph_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _split_text(text: str) -> list:
+    """Découpe un texte trop long en morceaux ≤ MAX_MESSAGE_LENGTH, de préférence sur un saut de ligne ou un espace."""
+    chunks = []
+    while len(text) > MAX_MESSAGE_LENGTH:
+        cut = max(text.rfind("\n", 0, MAX_MESSAGE_LENGTH), text.rfind(" ", 0, MAX_MESSAGE_LENGTH))
+        if cut <= 0:
+            cut = MAX_MESSAGE_LENGTH
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Backoff exponentiel avec jitter complet, ou Retry-After si Meta le fournit."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+async def _post_message(recipient_id: str, text: str, tag: Optional[str] = None) -> str:
+    """
+    POST /me/messages avec retries (backoff + jitter) ; retourne le message_id.
+    Un timeout de lecture ou une 5xx peut suivre un message déjà accepté :
+    pas de nouvel essai (doublon chez le client), l'erreur remonte.
+    """
+    client = get_graph_client()
+    payload = {
+        "recipient": {"id": recipient_id},
+        "messaging_type": "MESSAGE_TAG" if tag else "RESPONSE",
+        "message": {"text": text},
+    }
+    if tag:
+        payload["tag"] = tag
+
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = await client.post("/me/messages", json=payload)
+        except RETRYABLE_ERRORS:
+            observe_outbound("graph", started)
+            if attempt == GRAPH_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff_delay(attempt))
+            continue
+        except httpx.TransportError as e:
+            observe_outbound("graph", started)
+            log.warning("envoi incertain, non rejoué", extra={"user": recipient_id, "error": type(e).__name__})
+            raise
+        observe_outbound("graph", started, response.status_code)
+
+        retry_after = response.headers.get("Retry-After")
+        retryable = response.status_code in RETRYABLE_STATUS or (
+            response.status_code in RETRYABLE_WITH_RETRY_AFTER and retry_after
+        )
+        if retryable and attempt < GRAPH_MAX_RETRIES:
+            await asyncio.sleep(_backoff_delay(attempt, retry_after))
+            continue
+        if response.status_code >= 500:
+            log.warning("envoi incertain, non rejoué", extra={"user": recipient_id, "status": response.status_code})
+
+        response.raise_for_status()
+        return response.json().get("message_id", "")
+
+
+async def send_messenger_message(recipient_id: str, text: str, tag: Optional[str] = None) -> bool:
+    """
+    Envoie un message Messenger / Instagram via la Graph API (Send API).
+    recipient_id: PSID / IGSID de l'expéditeur reçu dans le webhook.
+    Sans tag : réponse, acceptée dans les 24 h qui suivent le dernier message
+    du client. Au-delà, un tag de message (ex: ACCOUNT_UPDATE) est requis.
+    """
+    try:
+        for chunk in _split_text(text):
+            message_id = await _post_message(recipient_id, chunk, tag)
+            log.info("message envoyé", extra={"user": recipient_id, "message_id": message_id, "sample": LOG_SAMPLE_RATE})
+        return True
+    except Exception as e:
+        log.error("échec d'envoi", extra={"user": recipient_id, "error": str(e)})
+        return False
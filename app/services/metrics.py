@@ -0,0 +1,313 @@
+import time
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Bornes (s) des histogrammes de latence : de la requête d'index au tour LLM complet
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _MetricBase(ABC):
+    """Métrique du registre : nom, aide, labels, et son rendu au format texte Prometheus."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> list:
+        """Lignes d'exposition de la métrique."""
+
+
+class _Metric(_MetricBase):
+    """Métrique à séries par valeurs de labels ; chaque sous-classe fournit le type de série."""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._children: Dict[tuple, object] = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self):
+        """Nouvelle série (compteur, jauge, histogramme...) pour une combinaison de labels."""
+
+    def labels(self, *values):
+        """Série pour ces valeurs de labels ; créée au premier usage puis servie par un dict."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} attend les labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> list:
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def samples(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class GaugeFunc(_MetricBase):
+    """Jauge calculée à la lecture de /metrics : fn() -> {(valeurs de labels...): valeur}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str], fn: Callable[[], dict]):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> list:
+        lines = self._header()
+        try:
+            values = self.fn()
+        except Exception:
+            return lines
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Compteur par seau (non cumulé) : un seul incrément par observation
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def samples(self, name, labelnames, values):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self, *values) -> _Timer:
+        """Chronomètre un bloc (with), synchrone ou contenant des await."""
+        return _Timer(self.labels(*values) if values else self._default)
+
+
+class Registry:
+    """Registre en mémoire du processus, rendu au format texte Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _MetricBase] = {}
+
+    def register(self, metric: _MetricBase) -> _MetricBase:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrique déjà enregistrée : {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def gauge_func(self, name: str, help: str, labelnames: Iterable[str], fn: Callable[[], dict]) -> GaugeFunc:
+        return self.register(GaugeFunc(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ─────────────────────────────────────────────
+# MÉTRIQUES DE L'APPLICATION
+# ─────────────────────────────────────────────
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "pulsai_http_request_duration_seconds", "Durée des requêtes HTTP par route",
+    ("method", "route", "status")
+)
+TURN_PHASE_SECONDS = registry.histogram(
+    "pulsai_turn_phase_seconds",
+    "Durée de chaque phase d'un tour IA (admission, lock, prepare, llm, persist)",
+    ("phase",)
+)
+TURNS_TOTAL = registry.counter(
+    "pulsai_turns_total", "Tours IA par canal et issue (ok, cache, busy, rate_limited, quota_exceeded)",
+    ("channel", "outcome")
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "pulsai_db_query_duration_seconds", "Durée des opérations de conversation_service", ("operation",)
+)
+OUTBOUND_SECONDS = registry.histogram(
+    "pulsai_outbound_request_duration_seconds",
+    "Durée des appels sortants (LLM, Twilio, Graph API, KKiaPay) par service et issue",
+    ("service", "outcome")
+)
+
+
+def outcome_for(status_code: Optional[int]) -> str:
+    """Issue d'un appel sortant : 2xx, 4xx, 5xx... ou error (pas de réponse)."""
+    return f"{status_code // 100}xx" if status_code else "error"
+
+
+def observe_outbound(service: str, started: float, status_code: Optional[int] = None):
+    OUTBOUND_SECONDS.labels(service, outcome_for(status_code)).observe(time.perf_counter() - started)
+
+
+def timed(histogram: Histogram, *values):
+    """Décorateur : chronomètre chaque appel d'une coroutine dans `histogram`."""
+    def decorator(func):
+        child = histogram.labels(*values)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : durée de chaque requête HTTP, étiquetée par le gabarit
+    de route (/api/ai/messages/{user_id}/{channel}) pour borner la cardinalité.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, str(status["code"])).observe(time.perf_counter() - started)
@@ -1,9 +1,13 @@
 import os
 import hmac
+import time
+import random
+import asyncio
 import hashlib
+from collections import OrderedDict
+from typing import Optional
 import httpx
-from dotenv import load_dotenv
-load_dotenv()
+from app.services.metrics import observe_outbound
 
 KKIAPAY_PUBLIC_KEY = os.getenv("KKIAPAY_PUBLIC_KEY")
 KKIAPAY_PRIVATE_KEY = os.getenv("KKIAPAY_PRIVATE_KEY")
@@ -11,19 +15,116 @@ KKIAPAY_SECRET_KEY = os.getenv("KKIAPAY_SECRET_KEY")
 KKIAPAY_SANDBOX = os.getenv("KKIAPAY_SANDBOX", "true").lower() == "true"
 
 BASE_URL = "https://api-sandbox.kkiapay.me" if KKIAPAY_SANDBOX else "https://api.kkiapay.me"
+# Surchargeable pour pointer vers un faux serveur KKiaPay local
+KKIAPAY_API_BASE = os.getenv("KKIAPAY_API_BASE", BASE_URL)
+KKIAPAY_TIMEOUT = float(os.getenv("KKIAPAY_TIMEOUT", "10"))
+KKIAPAY_MAX_RETRIES = int(os.getenv("KKIAPAY_MAX_RETRIES", "2"))
+# Statuts non terminaux (PENDING...) : courte durée de vie, le front interroge en boucle
+KKIAPAY_PENDING_TTL = float(os.getenv("KKIAPAY_PENDING_TTL", "5"))
+KKIAPAY_STATUS_CACHE_SIZE = int(os.getenv("KKIAPAY_STATUS_CACHE_SIZE", "10000"))
 
-async def verify_payment(transaction_id: str) -> dict:
-    """Vérifie le statut d'un paiement KKiaPay."""
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{BASE_URL}/api/v1/transactions/status",
-            json={"transactionId": transaction_id},
-            headers={
-                "x-private-key": KKIAPAY_PRIVATE_KEY,
-                "Content-Type": "application/json"
-            }
+# Prix mensuels des plans (FCFA) : lien de paiement et plan d'un paiement reçu
+PLANS = {
+    "starter": 9900,
+    "pro": 29900,
+    "enterprise": 99900
+}
+
+TERMINAL_STATUSES = {"SUCCESS", "FAILED"}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+# transaction_id -> (expiration monotonic ou None si terminal, résultat)
+_status_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_in_flight: dict = {}
+_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+
+def get_kkiapay_client() -> httpx.AsyncClient:
+    """Client HTTP partagé (keep-alive) vers l'API KKiaPay, ouvert avec l'application."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=KKIAPAY_API_BASE,
+            headers={"x-private-key": KKIAPAY_PRIVATE_KEY or "", "Content-Type": "application/json"},
+            timeout=httpx.Timeout(KKIAPAY_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
         )
-        return response.json()
+    return _client
+
+
+async def close_kkiapay_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def remember_status(transaction_id: str, result: dict):
+    """Met en cache un statut : indéfiniment s'il est terminal, KKIAPAY_PENDING_TTL sinon."""
+    terminal = result.get("status") in TERMINAL_STATUSES
+    _status_cache[transaction_id] = (None if terminal else time.monotonic() + KKIAPAY_PENDING_TTL, result)
+    _status_cache.move_to_end(transaction_id)
+    while len(_status_cache) > KKIAPAY_STATUS_CACHE_SIZE:
+        _status_cache.popitem(last=False)
+
+
+def _cached_status(transaction_id: str) -> Optional[dict]:
+    entry = _status_cache.get(transaction_id)
+    if entry is None:
+        return None
+    expires_at, result = entry
+    if expires_at is not None and expires_at < time.monotonic():
+        del _status_cache[transaction_id]
+        return None
+    return result
+
+
+async def _fetch_status(transaction_id: str) -> dict:
+    client = get_kkiapay_client()
+    for attempt in range(KKIAPAY_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = await client.post("/api/v1/transactions/status", json={"transactionId": transaction_id})
+        except httpx.TransportError:
+            observe_outbound("kkiapay", started)
+            if attempt == KKIAPAY_MAX_RETRIES:
+                raise
+        else:
+            observe_outbound("kkiapay", started, response.status_code)
+            if response.status_code not in RETRYABLE_STATUS or attempt == KKIAPAY_MAX_RETRIES:
+                result = response.json()
+                if response.is_success:
+                    remember_status(transaction_id, result)
+                return result
+        await asyncio.sleep(random.uniform(0, 0.25 * (2 ** attempt)))
+
+
+async def verify_payment(transaction_id: str) -> dict:
+    """
+    Vérifie le statut d'un paiement KKiaPay.
+    Servi par le cache de statuts si possible ; les vérifications simultanées
+    d'une même transaction partagent une seule requête.
+    """
+    cached = _cached_status(transaction_id)
+    if cached is not None:
+        _cache_stats["hits"] += 1
+        return cached
+
+    task = _in_flight.get(transaction_id)
+    if task is None:
+        _cache_stats["misses"] += 1
+        task = asyncio.ensure_future(_fetch_status(transaction_id))
+        _in_flight[transaction_id] = task
+        task.add_done_callback(lambda _: _in_flight.pop(transaction_id, None))
+    else:
+        _cache_stats["coalesced"] += 1
+    # shield : un appelant qui abandonne n'annule pas la requête partagée
+    return await asyncio.shield(task)
+
+
+def payment_stats() -> dict:
+    return {**_cache_stats, "cached": len(_status_cache), "in_flight": len(_in_flight)}
 
 def verify_webhook_signature(payload: bytes, signature: str) -> bool:
     """Vérifie la signature du webhook KKiaPay."""
@@ -0,0 +1,122 @@
+import os
+import re
+from datetime import datetime
+from typing import List, Optional
+
+# Budget total du prompt (système + résumé + historique + message), en tokens estimés
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "3000"))
+AI_PROMPT_MAX_TURNS = int(os.getenv("AI_PROMPT_MAX_TURNS", "10"))
+# Plafond par message : un long texte collé est tronqué (début + fin)
+AI_PROMPT_MAX_MESSAGE_TOKENS = int(os.getenv("AI_PROMPT_MAX_MESSAGE_TOKENS", "600"))
+AI_SUMMARY_MAX_TOKENS = int(os.getenv("AI_SUMMARY_MAX_TOKENS", "300"))
+# Mots gardés par tour replié dans le résumé
+SUMMARY_WORDS_PER_TURN = 30
+
+CHANNEL_TONE = {
+    "web": "Utilise un ton professionnel mais accessible.",
+    "whatsapp": "Utilise un ton décontracté, des messages courts, des emojis appropriés.",
+    "email": "Utilise un ton formel avec des phrases complètes et structurées.",
+    "messenger": "Utilise un ton convivial et dynamique, messages courts.",
+    "instagram": "Utilise un ton moderne, inspirant, avec des emojis.",
+}
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimation rapide du nombre de tokens, sans tokenizer : environ 4 caractères
+    par token pour les mots, 1 token par signe de ponctuation.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECES.findall(text or ""))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Tronque un texte trop long en gardant le début et la fin."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 4 caractères par token en moyenne : découpe proportionnelle puis ajustement
+    keep = max_tokens * 4 // 2
+    while keep > 0:
+        candidate = f"{text[:keep]} […] {text[-keep:]}"
+        if estimate_tokens(candidate) <= max_tokens:
+            return candidate
+        keep = int(keep * 0.8)
+    return text[:max_tokens]
+
+
+def _turn(m) -> dict:
+    role = m.role if hasattr(m, 'role') else m.get('role', 'user')
+    content = m.content if hasattr(m, 'content') else m.get('content', '')
+    created_at = getattr(m, 'created_at', None) if hasattr(m, 'role') else m.get('created_at')
+    return {"role": role, "content": content, "created_at": created_at}
+
+
+def fold_into_summary(summary: Optional[str], turns: List[dict]) -> str:
+    """
+    Ajoute des tours sortis de la fenêtre au résumé glissant (extractif :
+    les premiers mots de chaque tour), puis retire les lignes les plus
+    anciennes pour rester sous AI_SUMMARY_MAX_TOKENS.
+    """
+    lines = summary.split("\n") if summary else []
+    for turn in turns:
+        words = turn["content"].split()
+        excerpt = " ".join(words[:SUMMARY_WORDS_PER_TURN]) + (" …" if len(words) > SUMMARY_WORDS_PER_TURN else "")
+        speaker = "Client" if turn["role"] == "user" else "PulsAI"
+        lines.append(f"- {speaker} : {excerpt}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > AI_SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def build_prompt(system_prompt: str, history: list, user_text: str, channel: str, stage: str,
+                 summary: Optional[str] = None, summary_upto: Optional[datetime] = None) -> dict:
+    """
+    Assemble le prompt dans le budget de tokens.
+    Retourne system, messages, le résumé à persister (mis à jour si des tours
+    datés sont sortis de la fenêtre), summary_upto, le nombre de tours
+    d'historique disponibles et l'estimation de tokens du prompt final.
+    """
+    tone = CHANNEL_TONE.get(channel, CHANNEL_TONE["web"])
+    system = f"{system_prompt}\n\nCanal actuel : {channel.upper()}. {tone}\nStade actuel de la conversation : {stage}"
+    user_text = truncate_to_tokens(user_text, AI_PROMPT_MAX_MESSAGE_TOKENS)
+
+    turns = [_turn(m) for m in history]
+    for turn in turns:
+        turn["content"] = truncate_to_tokens(turn["content"], AI_PROMPT_MAX_MESSAGE_TOKENS)
+
+    # Fenêtre : les tours les plus récents qui tiennent dans le budget
+    available = AI_PROMPT_TOKEN_BUDGET - estimate_tokens(system) - estimate_tokens(user_text) - AI_SUMMARY_MAX_TOKENS
+    window = []
+    for turn in reversed(turns):
+        cost = estimate_tokens(turn["content"]) + 4
+        if len(window) >= AI_PROMPT_MAX_TURNS or cost > available:
+            break
+        window.append(turn)
+        available -= cost
+    window.reverse()
+    dropped = turns[:len(turns) - len(window)]
+
+    # Tours datés (contexte serveur) : repliés une seule fois dans le résumé persisté.
+    # Tours non datés (historique fourni par le client) : résumé éphémère, non persisté.
+    dated = [t for t in dropped if t["created_at"] is not None and (summary_upto is None or t["created_at"] > summary_upto)]
+    undated = [t for t in dropped if t["created_at"] is None]
+    if dated:
+        summary = fold_into_summary(summary, dated)
+        summary_upto = max(t["created_at"] for t in dated)
+    prompt_summary = fold_into_summary(summary, undated) if undated else summary
+
+    if prompt_summary:
+        system += f"\n\nRésumé des échanges précédents :\n{prompt_summary}"
+
+    messages = [{"role": t["role"], "content": t["content"]} for t in window]
+    messages.append({"role": "user", "content": user_text})
+    return {
+        "system": system,
+        "messages": messages,
+        "summary": summary,
+        "summary_upto": summary_upto,
+        "summary_changed": bool(dated),
+        "history_turns": len(turns),
+        "tokens": estimate_tokens(system) + sum(estimate_tokens(m["content"]) + 4 for m in messages),
+    }
@@ -0,0 +1,108 @@
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# Désactivé par défaut : à activer explicitement par environnement
+AI_RESPONSE_CACHE = os.getenv("AI_RESPONSE_CACHE", "false").lower() == "true"
+AI_RESPONSE_CACHE_SIZE = int(os.getenv("AI_RESPONSE_CACHE_SIZE", "2000"))
+AI_RESPONSE_CACHE_TTL = float(os.getenv("AI_RESPONSE_CACHE_TTL", "3600"))
+AI_RESPONSE_CACHE_STAGES = set(os.getenv("AI_RESPONSE_CACHE_STAGES", "greeting,qualification").split(","))
+# Au-delà de ce nombre de tours d'historique, la conversation a un vrai contexte : pas de cache
+AI_RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("AI_RESPONSE_CACHE_MAX_HISTORY", "0"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """'Bonjour !!', 'bonjour' et 'BONJOUR' donnent la même clé."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """
+    Cache LRU + TTL des réponses brutes du modèle pour les questions
+    récurrentes des premiers stades (salutations, prix, plans...).
+    Compte les appels LLM évités et la latence économisée (estimée par
+    la moyenne glissante de la latence LLM observée).
+    """
+
+    def __init__(self, enabled: bool, max_size: int, ttl: float, stages: set, max_history: int):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stages = stages
+        self.max_history = max_history
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_ms = 0.0
+        self._llm_latency_ms = None
+
+    def key_for(self, user_text: str, stage: str, channel: str, prompt_version: str, history_turns: int) -> Optional[tuple]:
+        """Clé de cache, ou None si la requête n'est pas éligible."""
+        if not self.enabled:
+            return None
+        if stage not in self.stages or history_turns > self.max_history:
+            self.bypassed += 1
+            return None
+        normalized = normalize_text(user_text)
+        if not normalized:
+            self.bypassed += 1
+            return None
+        return (normalized, stage, channel, prompt_version)
+
+    def get(self, key: Optional[tuple]) -> Optional[str]:
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_ms += self._llm_latency_ms or 0.0
+        return entry[1]
+
+    def put(self, key: Optional[tuple], raw: str):
+        if key is None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, raw)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def record_llm_latency(self, seconds: float):
+        ms = seconds * 1000
+        self._llm_latency_ms = ms if self._llm_latency_ms is None else 0.9 * self._llm_latency_ms + 0.1 * ms
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "llm_calls_avoided": self.hits,
+            "saved_latency_ms": round(self.saved_ms, 1),
+        }
+
+
+response_cache = ResponseCache(
+    enabled=AI_RESPONSE_CACHE,
+    max_size=AI_RESPONSE_CACHE_SIZE,
+    ttl=AI_RESPONSE_CACHE_TTL,
+    stages=AI_RESPONSE_CACHE_STAGES,
+    max_history=AI_RESPONSE_CACHE_MAX_HISTORY,
+)
@@ -0,0 +1,101 @@
+class TextFieldParser:
+    """
+    Parseur incrémental de l'enveloppe JSON demandée par le SYSTEM_PROMPT :
+        {"text": "...", "stage": "...", "payment_url": null, "actions": []}
+
+    feed() reçoit les fragments du flux LLM et retourne la partie du champ
+    "text" (de premier niveau) décodée depuis l'appel précédent. Les autres
+    champs sont ignorés ici : ils sont lus sur la réponse complète à la fin
+    du flux. Si le modèle ne respecte pas le format, rien n'est émis.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, field: str = "text"):
+        self.field = field
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = ""          # séquence d'échappement en cours (sans le backslash)
+        self._in_escape = False
+        self._expect_key = False
+        self._is_key = False
+        self._is_target = False
+        self._key = []
+        self._last_key = None
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        for char in chunk:
+            if self.done:
+                break
+            if self._in_string:
+                self._string_char(char, out)
+            else:
+                self._structural_char(char)
+        return "".join(out)
+
+    def _structural_char(self, char: str):
+        if char == '"':
+            self._in_string = True
+            top_level = self._depth == 1
+            self._is_key = top_level and self._expect_key
+            self._is_target = top_level and not self._expect_key and self._last_key == self.field
+            self._key = []
+        elif char in "{[":
+            self._depth += 1
+            self._expect_key = char == "{" and self._depth == 1
+        elif char in "}]":
+            self._depth -= 1
+        elif char == "," and self._depth == 1:
+            self._expect_key = True
+        elif char == ":" and self._depth == 1:
+            self._expect_key = False
+
+    def _string_char(self, char: str, out: list):
+        if self._in_escape:
+            self._escape += char
+            decoded = self._decode_escape()
+            if decoded is None:
+                return
+            self._in_escape = False
+            self._escape = ""
+            self._emit(decoded, out)
+            return
+        if char == "\\":
+            self._in_escape = True
+            return
+        if char == '"':
+            self._in_string = False
+            if self._is_key:
+                self._last_key = "".join(self._key)
+            elif self._is_target:
+                self.done = True
+            return
+        self._emit(char, out)
+
+    def _decode_escape(self):
+        """Retourne le caractère décodé, '' pour une moitié de paire, ou None si incomplet."""
+        head = self._escape[0]
+        if head != "u":
+            return self._ESCAPES.get(head, head)
+        if len(self._escape) < 5:
+            return None
+        try:
+            code = int(self._escape[1:5], 16)
+        except ValueError:
+            return ""
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+        return chr(code)
+
+    def _emit(self, text: str, out: list):
+        if self._is_key:
+            self._key.append(text)
+        elif self._is_target:
+            out.append(text)
@@ -1,32 +1,147 @@
 import os
-from dotenv import load_dotenv
-load_dotenv()
-
-from twilio.rest import Client
+import json
+import time
+import random
+import asyncio
+from typing import Optional
+import httpx
+from app.services.concurrency import KeyedLock, TokenBucket
+from app.services.metrics import observe_outbound
+from app.logging_config import get_logger, LOG_SAMPLE_RATE
 
 ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
 
-client = Client(ACCOUNT_SID, AUTH_TOKEN)
+# Surchargeable pour pointer vers un faux serveur Twilio local
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+# Débit WhatsApp par expéditeur (Twilio : 80 messages/s par défaut)
+TWILIO_WHATSAPP_RATE = float(os.getenv("TWILIO_WHATSAPP_RATE", "80"))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "3"))
+TWILIO_MAX_CONNECTIONS = int(os.getenv("TWILIO_MAX_CONNECTIONS", "20"))
+
+# POST /Messages.json crée un message : il n'est rejoué que si Twilio ne l'a
+# certainement pas accepté. 429 : refusé (limite de débit) ; 503 : refusé
+# seulement s'il est accompagné d'un Retry-After.
+RETRYABLE_STATUS = {429}
+RETRYABLE_WITH_RETRY_AFTER = {503}
+# La requête n'est jamais partie : connexion impossible ou pas de connexion libre
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+_client: Optional[httpx.AsyncClient] = None
+_rate_limiter = TokenBucket(TWILIO_WHATSAPP_RATE)
+_destination_locks = KeyedLock()
+log = get_logger("whatsapp")
+
+
+def get_twilio_client() -> httpx.AsyncClient:
+    """Client HTTP partagé (connexions keep-alive) vers l'API REST Twilio."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=TWILIO_API_BASE,
+            auth=(ACCOUNT_SID or "", AUTH_TOKEN or ""),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=TWILIO_MAX_CONNECTIONS,
+                max_keepalive_connections=TWILIO_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+        )
+    return _client
+
+
+async def close_twilio_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Backoff exponentiel avec jitter complet, ou Retry-After si Twilio le fournit."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+async def _create_message(to_number: str, content: dict) -> str:
+    """
+    POST /Messages.json avec retries ; retourne le SID du message créé.
+    content : {"Body": texte} ou {"ContentSid": ..., "ContentVariables": ...} (modèle approuvé).
+    Un timeout de lecture ou une 5xx peut suivre un message déjà accepté :
+    pas de nouvel essai (doublon chez le client), l'erreur remonte.
+    """
+    client = get_twilio_client()
+    url = f"/2010-04-01/Accounts/{ACCOUNT_SID}/Messages.json"
+    payload = {"From": TWILIO_NUMBER, "To": to_number, **content}
+
+    for attempt in range(TWILIO_MAX_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, data=payload)
+        except RETRYABLE_ERRORS:
+            observe_outbound("twilio", started)
+            if attempt == TWILIO_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff_delay(attempt))
+            continue
+        except httpx.TransportError as e:
+            observe_outbound("twilio", started)
+            log.warning("envoi incertain, non rejoué", extra={"user": to_number, "error": type(e).__name__})
+            raise
+        observe_outbound("twilio", started, response.status_code)
+
+        retry_after = response.headers.get("Retry-After")
+        retryable = response.status_code in RETRYABLE_STATUS or (
+            response.status_code in RETRYABLE_WITH_RETRY_AFTER and retry_after
+        )
+        if retryable and attempt < TWILIO_MAX_RETRIES:
+            await asyncio.sleep(_backoff_delay(attempt, retry_after))
+            continue
+        if response.status_code >= 500:
+            log.warning("envoi incertain, non rejoué", extra={"user": to_number, "status": response.status_code})
+
+        response.raise_for_status()
+        return response.json().get("sid", "")
+
 
 async def send_whatsapp_message(to_number: str, text: str) -> bool:
     """
     Envoie un message WhatsApp via Twilio.
     to_number: numéro au format international ex: +22959085540
+    Les envois vers un même numéro partent dans l'ordre d'appel.
+    Texte libre : accepté par WhatsApp seulement dans les 24 h qui suivent le
+    dernier message du client (au-delà, send_whatsapp_template).
     """
+    return await _send(to_number, {"Body": text})
+
+
+async def send_whatsapp_template(to_number: str, content_sid: str, variables: Optional[dict] = None) -> bool:
+    """Envoie un modèle WhatsApp approuvé (Content API Twilio), seul envoi permis hors de la fenêtre de 24 h."""
+    content = {"ContentSid": content_sid}
+    if variables:
+        content["ContentVariables"] = json.dumps(variables, ensure_ascii=False)
+    return await _send(to_number, content)
+
+
+async def _send(to_number: str, content: dict) -> bool:
     try:
         # S'assurer que le numéro est au format whatsapp:+xxx
         if not to_number.startswith("whatsapp:"):
             to_number = f"whatsapp:{to_number}"
 
-        message = client.messages.create(
-            from_=TWILIO_NUMBER,
-            to=to_number,
-            body=text
-        )
-        print(f"[WhatsApp] Message envoyé à {to_number} — SID: {message.sid}")
+        async with _destination_locks.acquire(to_number):
+            await _rate_limiter.acquire()
+            sid = await _create_message(to_number, content)
+
+        log.info("message envoyé", extra={"user": to_number, "message_sid": sid, "sample": LOG_SAMPLE_RATE})
         return True
     except Exception as e:
-        print(f"[WhatsApp] Erreur envoi: {str(e)}")
-        return False
\ No newline at end of file
+        log.error("échec d'envoi", extra={"user": to_number, "error": str(e)})
+        return False
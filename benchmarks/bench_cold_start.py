@@ -0,0 +1,69 @@
+"""
+Démarrage à froid : temps d'import de app.main et latence de la première
+requête (/health puis /ready), chacun mesuré dans un interpréteur neuf.
+Résultats en JSON sur stdout :
+
+    python -m benchmarks.bench_cold_start [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r"""
+import asyncio, json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter() - started
+
+import httpx
+
+async def first_requests():
+    transport = httpx.ASGITransport(app=app.main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        timings = {}
+        for path in ("/health", "/ready"):
+            t = time.perf_counter()
+            await client.get(path)
+            timings[path] = time.perf_counter() - t
+        return timings
+
+timings = asyncio.run(first_requests())
+print(json.dumps({"import_s": imported, "health_s": timings["/health"], "ready_s": timings["/ready"]}))
+"""
+
+
+def run_probe(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'cold.db')}")
+    env.setdefault("LLM_PROVIDERS", "fake")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+    # Premier passage jeté : compilation des .pyc
+    run_probe(env)
+    samples = [run_probe(env) for _ in range(args.runs)]
+
+    result = {"runs": args.runs}
+    for key in ("import_s", "health_s", "ready_s"):
+        values = [s[key] * 1000 for s in samples]
+        result[key.replace("_s", "_ms")] = {
+            "median": round(statistics.median(values), 2),
+            "max": round(max(values), 2),
+        }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark : coût de la résolution de la conversation active en fonction
+de la taille de l'historique.
+
+Compare l'ancienne requête (selectinload de tous les messages) à
+find_active_conversation. Tourne hors ligne sur SQLite (aiosqlite requis) :
+
+    python -m benchmarks.bench_conversation_lookup
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_file}")
+
+from sqlalchemy import insert, select  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+
+from app.database import AsyncSessionLocal, init_db  # noqa: E402
+from app.models_db import Conversation, Message, StageEnum  # noqa: E402
+from app.services.conversation_service import find_active_conversation  # noqa: E402
+
+HISTORY_SIZES = [10, 100, 1000, 10000]
+ITERATIONS = 50
+
+
+async def seed(user_id: str, size: int):
+    async with AsyncSessionLocal() as db:
+        conversation = Conversation(user_id=user_id, channel="whatsapp", stage=StageEnum.qualification)
+        db.add(conversation)
+        await db.flush()
+        start = datetime.utcnow() - timedelta(minutes=size)
+        rows = [
+            {
+                "conversation_id": conversation.id,
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"message {i} " * 20,
+                "channel": "whatsapp",
+                "created_at": start + timedelta(minutes=i),
+            }
+            for i in range(size)
+        ]
+        await db.execute(insert(Message), rows)
+        await db.commit()
+
+
+async def legacy_lookup(db, user_id: str, channel: str):
+    result = await db.execute(
+        select(Conversation)
+        .where(Conversation.user_id == user_id)
+        .where(Conversation.channel == channel)
+        .where(Conversation.stage != StageEnum.completed)
+        .options(selectinload(Conversation.messages))
+        .order_by(Conversation.updated_at.desc())
+    )
+    return result.scalars().first()
+
+
+async def measure(lookup, user_id: str) -> float:
+    samples = []
+    for _ in range(ITERATIONS):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            await lookup(db, user_id, "whatsapp")
+            samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def main():
+    await init_db()
+    print(f"{'messages':>10} | {'selectinload (ms)':>18} | {'lookup (ms)':>12}")
+    for size in HISTORY_SIZES:
+        user_id = f"bench-{size}"
+        await seed(user_id, size)
+        legacy = await measure(legacy_lookup, user_id)
+        current = await measure(find_active_conversation, user_id)
+        print(f"{size:>10} | {legacy:>18.3f} | {current:>12.3f}")
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,100 @@
+"""
+Lot Messenger multi-expéditeurs : un seul POST /api/webhooks/messenger
+contenant SENDERS × MESSAGES événements, LLM « fake » avec latence et
+Graph API remplacée par un faux serveur local. Vérifie l'ordre par
+expéditeur et mesure le temps de traitement du lot :
+
+    python -m benchmarks.bench_messenger_fanout [--senders 20] [--messages 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), "messenger.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_file}")
+os.environ["LLM_PROVIDERS"] = "fake"
+os.environ.setdefault("LLM_FAKE_LATENCY", "0.05")
+
+from benchmarks.stub_server import StubServer  # noqa: E402
+
+GRAPH_PATH = "/v19.0/me/messages"
+
+
+def batch(senders: int, messages: int) -> dict:
+    # Meta regroupe les événements par entry ; on entrelace les expéditeurs
+    events = [
+        {"sender": {"id": f"psid-{s}"}, "message": {"mid": f"mid-{s}-{i}", "text": f"message {i}"}}
+        for i in range(messages) for s in range(senders)
+    ]
+    return {"object": "page", "entry": [{"id": "page", "messaging": events}]}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5)
+    args = parser.parse_args()
+
+    stub = StubServer({GRAPH_PATH: (200, {"message_id": "stub"})}, latency=0.01)
+    await stub.start()
+    os.environ["GRAPH_API_BASE"] = stub.url
+
+    import httpx
+    from app.main import app
+    from app.database import init_db
+    from app.routers import webhooks
+    from app.services.messenger_service import close_graph_client
+
+    await init_db()
+    await webhooks.messenger_executor.start()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        response = await client.post("/api/webhooks/messenger", json=batch(args.senders, args.messages))
+        acked = time.perf_counter() - started
+        # Relivraison du même lot : doit être entièrement dédoublonnée
+        await client.post("/api/webhooks/messenger", json=batch(args.senders, args.messages))
+        await webhooks.messenger_executor.stop(timeout=120)
+        elapsed = time.perf_counter() - started
+
+        # Ordre par expéditeur : les messages persistés suivent l'ordre de réception
+        in_order = 0
+        for s in range(args.senders):
+            history = (await client.get(f"/api/ai/messages/psid-{s}/messenger")).json()["messages"]
+            texts = [m["text"] for m in history if m["from"] == "user"]
+            in_order += texts == [f"message {i}" for i in range(args.messages)]
+
+    sent = {}
+    for request in stub.requests:
+        recipient = json.loads(request["body"])["recipient"]["id"]
+        sent.setdefault(recipient, []).append(request)
+    stats = webhooks.messenger_executor.stats()
+    await close_graph_client()
+    await stub.stop()
+
+    print(json.dumps({
+        "events": args.senders * args.messages,
+        "ack_status": response.status_code,
+        "ack_ms": round(acked * 1000, 1),
+        "batch_s": round(elapsed, 2),
+        "graph_sends": len(stub.requests),
+        "graph_connections": stub.connections,
+        "senders_answered": len(sent),
+        "senders_in_order": in_order,
+        "duplicates": stats["duplicates"],
+        "failed": stats["failed"],
+    }, indent=2))
+    ok = (
+        stats["processed"] == args.senders * args.messages
+        and stats["duplicates"] == args.senders * args.messages
+        and in_order == args.senders
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
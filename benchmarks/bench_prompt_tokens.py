@@ -0,0 +1,61 @@
+"""
+Distribution des tokens de prompt (estimation prompt_builder.estimate_tokens)
+sur des conversations synthétiques, avant et après le budget :
+- avant : SYSTEM_PROMPT complet + 10 derniers tours bruts + message
+- après : build_prompt (budget, troncature des collages, résumé glissant)
+
+    python -m benchmarks.bench_prompt_tokens
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("LLM_PROVIDERS", "fake")
+
+from app.services.ai_service import SYSTEM_PROMPT  # noqa: E402
+from app.services.prompt_builder import build_prompt, estimate_tokens  # noqa: E402
+
+CONVERSATIONS = 2000
+SHORT = ["Bonjour", "C'est combien ?", "Quels sont vos plans ?", "Je gère une boutique en ligne avec 3 vendeurs.",
+         "Est-ce que WhatsApp est inclus dans le plan Pro ?", "Ok, et pour le paiement mobile money ?"]
+
+
+def synthetic_turn(rng: random.Random) -> str:
+    if rng.random() < 0.05:
+        # Long texte collé (cahier des charges, conversation transférée...)
+        return " ".join(rng.choice(SHORT) for _ in range(rng.randint(150, 800)))
+    return " ".join(rng.choice(SHORT) for _ in range(rng.randint(1, 6)))
+
+
+def legacy_tokens(history: list, user_text: str) -> int:
+    messages = [SYSTEM_PROMPT] + [t["content"] for t in history[-10:]] + [user_text]
+    return sum(estimate_tokens(m) + 4 for m in messages)
+
+
+def percentiles(values: list) -> str:
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]  # noqa: E731
+    return f"p50={pick(0.5):>6} p90={pick(0.9):>6} p99={pick(0.99):>6} max={values[-1]:>6}"
+
+
+def main():
+    rng = random.Random(42)
+    before, after = [], []
+    for _ in range(CONVERSATIONS):
+        start = datetime.utcnow() - timedelta(hours=1)
+        history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": synthetic_turn(rng), "created_at": start + timedelta(minutes=i)}
+            for i in range(rng.randint(0, 20))
+        ]
+        user_text = synthetic_turn(rng)
+        before.append(legacy_tokens(history, user_text))
+        after.append(build_prompt(SYSTEM_PROMPT, history, user_text, channel="whatsapp", stage="presentation")["tokens"])
+
+    print(f"avant : {percentiles(before)}")
+    print(f"après : {percentiles(after)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
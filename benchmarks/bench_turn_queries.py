@@ -0,0 +1,56 @@
+"""
+Compte les requêtes SQL et les COMMIT émis par un tour get_ai_response
+(première conversation puis tour suivant), hors ligne sur SQLite, avec
+le fournisseur LLM local déterministe :
+
+    python -m benchmarks.bench_turn_queries
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_file}")
+os.environ.setdefault("LLM_PROVIDERS", "fake")
+
+from sqlalchemy import event  # noqa: E402
+
+from app.database import AsyncSessionLocal, get_engine, init_db  # noqa: E402
+from app.services import ai_service  # noqa: E402
+
+
+class Counter:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def reset(self):
+        self.statements = []
+        self.commits = 0
+
+
+async def run_turn(counter: Counter, label: str):
+    counter.reset()
+    async with AsyncSessionLocal() as db:
+        await ai_service.get_ai_response(
+            user_text="Bonjour", history=[], channel="whatsapp",
+            user_id="bench-user", stage="greeting", db=db
+        )
+    verbs = [s.split()[0].upper() for s in counter.statements]
+    print(f"{label:<22} statements={len(verbs):<3} commits={counter.commits:<2} {' '.join(verbs)}")
+
+
+async def main():
+    await init_db()
+    counter = Counter()
+    event.listen(get_engine().sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: counter.statements.append(statement))
+    event.listen(get_engine().sync_engine, "commit", lambda conn: setattr(counter, "commits", counter.commits + 1))
+
+    await run_turn(counter, "new conversation")
+    await run_turn(counter, "existing conversation")
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,271 @@
+"""
+Test de charge hors ligne du pipeline de conversation.
+
+L'application FastAPI tourne en mémoire (httpx.ASGITransport) avec :
+- le fournisseur LLM « fake » (latence réglable, --llm-latency)
+- un faux serveur Twilio et un faux serveur KKiaPay (benchmarks.stub_server)
+- SQLite temporaire, ou la base de DATABASE_URL (Postgres local)
+
+Des clients virtuels rejouent un mélange de trafic (--mix) :
+    message  POST /api/ai/message
+    twilio   POST /api/webhooks/whatsapp/twilio (traité par la file WhatsApp)
+    history  GET  /api/ai/messages/{user}/{channel}
+    verify   POST /api/payment/verify
+
+Résultat JSON (débit, percentiles de latence, requêtes SQL par opération),
+stable d'un commit à l'autre pour être comparé :
+
+    python -m benchmarks.load_test --duration 20 --concurrency 32 --out after.json
+    python -m benchmarks.load_test --compare before.json after.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_MIX = "message=45,twilio=25,history=25,verify=5"
+TEXTS = [
+    "Bonjour", "C'est combien ?", "Quels sont vos plans ?", "Je gère une boutique avec 3 vendeurs",
+    "WhatsApp est inclus dans le plan Pro ?", "Et pour le mobile money ?", "C'est sécurisé ?",
+]
+
+# Opération en cours, héritée par les jobs de file (contexte copié à l'enqueue)
+current_op: contextvars.ContextVar = contextvars.ContextVar("bench_op", default="other")
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    # Rang le plus proche : plus petite valeur couvrant q des échantillons
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "p50": round(percentile(latencies, 0.50), 2),
+        "p90": round(percentile(latencies, 0.90), 2),
+        "p99": round(percentile(latencies, 0.99), 2),
+        "max": round(max(latencies), 2) if latencies else 0.0,
+        "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+    }
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - {"message", "twilio", "history", "verify"}
+    if unknown:
+        raise SystemExit(f"Opérations inconnues : {', '.join(sorted(unknown))}")
+    return weights
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def configure_environment(args):
+    """Variables lues à l'import des modules de l'application : à poser avant tout import."""
+    if not os.getenv("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    os.environ["LLM_PROVIDERS"] = "fake"
+    os.environ["LLM_FAKE_LATENCY"] = str(args.llm_latency)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+    os.environ.setdefault("KKIAPAY_MAX_RETRIES", "0")
+    # Les clients virtuels écrivent bien plus vite qu'un humain : débit par utilisateur hors mesure
+    os.environ.setdefault("ADMISSION_RATE_PER_MINUTE", "100000")
+    os.environ.setdefault("ADMISSION_BURST", "100000")
+    os.environ.setdefault("AI_FREE_MONTHLY_QUOTA", "0")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict = {}
+        self.errors: dict = {}
+        self.statements: dict = {}
+
+    def record(self, op: str, elapsed_ms: float, ok: bool):
+        self.latencies.setdefault(op, []).append(elapsed_ms)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def on_statement(self, *_):
+        op = current_op.get()
+        self.statements[op] = self.statements.get(op, 0) + 1
+
+
+async def run_operation(client, op: str, user: int, rng: random.Random) -> bool:
+    current_op.set(op)
+    if op == "message":
+        response = await client.post("/api/ai/message", json={
+            "userId": f"web-{user}", "channel": "web", "text": rng.choice(TEXTS)
+        })
+    elif op == "twilio":
+        response = await client.post("/api/webhooks/whatsapp/twilio", data={
+            "MessageSid": f"SM{rng.getrandbits(64):016x}",
+            "From": f"whatsapp:+2290100{user:05d}",
+            "To": "whatsapp:+14155238886",
+            "Body": rng.choice(TEXTS),
+        })
+    elif op == "history":
+        response = await client.get(f"/api/ai/messages/web-{user}/web", params={"limit": 50})
+    else:
+        response = await client.post("/api/payment/verify", json={"transactionId": f"tx-{rng.randrange(50)}"})
+    return response.status_code < 500
+
+
+async def virtual_client(client, recorder: Recorder, weights: dict, users: int, deadline: float, seed: int):
+    rng = random.Random(seed)
+    ops, cumulative = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, cumulative)[0]
+        started = time.perf_counter()
+        try:
+            ok = await run_operation(client, op, rng.randrange(users), rng)
+        except Exception:
+            ok = False
+        recorder.record(op, (time.perf_counter() - started) * 1000, ok)
+
+
+async def run(args) -> dict:
+    configure_environment(args)
+    from benchmarks.stub_server import StubServer
+
+    twilio = StubServer({"/2010-04-01/Accounts/": (201, {"sid": "SMstub"})}, latency=args.stub_latency)
+    kkiapay = StubServer({"/api/v1/transactions/status": (200, {"status": "SUCCESS", "amount": 29900})}, latency=args.stub_latency)
+    await twilio.start()
+    await kkiapay.start()
+    os.environ["TWILIO_API_BASE"] = twilio.url
+    os.environ["KKIAPAY_API_BASE"] = kkiapay.url
+
+    import httpx
+    from sqlalchemy import event
+    from app.main import app
+    from app.database import init_db, get_engine
+    from app.routers import webhooks
+
+    await init_db()
+    recorder = Recorder()
+    event.listen(get_engine().sync_engine, "before_cursor_execute", recorder.on_statement)
+    await app.router.startup()
+
+    weights = parse_mix(args.mix)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=60) as client:
+        # Échauffement : pools, caches de requêtes préparées, premier accès aux fournisseurs
+        await asyncio.gather(*(run_operation(client, op, 0, random.Random(0)) for op in weights))
+        while webhooks.whatsapp_queue.depth() or webhooks.whatsapp_queue.stats()["in_flight"]:
+            await asyncio.sleep(0.05)
+        warmup_jobs = webhooks.whatsapp_queue.stats()["processed"]
+        recorder.__init__()
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            virtual_client(client, recorder, weights, args.users, deadline, args.seed + i)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+        # Laisser la file WhatsApp traiter les messages acquittés pendant la mesure
+        await app.router.shutdown()
+        drained = time.perf_counter() - started
+
+    await twilio.stop()
+    await kkiapay.stop()
+
+    whatsapp = webhooks.whatsapp_queue.stats()
+    whatsapp["processed"] -= warmup_jobs
+    counts = {op: len(values) for op, values in recorder.latencies.items()}
+    # Requêtes SQL par opération ; pour twilio, par message traité par la file
+    per_op_units = {**counts, "twilio": whatsapp["processed"] or 1}
+    total = sum(counts.values())
+    return {
+        "commit": git_commit(),
+        "config": {
+            "duration_s": args.duration, "concurrency": args.concurrency, "users": args.users,
+            "mix": args.mix, "llm_latency_s": args.llm_latency, "stub_latency_s": args.stub_latency,
+            "database": get_engine().dialect.name, "seed": args.seed,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "ops": {
+            op: {
+                "count": counts[op],
+                "errors": recorder.errors.get(op, 0),
+                "throughput_rps": round(counts[op] / elapsed, 1),
+                "latency_ms": summarize(recorder.latencies[op]),
+                "queries_per_op": round(recorder.statements.get(op, 0) / per_op_units[op], 2),
+            }
+            for op in sorted(counts)
+        },
+        "whatsapp_pipeline": {
+            "processed": whatsapp["processed"],
+            "failed": whatsapp["failed"],
+            "queue_wait_avg_ms": whatsapp["wait_avg_ms"],
+            "queue_wait_max_ms": whatsapp["wait_max_ms"],
+            "drain_s": round(drained - elapsed, 2),
+            "twilio_sends": len(twilio.requests),
+        },
+    }
+
+
+def compare(before_path: str, after_path: str):
+    """Écarts de débit et de latence entre deux résultats (after - before)."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def delta(old, new):
+        return f"{old:>9} -> {new:<9} ({(new - old) / old * 100:+.1f}%)" if old else f"{old:>9} -> {new}"
+
+    print(f"{before.get('commit', '?')} -> {after.get('commit', '?')}")
+    print(f"{'throughput_rps':<28}{delta(before['throughput_rps'], after['throughput_rps'])}")
+    for op in sorted(set(before["ops"]) & set(after["ops"])):
+        old, new = before["ops"][op], after["ops"][op]
+        for q in ("p50", "p99"):
+            print(f"{op + ' ' + q + ' (ms)':<28}{delta(old['latency_ms'][q], new['latency_ms'][q])}")
+        print(f"{op + ' queries':<28}{delta(old['queries_per_op'], new['queries_per_op'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--stub-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="fichier JSON de résultats (sinon stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
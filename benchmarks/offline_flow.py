@@ -0,0 +1,99 @@
+"""
+Harnais hors ligne : déroule une conversation complète (accueil -> paiement)
+contre l'application FastAPI en mémoire, avec le fournisseur LLM « fake »
+et SQLite. Aucune clé API ni réseau requis :
+
+    python -m benchmarks.offline_flow
+
+Termine en erreur si une étape ne se comporte pas comme attendu.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+_db_file = os.path.join(tempfile.mkdtemp(), "offline.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_file}")
+os.environ["LLM_PROVIDERS"] = "fake"
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.database import init_db  # noqa: E402
+from app.services.llm_provider import FakeProvider, LLMRouter, ProviderError  # noqa: E402
+
+SCRIPT = [
+    ("Bonjour", "qualification"),
+    ("Je gère une boutique, 3 canaux", "presentation"),
+    ("C'est sécurisé ?", "objection"),
+    ("Ok je veux payer le plan Pro", "payment"),
+]
+
+
+def check(condition: bool, label: str):
+    print(f"{'OK ' if condition else 'KO '} {label}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def conversation_flow(client: httpx.AsyncClient):
+    user = {"userId": "offline-user", "channel": "web"}
+    for text, expected_stage in SCRIPT:
+        response = (await client.post("/api/ai/message", json={**user, "text": text})).json()
+        check(response["stage"] == expected_stage, f"'{text}' -> {response['stage']}")
+    check(bool(response["payment_url"]), "lien de paiement généré")
+
+    history = (await client.get("/api/ai/messages/offline-user/web")).json()
+    check(len(history["messages"]) == 2 * len(SCRIPT), f"{len(history['messages'])} messages persistés")
+
+    stage = (await client.get("/api/ai/stage/offline-user/web")).json()
+    check(stage["stage"] == "payment", "stade persisté")
+
+
+async def streaming_flow(client: httpx.AsyncClient):
+    payload = {"userId": "offline-stream", "channel": "web", "text": "Bonjour"}
+    deltas, done = [], None
+    async with client.stream("POST", "/api/ai/message/stream", json=payload) as response:
+        body = "".join([chunk async for chunk in response.aiter_text()])
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        data = json.loads(data.removeprefix("data: "))
+        if event == "event: delta":
+            deltas.append(data["text"])
+        elif event == "event: done":
+            done = data
+    check(done is not None and "".join(deltas) == done["text"], "flux SSE identique à la réponse finale")
+
+
+class _BrokenProvider(FakeProvider):
+    name = "broken"
+
+    async def _complete(self, system, messages, max_tokens, temperature):
+        raise ProviderError("panne simulée")
+
+
+async def failover_flow():
+    messages = [{"role": "user", "content": "Bonjour"}]
+
+    router = LLMRouter([_BrokenProvider("broken", 1, 1.0), FakeProvider("fake", 1, 1.0)])
+    check(json.loads(await router.complete("", messages))["stage"] == "qualification", "bascule sur erreur")
+
+    slow = FakeProvider("slow", 1, 5.0)
+    slow.latency = 2.0
+    router = LLMRouter([slow, FakeProvider("fake", 1, 5.0)], hedge_after=0.05)
+    await router.complete("", messages)
+    check(router.hedges == 1, "requête couverte quand le primaire dépasse le seuil")
+
+
+async def main():
+    await init_db()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://offline") as client:
+        await conversation_flow(client)
+        await streaming_flow(client)
+    await failover_flow()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,111 @@
+"""
+Tours concurrents pour un même utilisateur, hors ligne (SQLite, LLM « fake »
+avec latence) :
+1. TURNS appels get_ai_response simultanés (une session chacun) : une seule
+   conversation active, messages alternés user/assistant, stades appliqués
+   dans l'ordre ;
+2. get_or_create_conversation simultanés sans verrou (cas multi-workers) :
+   l'index unique partiel garde une seule conversation active.
+
+    python -m benchmarks.stress_concurrent_turns [--turns 8]
+
+Termine en erreur si un contrôle échoue.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+_db_file = os.path.join(tempfile.mkdtemp(), "stress.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_file}")
+os.environ["LLM_PROVIDERS"] = "fake"
+os.environ.setdefault("LLM_FAKE_LATENCY", "0.02")
+# Rafale volontaire au-delà du débit par utilisateur : admission hors du périmètre du test
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app.database import AsyncSessionLocal, init_db  # noqa: E402
+from app.models_db import Conversation, Message, StageEnum  # noqa: E402
+from app.services.ai_service import get_ai_response  # noqa: E402
+from app.services.conversation_service import get_or_create_conversation  # noqa: E402
+from app.services.llm_provider import FakeProvider  # noqa: E402
+
+
+def check(condition: bool, label: str):
+    print(f"{'OK ' if condition else 'KO '} {label}")
+    if not condition:
+        raise SystemExit(1)
+
+
+async def active_conversations(user_id: str, channel: str) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(func.count()).select_from(Conversation)
+            .where(Conversation.user_id == user_id)
+            .where(Conversation.channel == channel)
+            .where(Conversation.stage != StageEnum.completed)
+        )
+        return result.scalar()
+
+
+async def one_turn(user_id: str, i: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        return await get_ai_response(
+            user_text=f"message {i}", history=[], channel="whatsapp",
+            user_id=user_id, stage="greeting", db=db
+        )
+
+
+async def concurrent_turns(turns: int):
+    user_id = "stress-turns"
+    responses = await asyncio.gather(*(one_turn(user_id, i) for i in range(turns)))
+    check(await active_conversations(user_id, "whatsapp") == 1, "une seule conversation active")
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Message.role, Message.content)
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .where(Conversation.user_id == user_id)
+            .order_by(Message.created_at, Message.id)
+        )).all()
+        conversation = (await db.execute(select(Conversation).where(Conversation.user_id == user_id))).scalar_one()
+
+    roles = [row.role for row in rows]
+    check(roles == ["user", "assistant"] * turns, f"{len(rows)} messages alternés user/assistant")
+
+    # Chaque réponse du fournisseur fake cite le message auquel elle répond
+    pairs = list(zip(rows[0::2], rows[1::2]))
+    check(all(reply.content.endswith(f"à : {asked.content}") for asked, reply in pairs), "chaque réponse suit son message")
+
+    # Le fournisseur fake avance d'un stade par tour : les stades ne reculent jamais
+    expected = [FakeProvider.STAGES[min(i + 1, len(FakeProvider.STAGES) - 1)] for i in range(turns)]
+    check(sorted(r["stage"] for r in responses) == sorted(expected), "stades appliqués dans l'ordre des tours")
+    check(conversation.stage.value == expected[-1], f"stade final {conversation.stage.value}")
+
+
+async def concurrent_creates(workers: int):
+    user_id = "stress-create"
+
+    async def create():
+        async with AsyncSessionLocal() as db:
+            return (await get_or_create_conversation(db, user_id, "web")).id
+
+    ids = await asyncio.gather(*(create() for _ in range(workers)))
+    check(await active_conversations(user_id, "web") == 1, "index unique : une seule conversation créée")
+    check(len(set(ids)) == 1, "tous les appelants reprennent la même conversation")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=8)
+    args = parser.parse_args()
+
+    await init_db()
+    await concurrent_turns(args.turns)
+    await concurrent_creates(args.turns)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
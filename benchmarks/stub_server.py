@@ -0,0 +1,129 @@
+"""
+Faux serveur HTTP local (asyncio pur, keep-alive) pour remplacer les API
+externes (Graph API, Twilio, KKiaPay) dans les harnais et benchmarks.
+Chaque requête est enregistrée ; la réponse est choisie par préfixe de chemin.
+
+    stub = StubServer({"/v19.0/me/messages": (200, {"message_id": "m1"})}, latency=0.02)
+    await stub.start()   # stub.url -> http://127.0.0.1:<port>
+
+SMTPSink joue le même rôle pour l'envoi d'emails (SMTP_HOST / SMTP_PORT) :
+
+    sink = SMTPSink()
+    await sink.start()   # sink.port ; sink.messages -> emails reçus (bytes)
+"""
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+
+class StubServer:
+
+    def __init__(self, routes: dict, latency: float = 0.0):
+        self.routes = routes
+        self.latency = latency
+        self.requests: list = []
+        self.connections = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _route(self, path: str):
+        for prefix, response in self.routes.items():
+            if path.startswith(prefix):
+                return response
+        return 404, {"error": "not found"}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = urlsplit(target).path
+                self.requests.append({"method": method, "path": path, "target": target, "body": body})
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                status, payload = self._route(path)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} STUB\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            return
+        finally:
+            writer.close()
+
+
+class SMTPSink:
+    """Serveur SMTP minimal (sans TLS ni AUTH) qui garde les messages reçus."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages: list = []
+        self.connections = 0
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        try:
+            await reply("220 stub ESMTP")
+            while line := await reader.readline():
+                command = line.decode("latin-1").strip().upper()
+                if command.startswith("EHLO"):
+                    await reply("250-stub\r\n250 8BITMIME")
+                elif command == "DATA":
+                    await reply("354 end with <CRLF>.<CRLF>")
+                    data = []
+                    while (chunk := await reader.readline()) not in (b".\r\n", b""):
+                        data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages.append(b"".join(data))
+                    await reply("250 queued")
+                elif command == "QUIT":
+                    await reply("221 bye")
+                    return
+                else:
+                    # HELO, MAIL FROM, RCPT TO, RSET, NOOP
+                    await reply("250 ok")
+        except (ConnectionError, asyncio.CancelledError):
+            return
+        finally:
+            writer.close()
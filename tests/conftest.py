@@ -0,0 +1,37 @@
+"""
+Tests hors ligne : SQLite temporaire, fournisseur LLM « fake », aucune clé
+réelle ni réseau. L'environnement est fixé avant l'import de l'application.
+
+    python -m pytest -q
+"""
+import asyncio
+import os
+import tempfile
+
+_db_file = os.path.join(tempfile.mkdtemp(), "tests.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_file}"
+os.environ["LLM_PROVIDERS"] = "fake"
+for _key in ("GROQ_API_KEY", "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "KKIAPAY_PUBLIC_KEY", "KKIAPAY_PRIVATE_KEY"):
+    os.environ.setdefault(_key, "test")
+os.environ.setdefault("KKIAPAY_SECRET_KEY", "test-secret")
+os.environ.setdefault("ADMIN_API_TOKEN", "test-admin-token")
+os.environ.setdefault("MAILGUN_WEBHOOK_SIGNING_KEY", "test-mailgun-key")
+os.environ.setdefault("EMAIL_WEBHOOK_SECRET", "test-email-secret")
+
+import pytest  # noqa: E402
+
+from app.database import init_db, dispose_engines  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Exécute une coroutine dans une boucle neuve, schéma créé, pools libérés à la fin."""
+    def runner(coro_fn, *args):
+        async def main():
+            try:
+                await init_db()
+                return await coro_fn(*args)
+            finally:
+                await dispose_engines()
+        return asyncio.run(main())
+    return runner
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from app.database import AsyncSessionLocal
+from app.models_db import Payment
+from app.services.admission import AdmissionController, PLAN_MONTHLY_QUOTAS, QUOTA_EXCEEDED
+from app.services.payment_service import PLANS
+
+
+def _controller() -> AdmissionController:
+    # Débit et délestage neutralisés : seul le quota peut refuser
+    return AdmissionController(enabled=True, max_backlog=10_000, rate_per_minute=600_000, burst=10_000,
+                               flush_interval=60, cache_ttl=60, max_tracked=100)
+
+
+def test_starter_plan_is_refused_past_its_monthly_quota(run):
+    quota = PLAN_MONTHLY_QUOTAS["starter"]
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            db.add(Payment(transaction_id="tx-quota", user_id="starter-user", amount=PLANS["starter"],
+                           status="SUCCESS", created_at=datetime.utcnow()))
+            await db.commit()
+            controller = _controller()
+            admitted = [await controller.check(db, "starter-user", "whatsapp") for _ in range(quota)]
+            assert admitted == [None] * quota
+            assert await controller.check(db, "starter-user", "web") == QUOTA_EXCEEDED
+            assert controller.upgrade_for("starter-user") == "pro"
+
+    run(scenario)
+
+
+def test_prospects_without_plan_are_unlimited(run):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            controller = _controller()
+            results = [await controller.check(db, "prospect", "whatsapp") for _ in range(PLAN_MONTHLY_QUOTAS["starter"] + 50)]
+            assert set(results) == {None}
+
+    run(scenario)
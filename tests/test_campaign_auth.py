@@ -0,0 +1,31 @@
+import httpx
+
+from app.main import app
+from app.security import ADMIN_API_TOKEN
+
+CAMPAIGN = {"name": "relance", "stages": ["presentation"], "channels": ["whatsapp"], "template": "Bonjour", "start": False}
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def test_campaign_endpoints_require_admin_token(run):
+    async def scenario():
+        async with _client() as client:
+            response = await client.post("/api/campaigns/", json=CAMPAIGN)
+            assert response.status_code == 401
+            response = await client.post("/api/campaigns/", json=CAMPAIGN, headers={"X-Admin-Token": "mauvais"})
+            assert response.status_code == 403
+
+            response = await client.post("/api/campaigns/", json=CAMPAIGN, headers={"X-Admin-Token": ADMIN_API_TOKEN})
+            assert response.status_code == 200
+            campaign_id = response.json()["id"]
+            for action in ("pause", "resume"):
+                assert (await client.post(f"/api/campaigns/{campaign_id}/{action}")).status_code == 401
+            assert (await client.get(f"/api/campaigns/{campaign_id}")).status_code == 401
+            # Création sans démarrage : rien n'a été lancé
+            response = await client.get(f"/api/campaigns/{campaign_id}", headers={"X-Admin-Token": ADMIN_API_TOKEN})
+            assert response.json()["status"] == "pending"
+
+    run(scenario)
@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models_db import Campaign, CampaignDelivery, Conversation, Message
+from app.services import campaign_service
+from app.services.campaign_service import campaigns
+
+
+async def _conversation(db, user_id: str, channel: str, last_inbound: timedelta) -> Conversation:
+    now = datetime.utcnow()
+    conversation = Conversation(user_id=user_id, channel=channel, stage="presentation",
+                                created_at=now - timedelta(days=10), updated_at=now - timedelta(days=8))
+    db.add(conversation)
+    await db.flush()
+    db.add(Message(conversation_id=conversation.id, role="user", content="Bonjour", channel=channel, created_at=now - last_inbound))
+    return conversation
+
+
+async def _run_campaign(db, **fields) -> dict:
+    campaign = Campaign(name="relance", stages="presentation", channels="whatsapp,messenger",
+                        cutoff=datetime.utcnow() - timedelta(days=7), template="Bonjour {user_id}", **fields)
+    db.add(campaign)
+    await db.commit()
+    await campaigns._run(campaign.id)
+    result = await db.execute(
+        select(Conversation.user_id, CampaignDelivery.status, CampaignDelivery.error)
+        .join(Conversation, Conversation.id == CampaignDelivery.conversation_id)
+        .where(CampaignDelivery.campaign_id == campaign.id)
+    )
+    return {user_id: (status, error) for user_id, status, error in result.all()}
+
+
+def test_campaign_respects_24h_window(run, monkeypatch):
+    sent = []
+
+    async def whatsapp_text(to, text):
+        sent.append(("whatsapp", to, text))
+        return True
+
+    async def whatsapp_template(to, content_sid, variables):
+        sent.append(("template", to, content_sid, variables))
+        return True
+
+    async def messenger(to, text, tag=None):
+        sent.append(("messenger", to, tag))
+        return True
+
+    monkeypatch.setattr(campaign_service, "send_whatsapp_message", whatsapp_text)
+    monkeypatch.setattr(campaign_service, "send_whatsapp_template", whatsapp_template)
+    monkeypatch.setattr(campaign_service, "send_messenger_message", messenger)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await _conversation(db, "+22900000001", "whatsapp", timedelta(hours=2))
+            await _conversation(db, "+22900000002", "whatsapp", timedelta(days=3))
+            await _conversation(db, "psid-recent", "messenger", timedelta(hours=2))
+            await _conversation(db, "psid-old", "messenger", timedelta(days=3))
+            await db.commit()
+
+            deliveries = await _run_campaign(db)
+            assert deliveries["+22900000001"][0] == "sent"
+            assert deliveries["psid-recent"][0] == "sent"
+            for user_id in ("+22900000002", "psid-old"):
+                status, error = deliveries[user_id]
+                assert status == "skipped" and "24 h" in error
+            assert sorted(entry[:2] for entry in sent) == [("messenger", "psid-recent"), ("whatsapp", "+22900000001")]
+
+            sent.clear()
+            deliveries = await _run_campaign(
+                db, whatsapp_content_sid="HX123", whatsapp_content_variables=json.dumps({"1": "{user_id}"}),
+                messenger_tag="ACCOUNT_UPDATE"
+            )
+            # Les conversations relancées par la première campagne sont de nouveau actives : hors cible
+            assert deliveries == {"+22900000002": ("sent", None), "psid-old": ("sent", None)}
+            assert sorted(sent, key=str) == [
+                ("messenger", "psid-old", "ACCOUNT_UPDATE"),
+                ("template", "+22900000002", "HX123", {"1": "+22900000002"}),
+            ]
+
+    run(scenario)
@@ -0,0 +1,44 @@
+import asyncio
+import hashlib
+import hmac
+import time
+
+import httpx
+
+from app.main import app
+from app.services.email_parser import EMAIL_WEBHOOK_SECRET, MAILGUN_WEBHOOK_SIGNING_KEY
+
+# Réponse automatique : authentifiée, elle est acceptée puis ignorée (aucun envoi, aucune file)
+EMAIL = {"from": "Client <client@example.com>", "subject": "Absence", "text": "Je suis absent", "auto-submitted": "auto-replied"}
+
+
+def _mailgun(timestamp: int = None, key: str = MAILGUN_WEBHOOK_SIGNING_KEY) -> dict:
+    timestamp = str(timestamp or int(time.time()))
+    token = "a" * 50
+    signature = hmac.new(key.encode(), f"{timestamp}{token}".encode(), hashlib.sha256).hexdigest()
+    return {"timestamp": timestamp, "token": token, "signature": signature}
+
+
+def _post(data: dict, **kwargs) -> httpx.Response:
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/webhooks/email", data=data, **kwargs)
+    return asyncio.run(main())
+
+
+def test_unauthenticated_email_is_rejected():
+    assert _post(EMAIL).status_code == 401
+
+
+def test_invalid_credentials_are_rejected():
+    assert _post({**EMAIL, **_mailgun(key="autre-cle")}).status_code == 403
+    assert _post({**EMAIL, **_mailgun(timestamp=int(time.time()) - 3600)}).status_code == 403
+    assert _post(EMAIL, auth=("pulsai", "mauvais")).status_code == 403
+    assert _post(EMAIL, params={"token": "mauvais"}).status_code == 403
+
+
+def test_authenticated_email_is_accepted():
+    for kwargs in ({"data": {**EMAIL, **_mailgun()}}, {"data": EMAIL, "auth": ("pulsai", EMAIL_WEBHOOK_SECRET)},
+                   {"data": EMAIL, "params": {"token": EMAIL_WEBHOOK_SECRET}}):
+        response = _post(kwargs.pop("data"), **kwargs)
+        assert response.status_code == 200 and response.json() == {"status": "ignored"}
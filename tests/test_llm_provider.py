@@ -0,0 +1,18 @@
+import pytest
+
+from app.services.llm_provider import LLMProvider, FakeProvider
+
+
+def test_incomplete_provider_fails_at_instantiation():
+    class CompleteOnly(LLMProvider):
+        name = "incomplet"
+
+        async def _complete(self, system, messages, max_tokens, temperature) -> str:
+            return ""
+
+    with pytest.raises(TypeError):
+        CompleteOnly("modele", concurrency=1, timeout=1.0)
+
+
+def test_builtin_providers_implement_the_interface():
+    FakeProvider("fake", concurrency=1, timeout=1.0)
@@ -0,0 +1,33 @@
+import logging
+import uuid
+
+from app.logging_config import ContextFilter, redact
+
+
+def _filtered(msg: str, **extra) -> logging.LogRecord:
+    record = logging.makeLogRecord({"msg": msg, "levelno": logging.INFO, **extra})
+    assert ContextFilter().filter(record)
+    return record
+
+
+def test_uuid_passes_through_unchanged():
+    conversation_id = "550e8400-e29b-41d4-a716-446655440000"
+    assert redact(conversation_id) == conversation_id
+    record = _filtered(f"tour traité {conversation_id}", conversation=conversation_id, user=str(uuid.UUID(conversation_id)))
+    assert conversation_id in record.msg
+    assert record.conversation == conversation_id
+    assert record.user == conversation_id
+
+
+def test_phone_numbers_and_emails_are_masked():
+    assert redact("envoi à whatsapp:+22959085540") == "envoi à whatsapp:***40"
+    assert redact("appel du +229 59 08 55 40") == "appel du ***40"
+    assert redact("contact jean.dupont@example.com") == "contact j***@example.com"
+    # Montants et compteurs lisibles dans le texte libre
+    assert redact("paiement 29900 FCFA, 1234567 octets") == "paiement 29900 FCFA, 1234567 octets"
+
+
+def test_identity_fields_mask_bare_numbers():
+    record = _filtered("message envoyé", user="1234567890123456", sender="whatsapp:+229 59 08 55 40")
+    assert record.user == "***56"
+    assert record.sender == "whatsapp:***40"
@@ -0,0 +1,53 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import messenger_service
+
+
+def _send_with(monkeypatch, outcomes: list) -> tuple:
+    """Envoie un message contre un faux serveur Graph API qui répond `outcomes` dans l'ordre ; retourne (succès, appels)."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome
+        return httpx.Response(status, headers=headers, json={"message_id": "m1"} if status == 201 else {})
+
+    monkeypatch.setattr(messenger_service, "_backoff_delay", lambda attempt, retry_after=None: 0)
+
+    async def main():
+        messenger_service._client = httpx.AsyncClient(base_url="https://graph.test", transport=httpx.MockTransport(handler))
+        try:
+            return await messenger_service.send_messenger_message("1234567890", "Bonjour")
+        finally:
+            await messenger_service.close_graph_client()
+
+    return asyncio.run(main()), len(calls)
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.ReadTimeout("timeout"),
+    (500, {}),
+    (502, {}),
+    (503, {}),
+])
+def test_uncertain_failures_are_not_retried(monkeypatch, failure):
+    sent, calls = _send_with(monkeypatch, [failure, (201, {})])
+    assert (sent, calls) == (False, 1)
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.ConnectError("refused"),
+    httpx.ConnectTimeout("timeout"),
+    httpx.PoolTimeout("pool"),
+    (429, {}),
+    (503, {"Retry-After": "1"}),
+])
+def test_rejected_requests_are_retried(monkeypatch, failure):
+    sent, calls = _send_with(monkeypatch, [failure, (201, {})])
+    assert (sent, calls) == (True, 2)
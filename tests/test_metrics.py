@@ -0,0 +1,19 @@
+import pytest
+
+from app.services.metrics import Counter, GaugeFunc, _Metric
+
+
+def test_metric_without_series_type_fails_at_instantiation():
+    class Incomplete(_Metric):
+        kind = "counter"
+
+    with pytest.raises(TypeError):
+        Incomplete("pulsai_test_incomplete", "test")
+
+
+def test_metrics_render_prometheus_text():
+    counter = Counter("pulsai_test_total", "test", ["channel"])
+    counter.labels("web").inc()
+    gauge = GaugeFunc("pulsai_test_depth", "test", ["queue"], lambda: {"payment": 3})
+    assert 'pulsai_test_total{channel="web"} 1' in counter.render()
+    assert gauge.render() == ["# HELP pulsai_test_depth test", "# TYPE pulsai_test_depth gauge", 'pulsai_test_depth{queue="payment"} 3']
@@ -0,0 +1,91 @@
+import hashlib
+import hmac
+import json
+
+import httpx
+from sqlalchemy import select
+
+from app.main import app
+from app.database import AsyncSessionLocal
+from app.models_db import Conversation, Payment
+from app.routers import payment
+from app.services.conversation_service import get_or_create_conversation
+from app.services.payment_service import KKIAPAY_SECRET_KEY
+
+
+def _signed(event: dict) -> dict:
+    body = json.dumps(event).encode()
+    signature = hmac.new(KKIAPAY_SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+    return {"content": body, "headers": {"x-kkiapay-signature": signature, "content-type": "application/json"}}
+
+
+async def _deliver(client: httpx.AsyncClient, event: dict) -> dict:
+    await payment.payment_queue.start()
+    try:
+        response = await client.post("/api/payment/webhook", **_signed(event))
+        assert response.status_code == 200
+        return response.json()
+    finally:
+        # Vide la file : le pipeline du paiement est terminé au retour
+        await payment.payment_queue.stop()
+
+
+async def _state(user_id: str, transaction_id: str):
+    async with AsyncSessionLocal() as db:
+        stage = (await db.execute(select(Conversation.stage).where(Conversation.user_id == user_id))).scalar()
+        row = (await db.execute(select(Payment).where(Payment.transaction_id == transaction_id))).scalar()
+        return getattr(stage, "value", stage), row
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def test_redelivery_after_pipeline_failure_closes_sale(run, monkeypatch):
+    user_id, transaction_id = "pay-retry", "tx-retry"
+    event = {"transactionId": transaction_id, "status": "SUCCESS", "amount": 29900, "data": user_id}
+    close_sale = payment.close_sale
+    calls = []
+
+    async def flaky_close_sale(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("base indisponible")
+        return await close_sale(*args, **kwargs)
+
+    monkeypatch.setattr(payment, "close_sale", flaky_close_sale)
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await get_or_create_conversation(db, user_id, "web")
+        async with _client() as client:
+            await _deliver(client, event)
+            stage, row = await _state(user_id, transaction_id)
+            assert stage != "completed" and row.processed_at is None
+
+            assert (await _deliver(client, event)) == {"received": True}
+            stage, row = await _state(user_id, transaction_id)
+            assert stage == "completed" and row.processed_at is not None
+
+            assert (await _deliver(client, event))["duplicate"] is True
+        assert len(calls) == 2
+
+    run(scenario)
+
+
+def test_pending_then_success_closes_sale(run):
+    user_id, transaction_id = "pay-pending", "tx-pending"
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await get_or_create_conversation(db, user_id, "web")
+        async with _client() as client:
+            await _deliver(client, {"transactionId": transaction_id, "status": "PENDING", "amount": 9900, "data": user_id})
+            stage, row = await _state(user_id, transaction_id)
+            assert stage == "greeting" and row.status == "PENDING" and row.processed_at is None
+
+            await _deliver(client, {"transactionId": transaction_id, "status": "SUCCESS", "amount": 9900, "data": user_id})
+            stage, row = await _state(user_id, transaction_id)
+            assert stage == "completed" and row.status == "SUCCESS" and row.processed_at is not None
+
+    run(scenario)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import whatsapp_service
+
+
+def _send_with(monkeypatch, outcomes: list) -> tuple:
+    """Envoie un message contre un faux Twilio qui répond `outcomes` dans l'ordre ; retourne (succès, appels)."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome
+        return httpx.Response(status, headers=headers, json={"sid": "SM1"} if status == 201 else {})
+
+    monkeypatch.setattr(whatsapp_service, "_backoff_delay", lambda attempt, retry_after=None: 0)
+
+    async def main():
+        whatsapp_service._client = httpx.AsyncClient(base_url="https://twilio.test", transport=httpx.MockTransport(handler))
+        try:
+            return await whatsapp_service.send_whatsapp_message("+22900000000", "Bonjour")
+        finally:
+            await whatsapp_service.close_twilio_client()
+
+    return asyncio.run(main()), len(calls)
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.ReadTimeout("timeout"),
+    (500, {}),
+    (502, {}),
+    (503, {}),
+])
+def test_uncertain_failures_are_not_retried(monkeypatch, failure):
+    sent, calls = _send_with(monkeypatch, [failure, (201, {})])
+    assert (sent, calls) == (False, 1)
+
+
+@pytest.mark.parametrize("failure", [
+    httpx.ConnectError("refused"),
+    httpx.ConnectTimeout("timeout"),
+    httpx.PoolTimeout("pool"),
+    (429, {}),
+    (503, {"Retry-After": "1"}),
+])
+def test_rejected_requests_are_retried(monkeypatch, failure):
+    sent, calls = _send_with(monkeypatch, [failure, (201, {})])
+    assert (sent, calls) == (True, 2)
+
+
+def test_template_sends_content_sid_and_variables():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(201, json={"sid": "SM1"})
+
+    async def main():
+        whatsapp_service._client = httpx.AsyncClient(base_url="https://twilio.test", transport=httpx.MockTransport(handler))
+        try:
+            return await whatsapp_service.send_whatsapp_template("+22900000000", "HX123", {"1": "Aïcha"})
+        finally:
+            await whatsapp_service.close_twilio_client()
+
+    assert asyncio.run(main()) is True
+    form = dict(httpx.QueryParams(requests[0].content.decode()))
+    assert form["ContentSid"] == "HX123" and json.loads(form["ContentVariables"]) == {"1": "Aïcha"}
+    assert "Body" not in form